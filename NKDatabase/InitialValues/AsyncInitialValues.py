@@ -0,0 +1,119 @@
+from collections.abc import Iterable
+from typing import Optional
+
+from psycopg.rows import dict_row
+from psycopg_pool import PoolTimeout
+
+from NKDatabase.InitialValues.ConfigSnapshot import open_snapshot
+from NKDatabase.InitialValues.InitialValues import (
+    Configuration,
+    ConfigurationModel,
+    configs_from_rows,
+    get_parameter_value,
+)
+from NKDatabase.NKPostgres.AsyncPostgreSQL import fetch_query, pooled_connection, select_with_conditions
+
+
+async def get_unique_app_names(ini_file: str = "database.ini") -> set[str]:
+    """
+    Get all unique app names from the database, see InitialValues.get_unique_app_names
+    """
+    try:
+        async with pooled_connection(ini_file) as connection:
+            results = await fetch_query(connection, "SELECT DISTINCT id FROM public.nkinitvalues")
+            return set([result[0] for result in results])
+    except PoolTimeout as error:
+        raise ConnectionError("Failed to connect to the database") from error
+
+
+async def app_name_exists(appname: str, ini_file: str = "database.ini") -> bool:
+    """
+    Check if an app has values in the database, see InitialValues.app_name_exists
+    """
+    try:
+        async with pooled_connection(ini_file) as connection:
+            results = await fetch_query(
+                connection,
+                "SELECT EXISTS (SELECT 1 FROM public.nkinitvalues WHERE id = %s)",
+                (appname,),
+            )
+            return results[0][0]
+    except PoolTimeout as error:
+        raise ConnectionError("Failed to connect to the database") from error
+
+
+async def get_config(appname: str = "", debugging: bool = False, ini_file: str = "database.ini") -> dict:
+    """
+    Purpose:
+    Get constants for application, see InitialValues.get_config
+    """
+    if appname is not None and len(appname) > 0:
+        constants = {}
+        try:
+            async with pooled_connection(ini_file) as connection:
+                where_conditions = {"id": appname, "debugmode": debugging}
+                rows = await select_with_conditions(connection, "public", "nkinitvalues", where_conditions)
+        except PoolTimeout as error:
+            raise ConnectionError("Failed to connect to the database") from error
+        for row in rows:
+            constants[row["name"]] = get_parameter_value(row)
+        return constants
+    return {}
+
+
+async def get_configs(
+    appnames: Iterable[str], debug_modes: Iterable[bool] = (False, True), ini_file: str = "database.ini"
+) -> dict[str, dict[bool, dict]]:
+    """
+    Purpose:
+    Get constants for many applications in one query, see InitialValues.get_configs
+    """
+    appnames = list(appnames)
+    debug_modes = list(debug_modes)
+    try:
+        async with pooled_connection(ini_file) as connection:
+            async with connection.cursor(row_factory=dict_row) as cursor:
+                await cursor.execute(
+                    "SELECT id, debugmode, name, type_id, value FROM public.nkinitvalues "
+                    "WHERE id = ANY(%s) AND debugmode = ANY(%s)",
+                    (appnames, debug_modes),
+                )
+                rows = await cursor.fetchall()
+    except PoolTimeout as error:
+        raise ConnectionError("Failed to connect to the database") from error
+    return configs_from_rows(rows, appnames, debug_modes)
+
+
+async def load_configuration(
+    appname: str = "",
+    debugging: bool = False,
+    named_attributes: bool = False,
+    ini_file: str = "database.ini",
+    snapshot_file: Optional[str] = None,
+    snapshot_max_age: Optional[float] = None,
+) -> Configuration:
+    """
+    Purpose:
+    Create a Configuration without blocking the event loop.
+    Input is validated like Configuration does, an unknown app raises ValueError.
+    With snapshot_file the values come from the snapshot when it has the app and is not older
+    than snapshot_max_age, see Configuration
+
+    Usage:
+    config = await load_configuration("nk-edoc-geocoding", ini_file="database.ini")
+    """
+    ConfigurationModel.model_validate(
+        {"appname": appname, "debugging": debugging, "ini_file": ini_file},
+        context={"check_app_name": False},
+    )
+    snapshot = open_snapshot(snapshot_file, snapshot_max_age) if snapshot_file else None
+    configs = snapshot.get(appname, debugging) if snapshot is not None else None
+    if configs is not None:
+        return Configuration.from_values(appname, configs, debugging, named_attributes, ini_file)
+
+    if not await app_name_exists(appname, ini_file):
+        allowed = await get_unique_app_names(ini_file)
+        raise ValueError(f"Invalid app_name '{appname}'. Must be one of: {sorted(allowed)}")
+
+    configs = await get_config(appname=appname, debugging=debugging, ini_file=ini_file)
+    return Configuration.from_values(appname, configs, debugging, named_attributes, ini_file)
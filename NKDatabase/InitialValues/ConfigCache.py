@@ -0,0 +1,192 @@
+import threading
+import time
+from typing import Callable, Optional
+
+import psycopg
+import psycopg.sql as sql
+
+from NKDatabase.NKPostgres.PostgreSQL import connection_kwargs, load_config
+
+NOTIFY_CHANNEL = "nkinitvalues_changed"
+
+# Installs a trigger sending the changed app name on NOTIFY_CHANNEL, an empty payload means all apps
+NOTIFY_TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION public.nkinitvalues_notify() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        PERFORM pg_notify('nkinitvalues_changed', '');
+    ELSIF TG_OP = 'INSERT' THEN
+        PERFORM pg_notify('nkinitvalues_changed', NEW.id);
+    ELSE
+        PERFORM pg_notify('nkinitvalues_changed', OLD.id);
+        IF TG_OP = 'UPDATE' AND NEW.id IS DISTINCT FROM OLD.id THEN
+            PERFORM pg_notify('nkinitvalues_changed', NEW.id);
+        END IF;
+    END IF;
+    RETURN NULL;
+END
+$$;
+DROP TRIGGER IF EXISTS nkinitvalues_notify ON public.nkinitvalues;
+CREATE TRIGGER nkinitvalues_notify AFTER INSERT OR UPDATE OR DELETE ON public.nkinitvalues
+    FOR EACH ROW EXECUTE FUNCTION public.nkinitvalues_notify();
+DROP TRIGGER IF EXISTS nkinitvalues_notify_truncate ON public.nkinitvalues;
+CREATE TRIGGER nkinitvalues_notify_truncate AFTER TRUNCATE ON public.nkinitvalues
+    FOR EACH STATEMENT EXECUTE FUNCTION public.nkinitvalues_notify();
+"""
+
+
+def install_notify_trigger(conn: psycopg.Connection):
+    """
+    Purpose:
+    Install the trigger on public.nkinitvalues used by ConfigCache.listen, needs owner rights on the table
+
+    Argument:
+    conn -->    connection to the database holding nkinitvalues
+    """
+    conn.execute(NOTIFY_TRIGGER_SQL)
+    conn.commit()
+
+
+class ConfigCache:
+    """
+    Purpose:
+    In process cache of configurations and app names with expiry after ttl seconds.
+    Entries of an app are dropped as soon as a notification arrives when listen() is running.
+    With read replicas the loaders must read the primary, a refill right after a notification
+    could otherwise cache the old values of a lagging replica.
+    A load that was running while invalidate() was called returns its values, but does not cache them
+
+    Contains:
+    ttl -> seconds an entry is served from memory
+    hits, misses -> lookup counters
+    """
+
+    def __init__(
+        self,
+        load_values: Callable[..., dict],
+        load_app_names: Callable[[str], set[str]],
+        ttl: float = 300.0,
+    ):
+        """
+        Argument:
+        load_values -->     called as load_values(appname=, debugging=, ini_file=) on a miss
+        load_app_names -->  called as load_app_names(ini_file) on a miss
+        ttl -->             seconds an entry is valid
+        """
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._load_values = load_values
+        self._load_app_names = load_app_names
+        self._values: dict[tuple[str, bool, str], tuple[float, dict]] = {}
+        self._app_names: dict[str, tuple[float, set[str]]] = {}
+        self._lock = threading.Lock()
+        # bumped by invalidate, a load only stores its result when the generation did not change meanwhile
+        self._generation = 0
+        self._listeners: list[tuple[threading.Thread, threading.Event]] = []
+
+    def get_config(self, appname: str, debugging: bool = False, ini_file: str = "database.ini") -> dict:
+        """
+        Purpose:
+        Get the constants of an app, see InitialValues.get_config
+
+        returns a copy of the cached dict
+        """
+        key = (appname, debugging, ini_file)
+        entry = self._values.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return dict(entry[1])
+
+        self.misses += 1
+        generation = self._generation
+        values = self._load_values(appname=appname, debugging=debugging, ini_file=ini_file)
+        with self._lock:
+            if generation == self._generation:
+                self._values[key] = (time.monotonic() + self.ttl, values)
+        return dict(values)
+
+    def get_unique_app_names(self, ini_file: str = "database.ini") -> set[str]:
+        """
+        Purpose:
+        Get all unique app names, see InitialValues.get_unique_app_names
+
+        returns a copy of the cached set
+        """
+        entry = self._app_names.get(ini_file)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return set(entry[1])
+
+        self.misses += 1
+        generation = self._generation
+        names = self._load_app_names(ini_file)
+        with self._lock:
+            if generation == self._generation:
+                self._app_names[ini_file] = (time.monotonic() + self.ttl, names)
+        return set(names)
+
+    def invalidate(self, appname: Optional[str] = None):
+        """
+        Purpose:
+        Drop cached entries
+
+        Argument:
+        appname -->     drop the entries of this app only, all entries when None or empty
+        """
+        with self._lock:
+            self._generation += 1
+            self._app_names.clear()
+            if appname:
+                for key in [key for key in self._values if key[0] == appname]:
+                    del self._values[key]
+            else:
+                self._values.clear()
+
+    def listen(self, ini_file: str = "database.ini", section: str = "postgresql", channel: str = NOTIFY_CHANNEL):
+        """
+        Purpose:
+        Start a daemon thread that invalidates entries when the nkinitvalues trigger fires,
+        see install_notify_trigger. The thread has its own connection and reconnects after errors;
+        everything is invalidated after a reconnect because notifications may have been missed
+
+        Argument:
+        ini_file -->    File containing connection values
+        section -->     Section name of ini file
+        channel -->     Notification channel
+        """
+        config = connection_kwargs(load_config(filename=ini_file, section=section))
+        stop = threading.Event()
+        thread = threading.Thread(
+            target=self._listen, args=(config, channel, stop), name=f"ConfigCache-{channel}", daemon=True
+        )
+        self._listeners.append((thread, stop))
+        thread.start()
+
+    def stop(self):
+        """
+        Purpose:
+        Stop the listener threads started by listen()
+        """
+        listeners, self._listeners = self._listeners, []
+        for _, stop in listeners:
+            stop.set()
+        for thread, _ in listeners:
+            thread.join()
+
+    def _listen(self, config: dict, channel: str, stop: threading.Event):
+        backoff = 1.0
+        while not stop.is_set():
+            try:
+                with psycopg.connect(**config, autocommit=True) as conn:
+                    conn.execute(sql.SQL("LISTEN {}").format(sql.Identifier(channel)))
+                    self.invalidate()
+                    backoff = 1.0
+                    while not stop.is_set():
+                        for notify in conn.notifies(timeout=1.0):
+                            self.invalidate(notify.payload)
+            except psycopg.Error as error:
+                print(f"Error listening for {channel}: {error}")
+                self.invalidate()
+                stop.wait(backoff)
+                backoff = min(backoff * 2, 60.0)
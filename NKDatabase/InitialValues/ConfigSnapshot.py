@@ -0,0 +1,336 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from collections.abc import Iterable, Mapping
+from typing import Callable, Optional
+
+from NKDatabase.InitialValues.ValueDecoders import decode_row
+from NKDatabase.NKFile.fileWriter import write_atomic
+
+MAGIC = b"NKCFGSNP"
+SNAPSHOT_VERSION = 3
+
+# magic, version, number of entries, created and checked (unix times), size of the index
+HEADER = struct.Struct("<8sIIddQ")
+# checked is rewritten in place when a refresh finds the constants unchanged
+CHECKED = struct.Struct("<d")
+CHECKED_OFFSET = struct.calcsize("<8sIId")
+# debugmode, length of the app name, offset and length of the JSON rows, followed by the app name
+INDEX_ENTRY = struct.Struct("<?HQQ")
+
+_snapshots: dict[str, "ConfigSnapshot"] = {}
+_snapshots_lock = threading.Lock()
+
+
+def encode_snapshot(
+    rows: Iterable[Mapping],
+    appnames: Iterable[str] = (),
+    debug_modes: Iterable[bool] = (False, True),
+    created: Optional[float] = None,
+) -> bytes:
+    """
+    Purpose:
+    Encode nkinitvalues rows in the snapshot format read by ConfigSnapshot: a header, an index of
+    (app, debugmode) -> position and the (name, type_id, value) rows of every entry as JSON.
+    Only data is stored, the values are decoded on lookup like get_config decodes them.
+    Entries and rows are sorted, so unchanged values give an unchanged body
+
+    Argument:
+    rows -->        rows with the keys id, debugmode, name, type_id and value, e.g. from InitialValues.get_config_rows
+    appnames -->    apps that get an empty entry for every debug mode when they have no rows
+    debug_modes --> debugmode values of the empty entries
+    created -->     unix time stored in the header as created and checked, default now
+    """
+    grouped: dict[tuple[str, bool], list] = {(appname, bool(debugging)): [] for appname in appnames for debugging in debug_modes}
+    for row in rows:
+        grouped.setdefault((row["id"], bool(row["debugmode"])), []).append([row["name"], row["type_id"], row["value"]])
+
+    entries = []
+    for (appname, debugging), values in sorted(grouped.items()):
+        payload = json.dumps(sorted(values, key=lambda value: value[0]), ensure_ascii=False, separators=(",", ":"))
+        entries.append((appname.encode("utf-8"), debugging, payload.encode("utf-8")))
+
+    index_size = sum(INDEX_ENTRY.size + len(name) for name, _, _ in entries)
+    offset = HEADER.size + index_size
+    index = bytearray()
+    for name, debugging, payload in entries:
+        index += INDEX_ENTRY.pack(debugging, len(name), offset, len(payload))
+        index += name
+        offset += len(payload)
+
+    created = time.time() if created is None else created
+    header = HEADER.pack(MAGIC, SNAPSHOT_VERSION, len(entries), created, created, index_size)
+    return b"".join([header, bytes(index), *(payload for _, _, payload in entries)])
+
+
+def write_snapshot(
+    filename: str,
+    rows: Iterable[Mapping],
+    appnames: Iterable[str] = (),
+    debug_modes: Iterable[bool] = (False, True),
+    only_if_changed: bool = False,
+) -> bool:
+    """
+    Purpose:
+    Write a snapshot file. The file is replaced atomically, processes that have the old file open
+    keep reading it until they notice the new one
+
+    Argument:
+    filename -->        snapshot file
+    rows, appnames, debug_modes --> see encode_snapshot
+    only_if_changed --> when the rows are the same as in the existing file, only its checked time is updated
+
+    returns True when the file was written
+    """
+    data = encode_snapshot(rows, appnames, debug_modes)
+    if only_if_changed:
+        try:
+            with open(filename, "r+b") as f:
+                if f.read()[HEADER.size:] == data[HEADER.size:]:
+                    # readers map the file, they see the new time without opening it again
+                    f.seek(CHECKED_OFFSET)
+                    f.write(CHECKED.pack(time.time()))
+                    return False
+        except OSError:
+            pass
+
+    write_atomic(filename, data, fsync=True)
+    return True
+
+
+class ConfigSnapshot:
+    """
+    Purpose:
+    Read-only view of a snapshot file written by write_snapshot. The file is memory mapped, so processes
+    on a host share its pages, and only the index is read on open; the rows of an app are
+    decoded when asked for. The file holds data only, reading it never runs code from it
+
+    Argument:
+    filename -->    snapshot file
+
+    Contains:
+    created -> unix time the constants were written
+    checked -> unix time a refresh last found them current, see write_snapshot
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        with open(filename, "rb") as f:
+            self._stat = os.fstat(f.fileno())
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._index = self._read_index()
+        except Exception:
+            self._map.close()
+            raise
+
+    def _read_index(self) -> dict[tuple[str, bool], tuple[int, int]]:
+        if len(self._map) < HEADER.size:
+            raise ValueError(f"{self.filename} is not a config snapshot")
+        magic, version, count, self.created, _, index_size = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.filename} is not a config snapshot")
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version {version} in {self.filename}")
+
+        index = {}
+        position = HEADER.size
+        for _ in range(count):
+            debugging, name_length, offset, length = INDEX_ENTRY.unpack_from(self._map, position)
+            position += INDEX_ENTRY.size
+            appname = self._map[position:position + name_length].decode("utf-8")
+            position += name_length
+            if offset + length > len(self._map):
+                raise ValueError(f"{self.filename} is truncated")
+            index[(appname, debugging)] = (offset, length)
+        if position != HEADER.size + index_size:
+            raise ValueError(f"{self.filename} has a damaged index")
+        return index
+
+    def __len__(self):
+        return len(self._index)
+
+    @property
+    def checked(self) -> float:
+        return CHECKED.unpack_from(self._map, CHECKED_OFFSET)[0]
+
+    def __enter__(self) -> "ConfigSnapshot":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, appname: str, debugging: bool = False) -> Optional[dict]:
+        """
+        Purpose:
+        Get the constants of an app like InitialValues.get_config
+
+        returns a new dict, None when the snapshot has no entry for the app and debugging
+        """
+        position = self._index.get((appname, debugging))
+        if position is None:
+            return None
+        offset, length = position
+        constants = {}
+        for name, type_id, value in json.loads(self._map[offset:offset + length]):
+            # unknown types give None, like get_config
+            known, decoded = decode_row({"type_id": type_id, "value": value})
+            constants[name] = decoded if known else None
+        return constants
+
+    def configs(self) -> dict[str, dict[bool, dict]]:
+        """
+        All entries as app -> debugging -> constants, like InitialValues.get_configs
+        """
+        configs = {}
+        for appname, debugging in self._index:
+            configs.setdefault(appname, {})[debugging] = self.get(appname, debugging)
+        return configs
+
+    def app_names(self) -> set[str]:
+        """
+        The apps in the snapshot, like InitialValues.get_unique_app_names
+        """
+        return {appname for appname, _ in self._index}
+
+    def is_current(self) -> bool:
+        """
+        False when the file was replaced or removed since it was opened.
+        The modification time is not compared, it changes with every update of checked
+        """
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            return False
+        return (stat.st_dev, stat.st_ino, stat.st_size) == (self._stat.st_dev, self._stat.st_ino, self._stat.st_size)
+
+    def close(self):
+        self._map.close()
+
+
+def open_snapshot(filename: str, max_age: Optional[float] = None) -> Optional[ConfigSnapshot]:
+    """
+    Purpose:
+    Get the process wide ConfigSnapshot of a file, opened again when the refresher has replaced the file
+
+    Argument:
+    filename -->    snapshot file
+    max_age -->     seconds since the constants were last found current, an older snapshot is not used,
+                    e.g. when its refresher stopped. None to use a snapshot of any age
+
+    returns None when the file is missing, is not a valid snapshot or is older than max_age
+    """
+    snapshot = _open_snapshot(os.path.abspath(filename))
+    if snapshot is not None and max_age is not None and time.time() - snapshot.checked > max_age:
+        return None
+    return snapshot
+
+
+def _open_snapshot(path: str) -> Optional[ConfigSnapshot]:
+    snapshot = _snapshots.get(path)
+    if snapshot is not None and snapshot.is_current():
+        return snapshot
+
+    with _snapshots_lock:
+        snapshot = _snapshots.get(path)
+        if snapshot is not None and snapshot.is_current():
+            return snapshot
+        if not os.path.exists(path):
+            return None
+        try:
+            snapshot = ConfigSnapshot(path)
+        except (OSError, ValueError) as error:
+            print(f"Error reading config snapshot: {error}")
+            return None
+        # the replaced snapshot is not closed, other threads may still read from it
+        _snapshots[path] = snapshot
+    return snapshot
+
+
+class SnapshotRefresher:
+    """
+    Purpose:
+    Keeps a snapshot file up to date from a daemon thread. The file is only rewritten when the constants
+    changed, otherwise its checked time is updated; when loading fails the old file stays in place,
+    ages and the load is retried with a growing delay
+
+    Argument:
+    filename -->        snapshot file
+    load_rows -->       called without arguments, returns the rows for write_snapshot
+    interval -->        seconds between refreshes
+    appnames, debug_modes --> see encode_snapshot
+
+    Contains:
+    refreshes, failures -> completed and failed refreshes
+    last_refresh -> unix time of the last completed refresh, 0 before the first
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        load_rows: Callable[[], Iterable[Mapping]],
+        interval: float = 60.0,
+        appnames: Iterable[str] = (),
+        debug_modes: Iterable[bool] = (False, True),
+    ):
+        self.filename = filename
+        self.interval = interval
+        self.appnames = list(appnames)
+        self.debug_modes = list(debug_modes)
+        self.refreshes = 0
+        self.failures = 0
+        self.last_refresh = 0.0
+        self._load_rows = load_rows
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def refresh(self) -> bool:
+        """
+        Purpose:
+        Load the rows and write the snapshot once
+
+        returns True when the refresh completed, errors are printed
+        """
+        try:
+            write_snapshot(self.filename, self._load_rows(), self.appnames, self.debug_modes, only_if_changed=True)
+        except Exception as error:
+            self.failures += 1
+            print(f"Error refreshing config snapshot {self.filename}: {error}")
+            return False
+        self.refreshes += 1
+        self.last_refresh = time.time()
+        return True
+
+    def start(self):
+        """
+        Purpose:
+        Start the daemon thread, it refreshes at once and then every interval seconds
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"SnapshotRefresher-{os.path.basename(self.filename)}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Purpose:
+        Stop the thread started by start()
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        backoff = 1.0
+        while not self._stop.is_set():
+            if self.refresh():
+                backoff = 1.0
+                self._stop.wait(self.interval)
+            else:
+                self._stop.wait(min(backoff, self.interval))
+                backoff *= 2
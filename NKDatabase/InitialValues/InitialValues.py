@@ -1,11 +1,18 @@
-from datetime import datetime
-import locale
-from pydantic import BaseModel, model_validator, Field, ConfigDict, StrictBool
-from NKDatabase.NKPostgres.PostgreSQL import (
-    connect,
-    load_config,
-    select_with_conditions,
-)
+from collections.abc import Iterable
+from datetime import datetime, timezone
+from functools import partial
+import json
+import os
+import tempfile
+from typing import Optional
+from psycopg.rows import dict_row
+from pydantic import BaseModel, model_validator, Field, ConfigDict, StrictBool, ValidationInfo
+from psycopg_pool import PoolTimeout
+from NKDatabase.InitialValues.ConfigCache import ConfigCache
+from NKDatabase.InitialValues.ConfigSnapshot import SnapshotRefresher, open_snapshot, write_snapshot
+from NKDatabase.InitialValues.ValueDecoders import decode_row, parse_date  # noqa: F401 re-exported
+from NKDatabase.NKPostgres.PostgreSQL import fetch_query, select_with_conditions
+from NKDatabase.NKPostgres.ReplicaRouter import primary_connection, read_connection
 
 
 class Parameter:
@@ -34,38 +41,57 @@ def get_initial_values(appname: str = "", debugging: bool = False):
     """
 
     if appname is not None and len(appname) > 0:
-        config = load_config()
-        connection = connect(config)
-        if connection:
-            parameters = []
-            #   Select the values from the database
-            where_conditions = {"id": appname, "debugmode": debugging}
-            results = select_with_conditions(
-                connection, "public", "nkinitvalues", where_conditions
-            )
-            for result in results:
-                parameter = get_parameter(result)
-                if parameter:
-                    parameters.append(parameter)
-            return parameters
+        parameters = []
+        try:
+            with read_connection() as connection:
+                #   Select the values from the database
+                where_conditions = {"id": appname, "debugmode": debugging}
+                results = select_with_conditions(
+                    connection, "public", "nkinitvalues", where_conditions
+                )
+        except PoolTimeout as error:
+            raise ConnectionError("Failed to connect to the database") from error
+        for result in results:
+            parameter = get_parameter(result)
+            if parameter:
+                parameters.append(parameter)
+        return parameters
     return None
 
 
-def get_unique_app_names(ini_file: str = "database.ini") -> set[str]:
+def get_unique_app_names(ini_file: str = "database.ini", primary: bool = False) -> set[str]:
     """
-    Get all unique app names from the database
+    Get all unique app names from the database, from a replica unless primary is set
 
     Returns:
         set[str]: A set of all unique app names
     """
-    config = load_config(filename=ini_file)
-    connection = connect(config)
-    if connection:
-        #   Select the values from the database
-        results = select_with_conditions(connection, "public", "nkinitvalues")
-        return set([result["id"] for result in results])
-    else:
-        raise ConnectionError("Failed to connect to the database")
+    try:
+        with (primary_connection if primary else read_connection)(ini_file) as connection:
+            #   Let the server remove the duplicates, only the ids are transferred
+            results = fetch_query(connection, "SELECT DISTINCT id FROM public.nkinitvalues")
+            return set([result[0] for result in results])
+    except PoolTimeout as error:
+        raise ConnectionError("Failed to connect to the database") from error
+
+
+def app_name_exists(appname: str, ini_file: str = "database.ini") -> bool:
+    """
+    Check if an app has values in the database, without reading the table
+
+    Returns:
+        bool: True when at least one row has appname as id
+    """
+    try:
+        with read_connection(ini_file) as connection:
+            results = fetch_query(
+                connection,
+                "SELECT EXISTS (SELECT 1 FROM public.nkinitvalues WHERE id = %s)",
+                (appname,),
+            )
+            return results[0][0]
+    except PoolTimeout as error:
+        raise ConnectionError("Failed to connect to the database") from error
 
 
 def get_parameter(row):
@@ -76,66 +102,15 @@ def get_parameter(row):
     Return a list of Parameter
     """
     if row:
-        match row["type_id"]:
-            case 1:
-                value = str(row["value"])
-            case 2:
-                value = int(row["value"])
-            case 3:
-                value = locale.atof(row["value"])
-            case 4:
-                val = row["value"].lower()
-                if val in ("y", "yes", "t", "true", "on", "1", "ja"):
-                    value = True
-                else:
-                    value = False
-            case 5:
-                value = row["value"].split(",")
-            case 6:
-                vals = row["value"].split(",")
-                value = []
-                for val in vals:
-                    value.append(int(val))
-            case 7:
-                vals = row["value"].split(",")
-                value = []
-                for val in vals:
-                    value.append(locale.atof(val))
-            case 8:
-                value = parse_date(row["value"])
-            case _:
-                return None
+        known, value = decode_row(row)
+        if not known:
+            return None
 
         parameter = Parameter(name=row["name"], value=value)
         return parameter
     return None
 
 
-def parse_date(date_str):
-    """
-    parse_date(date_str)
-    Parses a string to datetime
-
-    Parameters:
-    date_str:   text to convert or parse to datetime
-
-    returns: datetime object
-    if None parse failed
-    """
-
-    date_formats = [
-        "%d-%m-%Y %H:%M:%S",
-        "%Y-%m-%d %H:%M:%S",
-        "%d-%m-%Y",
-    ]  # List of possible date formats
-    for date_format in date_formats:
-        try:
-            return datetime.strptime(date_str, date_format)
-        except ValueError:
-            continue
-    raise ValueError(f"Date format not recognized for date: {date_str}")
-
-
 def get_config(
     appname: str = "", debugging: bool = False, ini_file: str = "database.ini"
 ) -> dict:
@@ -147,24 +122,26 @@ def get_config(
     appname -->  name of application (id in table row)
     debugging --> indicates whether values fetched are for production or debugging.   Default is False
 
-    returns a list of class values containing name and value of contsnats/parameters
+    returns a list of class values containing name and value of contsnats/parameters.
+    Always read on the primary: the values are cached, also after a change notification, and must not lag behind
     """
 
     if appname is not None and len(appname) > 0:
         # print(f'looking up valujes for {appname}')
         constants = {}
-        config = load_config(filename=ini_file)
-        connection = connect(config)
-        if connection:
-            # print(f'connection established')
-            #   Select the values from the database
-            where_conditions = {"id": appname, "debugmode": debugging}
-            rows = select_with_conditions(
-                connection, "public", "nkinitvalues", where_conditions
-            )
-            for row in rows:
-                constants[row["name"]] = get_parameter_value(row)
-            return constants
+        try:
+            with primary_connection(ini_file) as connection:
+                # print(f'connection established')
+                #   Select the values from the database
+                where_conditions = {"id": appname, "debugmode": debugging}
+                rows = select_with_conditions(
+                    connection, "public", "nkinitvalues", where_conditions
+                )
+        except PoolTimeout as error:
+            raise ConnectionError("Failed to connect to the database") from error
+        for row in rows:
+            constants[row["name"]] = get_parameter_value(row)
+        return constants
     return {}
 
 
@@ -174,41 +151,185 @@ def get_parameter_value(row):
     Parameter:
     row -> db record
     Return a list of Parameter
+    Decoders per type_id are in ValueDecoders.DECODERS, add new types with register_decoder
     """
     if row:
-        match row["type_id"]:
-            case 1:
-                value = str(row["value"])
-            case 2:
-                value = int(row["value"])
-            case 3:
-                value = locale.atof(row["value"])
-            case 4:
-                val = row["value"].lower()
-                if val in ("y", "yes", "t", "true", "on", "1", "ja"):
-                    value = True
-                else:
-                    value = False
-            case 5:
-                value = row["value"].split(",")
-            case 6:
-                vals = row["value"].split(",")
-                value = []
-                for val in vals:
-                    value.append(int(val))
-            case 7:
-                vals = row["value"].split(",")
-                value = []
-                for val in vals:
-                    value.append(locale.atof(val))
-            case 8:
-                value = parse_date(row["value"])
-            case _:
-                return None
+        known, value = decode_row(row)
+        if not known:
+            return None
 
         return value
     return None
 
+
+def get_config_rows(
+    appnames: Iterable[str], debug_modes: Iterable[bool] = (False, True), ini_file: str = "database.ini"
+) -> list[dict]:
+    """
+    Purpose:
+    Get the nkinitvalues rows of many applications in a single query
+
+    Argument:
+    appnames -->    names of the applications (id in table row)
+    debug_modes --> debugmode values to include, default both
+    ini_file -->    File containing connection values
+
+    returns the rows as dicts with the keys id, debugmode, name, type_id and value
+    """
+    try:
+        with read_connection(ini_file) as connection:
+            with connection.cursor(row_factory=dict_row) as cursor:
+                cursor.execute(
+                    "SELECT id, debugmode, name, type_id, value FROM public.nkinitvalues "
+                    "WHERE id = ANY(%s) AND debugmode = ANY(%s)",
+                    (list(appnames), list(debug_modes)),
+                )
+                return cursor.fetchall()
+    except PoolTimeout as error:
+        raise ConnectionError("Failed to connect to the database") from error
+
+
+def configs_from_rows(rows: Iterable[dict], appnames: Iterable[str], debug_modes: Iterable[bool]) -> dict[str, dict[bool, dict]]:
+    """
+    Decodes rows into app -> debugmode -> constants, apps without rows get empty dicts like get_config
+    """
+    configs = {appname: {debugging: {} for debugging in debug_modes} for appname in appnames}
+    for row in rows:
+        constants = configs.setdefault(row["id"], {}).setdefault(row["debugmode"], {})
+        constants[row["name"]] = get_parameter_value(row)
+    return configs
+
+
+def get_configs(
+    appnames: Iterable[str], debug_modes: Iterable[bool] = (False, True), ini_file: str = "database.ini"
+) -> dict[str, dict[bool, dict]]:
+    """
+    Purpose:
+    Get constants for many applications with one connection and one query
+
+    Argument:
+    appnames -->    names of the applications (id in table row)
+    debug_modes --> debugmode values to include, default both
+    ini_file -->    File containing connection values
+
+    returns a dict app -> debugging -> constants, the constants are the dicts get_config returns
+    """
+    appnames = list(appnames)
+    debug_modes = list(debug_modes)
+    rows = get_config_rows(appnames, debug_modes, ini_file)
+    return configs_from_rows(rows, appnames, debug_modes)
+
+
+def write_config_snapshot(
+    filename: str, appnames: Iterable[str], debug_modes: Iterable[bool] = (False, True), ini_file: str = "database.ini"
+):
+    """
+    Purpose:
+    Write the nkinitvalues rows of many applications to a JSON file, see read_config_snapshot.
+    The file is replaced atomically, readers never see a half written snapshot
+
+    Argument:
+    filename -->    snapshot file
+    appnames -->    names of the applications (id in table row)
+    debug_modes --> debugmode values to include, default both
+    ini_file -->    File containing connection values
+    """
+    appnames = list(appnames)
+    debug_modes = list(debug_modes)
+    rows = get_config_rows(appnames, debug_modes, ini_file)
+    snapshot = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "appnames": appnames,
+        "debug_modes": debug_modes,
+        "rows": rows,
+    }
+    directory = os.path.dirname(os.path.abspath(filename))
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=directory, delete=False, suffix=".tmp") as f:
+        try:
+            json.dump(snapshot, f, ensure_ascii=False)
+        except Exception:
+            f.close()
+            os.remove(f.name)
+            raise
+    os.replace(f.name, filename)
+
+
+def read_config_snapshot(filename: str) -> dict[str, dict[bool, dict]]:
+    """
+    Purpose:
+    Read a snapshot written by write_config_snapshot without touching the database
+
+    Argument:
+    filename -->    snapshot file
+
+    returns a dict app -> debugging -> constants like get_configs
+    """
+    with open(filename, "r", encoding="utf-8") as f:
+        snapshot = json.load(f)
+    return configs_from_rows(snapshot["rows"], snapshot["appnames"], snapshot["debug_modes"])
+
+
+def refresh_snapshot_file(
+    filename: str,
+    appnames: Optional[Iterable[str]] = None,
+    debug_modes: Iterable[bool] = (False, True),
+    ini_file: str = "database.ini",
+) -> bool:
+    """
+    Purpose:
+    Write the nkinitvalues rows of many applications to a memory mapped snapshot file,
+    see ConfigSnapshot and Configuration(snapshot_file=...). E.g. run from cron next to the services.
+    When the rows did not change only the checked time of the file is updated, see open_snapshot
+
+    Argument:
+    filename -->    snapshot file
+    appnames -->    names of the applications, default every app in nkinitvalues
+    debug_modes --> debugmode values to include, default both
+    ini_file -->    File containing connection values
+
+    returns True when the file was written, False when the rows did not change
+    """
+    appnames = list(get_unique_app_names(ini_file) if appnames is None else appnames)
+    debug_modes = list(debug_modes)
+    rows = get_config_rows(appnames, debug_modes, ini_file)
+    return write_snapshot(filename, rows, appnames, debug_modes, only_if_changed=True)
+
+
+def start_snapshot_refresher(
+    filename: str,
+    appnames: Optional[Iterable[str]] = None,
+    debug_modes: Iterable[bool] = (False, True),
+    ini_file: str = "database.ini",
+    interval: float = 60.0,
+) -> SnapshotRefresher:
+    """
+    Purpose:
+    Keep a snapshot file up to date from a background thread, see refresh_snapshot_file for the arguments.
+    One refresher per host is enough, the services only read the file
+
+    Argument:
+    interval -->    seconds between refreshes
+
+    returns the started SnapshotRefresher, call stop() to end it
+    """
+    appnames = None if appnames is None else list(appnames)
+    debug_modes = list(debug_modes)
+
+    def load_rows() -> list[dict]:
+        names = get_unique_app_names(ini_file) if appnames is None else appnames
+        return get_config_rows(names, debug_modes, ini_file)
+
+    refresher = SnapshotRefresher(filename, load_rows, interval, appnames or (), debug_modes)
+    refresher.start()
+    return refresher
+
+
+# Process wide cache used by Configuration(cached=True),
+# call config_cache.listen(ini_file) to invalidate on changes in nkinitvalues.
+# Refills read the primary, a lagging replica would put the old values back after a notification
+config_cache = ConfigCache(get_config, partial(get_unique_app_names, primary=True))
+
+
 class ConfigurationModel(BaseModel):
     """
     Evaluating input values to the Configuration-class
@@ -217,15 +338,25 @@ class ConfigurationModel(BaseModel):
     appname: str = Field(min_length=5)
     debugging: StrictBool = False
     ini_file: str = Field(default="database.ini")
+    cached: StrictBool = False
 
     @model_validator(mode='after')
-    def app_name_must_be_known(self):
+    def app_name_must_be_known(self, info: ValidationInfo):
         """
-        Validating if the app_name is a valid unique app_name
+        Validating if the app_name is a valid unique app_name.
+        Validating with context={"check_app_name": False} skips the database lookup
         """
         # Check minimum length first
         if len(self.appname) < 5:
             raise ValueError("app_name is too short (min 5 chars).")
+        if info.context and not info.context.get("check_app_name", True):
+            return self
+        if self.cached:
+            if self.appname in config_cache.get_unique_app_names(self.ini_file):
+                return self
+        elif app_name_exists(self.appname, self.ini_file):
+            return self
+        # Only read all app names when the error message needs them
         allowed: set[str] = get_unique_app_names(self.ini_file)
         if self.appname not in allowed:
             raise ValueError(f"Invalid app_name '{self.appname}'. Must be one of: {sorted(allowed)}")
@@ -234,6 +365,11 @@ class ConfigurationModel(BaseModel):
 class Configuration:
     """
     Class to encapsulate the configuration settings for the entire application.
+    With cached=True app names and values are served from config_cache.
+    The values are read from the replicas when the ini section sets replica_hosts, see ReplicaRouter.
+    With snapshot_file the values come from a snapshot file when it has the app, without touching
+    the database, see refresh_snapshot_file. Otherwise, or when the snapshot was last checked more than
+    snapshot_max_age seconds ago, they are read as without it
     """
 
     def __init__(
@@ -242,14 +378,64 @@ class Configuration:
         debugging: bool = False,
         named_attributes: bool = False,
         ini_file: str = "database.ini",
+        cached: bool = False,
+        snapshot_file: Optional[str] = None,
+        snapshot_max_age: Optional[float] = None,
     ):
+        snapshot = open_snapshot(snapshot_file, snapshot_max_age) if snapshot_file else None
+        configs = snapshot.get(appname, debugging) if snapshot is not None else None
+        if configs is not None:
+            # the app is known from the snapshot, the input is validated without a database lookup
+            ConfigurationModel.model_validate(
+                {"appname": appname, "debugging": debugging, "ini_file": ini_file, "cached": cached},
+                context={"check_app_name": False},
+            )
+            self._set_values(appname, configs, debugging, named_attributes, ini_file)
+            return
+
         self.named_attributes = named_attributes
         self.initialized = True
         self.ini_file = ini_file
-        self.validation_model = ConfigurationModel(appname=appname, debugging=debugging, ini_file=self.ini_file)
-        self.configs: dict = get_config(
-            appname=appname, debugging=debugging, ini_file=self.ini_file
+        self.validation_model = ConfigurationModel(
+            appname=appname, debugging=debugging, ini_file=self.ini_file, cached=cached
         )
+        if cached:
+            self.configs: dict = config_cache.get_config(
+                appname=appname, debugging=debugging, ini_file=self.ini_file
+            )
+        else:
+            self.configs: dict = get_config(
+                appname=appname, debugging=debugging, ini_file=self.ini_file
+            )
+        self.set_constants()
+
+    @classmethod
+    def from_values(
+        cls,
+        appname: str,
+        configs: dict,
+        debugging: bool = False,
+        named_attributes: bool = False,
+        ini_file: str = "database.ini",
+    ) -> "Configuration":
+        """
+        Purpose:
+            Create a Configuration from constants that are already loaded, e.g. by get_configs or
+            read_config_snapshot. Nothing is validated against or read from the database
+        """
+        configuration = cls.__new__(cls)
+        configuration._set_values(appname, configs, debugging, named_attributes, ini_file)
+        return configuration
+
+    def _set_values(self, appname: str, configs: dict, debugging: bool, named_attributes: bool, ini_file: str):
+        """
+        Sets up the instance for from_values and for Configuration(snapshot_file=...)
+        """
+        self.named_attributes = named_attributes
+        self.initialized = True
+        self.ini_file = ini_file
+        self.validation_model = ConfigurationModel.model_construct(appname=appname, debugging=debugging, ini_file=ini_file)
+        self.configs = dict(configs)
         self.set_constants()
 
     def set_constants(self):
@@ -0,0 +1,148 @@
+from datetime import datetime
+import locale
+from typing import Callable
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for use_numpy_lists
+    np = None
+
+TRUE_VALUES = frozenset(("y", "yes", "t", "true", "on", "1", "ja"))
+
+
+class DateParser:
+    """
+    Purpose:
+    Parses a string to datetime trying a list of formats.
+    The format that worked last is tried first, so a table using one format costs one strptime per value
+    """
+
+    def __init__(self, date_formats: list[str]):
+        self.date_formats = list(date_formats)
+        self._last = 0
+
+    def __call__(self, date_str: str) -> datetime:
+        formats = self.date_formats
+        last = self._last
+        try:
+            return datetime.strptime(date_str, formats[last])
+        except ValueError:
+            pass
+        for index, date_format in enumerate(formats):
+            if index == last:
+                continue
+            try:
+                value = datetime.strptime(date_str, date_format)
+            except ValueError:
+                continue
+            self._last = index
+            return value
+        raise ValueError(f"Date format not recognized for date: {date_str}")
+
+
+parse_date = DateParser(
+    [
+        "%d-%m-%Y %H:%M:%S",
+        "%Y-%m-%d %H:%M:%S",
+        "%d-%m-%Y",
+    ]
+)
+
+
+def _plain_float_locale() -> bool:
+    """
+    True when the current locale writes floats like Python does, so float() can replace locale.atof
+    """
+    conventions = locale.localeconv()
+    return conventions["decimal_point"] == "." and not conventions["thousands_sep"]
+
+
+def decode_float(value: str) -> float:
+    return locale.atof(value)
+
+
+def decode_bool(value: str) -> bool:
+    return value.lower() in TRUE_VALUES
+
+
+def decode_str_list(value: str) -> list[str]:
+    return value.split(",")
+
+
+def decode_int_list(value: str) -> list[int]:
+    return list(map(int, value.split(",")))
+
+
+def decode_float_list(value: str) -> list[float]:
+    if _plain_float_locale():
+        return list(map(float, value.split(",")))
+    return list(map(locale.atof, value.split(",")))
+
+
+def decode_int_array(value: str):
+    return np.array(value.split(","), dtype=np.int64)
+
+
+def decode_float_array(value: str):
+    if _plain_float_locale():
+        return np.array(value.split(","), dtype=np.float64)
+    return np.array(decode_float_list(value), dtype=np.float64)
+
+
+# type_id in nkinitvalues -> function decoding the value column
+DECODERS: dict[int, Callable[[str], any]] = {
+    1: str,
+    2: int,
+    3: decode_float,
+    4: decode_bool,
+    5: decode_str_list,
+    6: decode_int_list,
+    7: decode_float_list,
+    8: parse_date,
+}
+
+
+def register_decoder(type_id: int, decoder: Callable[[str], any]):
+    """
+    Purpose:
+    Add a decoder for a type_id or replace an existing one
+
+    Argument:
+    type_id -->     type_id as used in nkinitvalues
+    decoder -->     function taking the value text and returning the decoded value
+    """
+    DECODERS[type_id] = decoder
+
+
+def use_numpy_lists(enabled: bool = True):
+    """
+    Purpose:
+    Decode integer and float lists (type_id 6 and 7) to NumPy arrays instead of lists
+
+    Argument:
+    enabled -->     True for NumPy arrays, False for the default lists
+    """
+    if enabled:
+        if np is None:
+            raise ImportError("use_numpy_lists needs numpy")
+        register_decoder(6, decode_int_array)
+        register_decoder(7, decode_float_array)
+    else:
+        register_decoder(6, decode_int_list)
+        register_decoder(7, decode_float_list)
+
+
+def decode_row(row) -> tuple[bool, any]:
+    """
+    Purpose:
+    Decode the value of a nkinitvalues row
+
+    Argument:
+    row -->     db record with type_id and value
+
+    returns (True, value) or (False, None) when the type_id has no decoder
+    """
+    decoder = DECODERS.get(row["type_id"])
+    if decoder is None:
+        return False, None
+    return True, decoder(row["value"])
@@ -0,0 +1,175 @@
+import hashlib
+import re
+from collections.abc import Iterable, Iterator, Mapping
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Optional
+
+from NKDatabase.NKFile.fileReader import map_ahead, pool_workers
+from NKDatabase.NKFile.tokenCounter import count_tokens
+
+_WORD = re.compile(r"\S+")
+
+
+def _split_word(text: str, start: int, end: int, max_tokens: int, counter: Callable[[str], int]) -> list[tuple[int, int]]:
+    """
+    Cuts a word longer than max_tokens into pieces of at most max_tokens, at least one character each
+    """
+    pieces = []
+    while start < end:
+        if counter(text[start:end]) <= max_tokens:
+            pieces.append((start, end))
+            break
+        # longest prefix within the budget
+        low, high = start + 1, end
+        while high - low > 1:
+            middle = (low + high) // 2
+            if counter(text[start:middle]) <= max_tokens:
+                low = middle
+            else:
+                high = middle
+        pieces.append((start, low))
+        start = low
+    return pieces
+
+
+def chunk_spans(text: str, max_tokens: int = 512, overlap_tokens: int = 64, counter: Optional[Callable[[str], int]] = None) -> list[tuple[int, int]]:
+    """
+    Splits a text into overlapping chunks of at most max_tokens tokens, cutting between words.
+    Every candidate chunk is measured with the counter as a whole, growing it word by word in doubling steps
+    and narrowing down with a binary search, so the counter runs a few times per chunk and not once per word.
+    A single word longer than max_tokens is cut into pieces of its own
+
+    Parameters:
+    text: the text to split
+    max_tokens: maximum number of tokens in a chunk
+    overlap_tokens: tokens a chunk repeats from the end of the previous chunk
+    counter: token counter, default tokenCounter.count_tokens
+    returns a list of (start, end) character positions, a text without words gives []
+    """
+    if max_tokens < 1:
+        raise ValueError("max_tokens must be at least 1")
+    if not 0 <= overlap_tokens < max_tokens:
+        raise ValueError("overlap_tokens must be at least 0 and less than max_tokens")
+    counter = counter if counter is not None else count_tokens
+
+    words = [(match.start(), match.end()) for match in _WORD.finditer(text)]
+
+    def tokens(first: int, last: int) -> int:
+        return counter(text[words[first][0]:words[last][1]])
+
+    spans = []
+    first = 0
+    while first < len(words):
+        if tokens(first, first) > max_tokens:
+            spans.extend(_split_word(text, *words[first], max_tokens, counter))
+            first += 1
+            continue
+
+        # last fits, high is the first word known not to fit or len(words)
+        last = first
+        step = 1
+        while last + step < len(words) and tokens(first, last + step) <= max_tokens:
+            last += step
+            step *= 2
+        high = min(last + step, len(words))
+        while high - last > 1:
+            middle = (last + high) // 2
+            if tokens(first, middle) <= max_tokens:
+                last = middle
+            else:
+                high = middle
+        spans.append((words[first][0], words[last][1]))
+        if last + 1 == len(words):
+            break
+
+        # repeat the longest tail of the chunk within overlap_tokens, always moving forward
+        low, next_first = first, last + 1
+        if overlap_tokens:
+            while next_first - low > 1:
+                middle = (low + next_first) // 2
+                if tokens(middle, last) <= overlap_tokens:
+                    next_first = middle
+                else:
+                    low = middle
+        first = next_first
+    return spans
+
+
+def chunk_document(
+    document: Mapping,
+    max_tokens: int = 512,
+    overlap_tokens: int = 64,
+    counter: Optional[Callable[[str], int]] = None,
+    text_field: str = "content",
+) -> list[dict]:
+    """
+    Splits a document into chunk documents. Each chunk is a copy of the document where text_field
+    holds the chunk text and these keys are set:
+    id: "<document_id>:<chunk_index>", stable as long as the document splits the same way
+    document_id: document_id of the document, or its id when it has none
+    chunk_index: position of the chunk in the document
+    chunk_hash: sha256 of the chunk text, for skipping unchanged chunks
+    token_size: tokens in the chunk
+
+    Parameters:
+    document: json object with text_field and document_id or id
+    max_tokens, overlap_tokens, counter: see chunk_spans
+    text_field: key of the text to split
+    returns the chunk documents, one chunk for a short document
+    """
+    document_id = document.get("document_id", document.get("id"))
+    if document_id is None:
+        raise KeyError("Document has neither 'document_id' nor 'id'")
+    counter = counter if counter is not None else count_tokens
+    text = document.get(text_field) or ""
+
+    spans = chunk_spans(text, max_tokens, overlap_tokens, counter) or [(0, 0)]
+    chunks = []
+    for index, (start, end) in enumerate(spans):
+        chunk_text = text[start:end]
+        chunk = dict(document)
+        chunk[text_field] = chunk_text
+        chunk["id"] = f"{document_id}:{index}"
+        chunk["document_id"] = document_id
+        chunk["chunk_index"] = index
+        chunk["chunk_hash"] = hashlib.sha256(chunk_text.encode("utf-8")).hexdigest()
+        chunk["token_size"] = counter(chunk_text)
+        chunks.append(chunk)
+    return chunks
+
+
+def chunk_documents(
+    documents: Iterable[Mapping],
+    max_tokens: int = 512,
+    overlap_tokens: int = 64,
+    counter: Optional[Callable[[str], int]] = None,
+    text_field: str = "content",
+    workers: Optional[int] = None,
+    prefetch: Optional[int] = None,
+    use_processes: bool = False,
+) -> Iterator[dict]:
+    """
+    Splits many documents into chunks in a pool of workers, see chunk_document.
+    Only prefetch documents are chunked ahead of the consumer, chunks come in document order,
+    so the result can go straight to VectorDatabase.bulk_insert_vectordata_sleeping_table once embedded
+
+    Parameters:
+    documents: json objects, e.g. from fileReader.iter_jsonfiles_in_directory
+    max_tokens, overlap_tokens, counter, text_field: see chunk_document
+    workers: number of threads or processes, default the executor default
+    prefetch: documents chunked ahead of the consumer, default 4 per worker
+    use_processes: chunk in a process pool, counter must then be picklable (a module level function)
+    returns an iterator of chunk documents
+    """
+    chunk = partial(chunk_document, max_tokens=max_tokens, overlap_tokens=overlap_tokens, counter=counter, text_field=text_field)
+    workers = pool_workers(workers, use_processes)
+    executor: Executor = ProcessPoolExecutor(workers) if use_processes else ThreadPoolExecutor(workers)
+    if prefetch is None:
+        prefetch = 4 * workers
+
+    try:
+        for chunks in map_ahead(executor, chunk, documents, prefetch):
+            yield from chunks
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
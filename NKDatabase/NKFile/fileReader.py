@@ -1,6 +1,16 @@
 import os
 import json
 import shutil
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Optional
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the standard json module is used without it
+    orjson = None
 
 
 def read_jsonfiles_in_directory(directory):
@@ -28,6 +38,111 @@ def read_jsonfiles_in_directory(directory):
     return data_list
 
 
+def load_json_file(filepath, json_backend: str = "json"):
+    """
+    Reads json data in one file and adds the filename like read_jsonfiles_in_directory
+
+    Parameters:
+    filepath: path of the file
+    json_backend: json or orjson
+    returns the json object
+    """
+    if json_backend == "orjson":
+        with open(filepath, "rb") as file:
+            data = orjson.loads(file.read())
+    else:
+        with open(filepath, "r", encoding="utf-8") as file:
+            data = json.load(file)
+    data["filename"] = os.path.basename(filepath)
+    return data
+
+
+def pool_workers(workers: Optional[int], use_processes: bool = False) -> int:
+    """
+    Number of workers for a pool: workers when given, otherwise the default of the executor,
+    os.cpu_count() for a process pool and min(32, os.cpu_count() + 4) for a thread pool
+
+    Parameters:
+    workers: requested number of workers or None
+    use_processes: the pool is a ProcessPoolExecutor
+    returns the number of workers
+    """
+    if workers:
+        return workers
+    cpus = os.cpu_count() or 1
+    return cpus if use_processes else min(32, cpus + 4)
+
+
+def map_ahead(executor: Executor, function: Callable, items: Iterable, prefetch: int) -> Iterator:
+    """
+    Runs function over items in the executor keeping prefetch calls in flight, results come in the order of items.
+    Items are only taken from the iterable as results are consumed, so memory use is bounded by prefetch
+
+    Parameters:
+    executor: thread or process pool running the calls
+    function: called with one item, must be picklable for a process pool
+    items: iterable of arguments
+    prefetch: calls kept in flight ahead of the consumer
+    returns an iterator of the results
+    """
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(function, item))
+        if len(pending) >= prefetch:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def iter_jsonfiles_in_directory(
+    directory,
+    batch_size: int = 100,
+    workers: Optional[int] = None,
+    prefetch: Optional[int] = None,
+    use_processes: bool = False,
+    json_backend: Optional[str] = None,
+) -> Iterator[list]:
+    """
+    Reads json data in all files in the selected directory in parallel and yields it in batches.
+    Only prefetch files are read ahead, so memory use does not depend on the size of the directory.
+    The documents are yielded in directory order and look like those of read_jsonfiles_in_directory
+
+    Parameters:
+    directory: name of directory to read from
+    batch_size: number of documents per yielded list
+    workers: number of threads or processes, default the executor default
+    prefetch: files read ahead of the consumer, default 4 per worker
+    use_processes: parse in a process pool instead of a thread pool, pays off for large files
+    json_backend: json or orjson, default orjson when installed
+    returns an iterator of lists of json objects
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+    if json_backend is None:
+        json_backend = "orjson" if orjson is not None else "json"
+    elif json_backend == "orjson" and orjson is None:
+        raise ImportError("json_backend 'orjson' needs the orjson package")
+
+    workers = pool_workers(workers, use_processes)
+    executor: Executor = ProcessPoolExecutor(workers) if use_processes else ThreadPoolExecutor(workers)
+    if prefetch is None:
+        prefetch = 4 * workers
+
+    try:
+        with os.scandir(directory) as entries:
+            paths = (entry.path for entry in entries if entry.name.endswith(".json") and entry.is_file())
+            batch = []
+            for document in map_ahead(executor, partial(load_json_file, json_backend=json_backend), paths, prefetch):
+                batch.append(document)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
 def get_files_in_directory(directory):
     """
     list files in selected directory
@@ -0,0 +1,28 @@
+import os
+import uuid
+
+
+def write_atomic(path: str, payload: bytes, fsync: bool = False):
+    """
+    Writes a file through a temporary file in the same directory and a rename,
+    so readers see the old or the new content and never a half-written file.
+    The temporary file is created with mode 0o666 like open() does, the kernel applies the umask to it
+
+    Parameters:
+    path: file to write
+    payload: the new content
+    fsync: flush the content to disk before the rename, so a crash never leaves an empty file behind
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    temp_path = os.path.join(directory, f".{name}.{uuid.uuid4().hex}.tmp")
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o666)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
@@ -1,5 +1,15 @@
+import hashlib
 import json
 import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Callable, Optional
+
+from NKDatabase.NKFile.fileReader import pool_workers
+from NKDatabase.NKFile.fileWriter import write_atomic  # noqa: F401 re-exported
+from NKDatabase.NKFile.tokenCounter import count_tokens
 
 
 def jsonConvert(source_dir, target_dir, source_name):
@@ -18,8 +28,8 @@ def jsonConvert(source_dir, target_dir, source_name):
         # Rename 'Embedding' to 'text_to_embed'
         data["text_to_embed"] = data.pop("Embedding")
 
-        # Add a new field 'tokensize' (let's assume it should be the length of 'Content')
-        data["token_size"] = int(len(data["Content"].split()))
+        # Add a new field 'tokensize', counted by the default token counter
+        data["token_size"] = count_tokens(data["Content"])
 
         data["source"] = source_name
 
@@ -32,3 +42,149 @@ def jsonConvert(source_dir, target_dir, source_name):
         with open(new_full_path, "w", encoding="utf-8") as f:
             json.dump(lowercased_data, f, ensure_ascii=False, indent=4)
             f.close()
+
+
+def default_transform(data: dict, source_name: str, token_counter: Optional[Callable[[str], int]] = None) -> dict:
+    """
+    The transform of jsonConvert: renames 'Embedding' to 'text_to_embed', adds 'token_size'
+    (tokens in 'Content') and 'source', and lowercases the keys
+
+    Parameters:
+    data: the json object of a source file
+    source_name: value for the 'source' key
+    token_counter: counts the tokens of 'Content', default tokenCounter.count_tokens.
+                   Pass it with functools.partial, e.g. partial(default_transform, token_counter=tiktoken_counter())
+    returns the json object to write
+    """
+    data["text_to_embed"] = data.pop("Embedding")
+    data["token_size"] = (token_counter or count_tokens)(data["Content"])
+    data["source"] = source_name
+    return {k.lower(): v for k, v in data.items()}
+
+
+@dataclass
+class ConversionResult:
+    """
+    Outcome of jsonConvertParallel, failures holds (filename, error)
+    """
+
+    converted: int = 0
+    unchanged: int = 0
+    skipped: int = 0
+    bytes_read: int = 0
+    bytes_written: int = 0
+    seconds: float = 0.0
+    failures: list[tuple[str, str]] = field(default_factory=list)
+
+    @property
+    def files_per_second(self) -> float:
+        files = self.converted + self.unchanged
+        return files / self.seconds if self.seconds else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"{self.converted} files converted, {self.unchanged} unchanged, {self.skipped} up to date, "
+            f"{len(self.failures)} failed in {self.seconds:.2f}s "
+            f"({self.files_per_second:.0f} files/s, {self.bytes_read / 1e6:.1f} MB read, {self.bytes_written / 1e6:.1f} MB written)"
+        )
+
+
+def _convert_file(
+    name: str, source_dir: str, target_dir: str, source_name: str, transform: Callable, skip: Optional[str], indent: Optional[int]
+) -> tuple[str, int, int, Optional[str]]:
+    """
+    Converts one file for jsonConvertParallel
+
+    returns (status, bytes read, bytes written, error), status is converted, unchanged, skipped or failed
+    """
+    source_path = os.path.join(source_dir, name)
+    target_path = os.path.join(target_dir, name)
+    try:
+        if skip == "mtime":
+            try:
+                if os.stat(target_path).st_mtime_ns >= os.stat(source_path).st_mtime_ns:
+                    return "skipped", 0, 0, None
+            except FileNotFoundError:
+                pass
+
+        with open(source_path, "rb") as f:
+            raw = f.read()
+        data = transform(json.loads(raw), source_name)
+        separators = (",", ":") if indent is None else None
+        payload = json.dumps(data, ensure_ascii=False, indent=indent, separators=separators).encode("utf-8")
+
+        if skip == "hash":
+            # an identical target is left alone, so its mtime keeps telling downstream jobs it did not change
+            try:
+                with open(target_path, "rb") as f:
+                    if hashlib.sha256(f.read()).digest() == hashlib.sha256(payload).digest():
+                        return "unchanged", len(raw), 0, None
+            except FileNotFoundError:
+                pass
+
+        write_atomic(target_path, payload)
+        return "converted", len(raw), len(payload), None
+    except Exception as error:
+        return "failed", 0, 0, f"{type(error).__name__}: {error}"
+
+
+def jsonConvertParallel(
+    source_dir,
+    target_dir,
+    source_name,
+    transform: Callable[[dict, str], dict] = default_transform,
+    workers: Optional[int] = None,
+    use_processes: bool = False,
+    skip: Optional[str] = "mtime",
+    indent: Optional[int] = None,
+) -> ConversionResult:
+    """
+    Converts the json files of source_dir into target_dir like jsonConvert, using a pool of workers.
+    Targets are written compactly through a temporary file and a rename, so a crash never leaves
+    a half-written target. A file that fails is reported in the result and does not stop the others
+
+    Parameters:
+    source_dir: directory with the source files
+    target_dir: directory for the converted files, same file names as the sources
+    source_name: value for the 'source' key
+    transform: function(data, source_name) returning the json object to write, default default_transform.
+               Must be a module level function when use_processes is set
+    workers: number of threads or processes, default the executor default
+    use_processes: convert in a process pool instead of a thread pool, pays off for large files
+    skip: "mtime" skips sources older than their target without reading them,
+          "hash" converts every source but does not rewrite a target with identical content,
+          None converts and writes everything
+    indent: indent of the written json, default compact
+    returns ConversionResult, use summary() for a report
+    """
+    if skip not in ("mtime", "hash", None):
+        raise ValueError(f"Unknown skip mode '{skip}', use 'mtime', 'hash' or None")
+
+    started = time.perf_counter()
+    result = ConversionResult()
+    with os.scandir(source_dir) as entries:
+        names = [entry.name for entry in entries if entry.is_file() and not entry.name.startswith(".")]
+
+    convert = partial(
+        _convert_file,
+        source_dir=source_dir,
+        target_dir=target_dir,
+        source_name=source_name,
+        transform=transform,
+        skip=skip,
+        indent=indent,
+    )
+    workers = pool_workers(workers, use_processes)
+    executor: Executor = ProcessPoolExecutor(workers) if use_processes else ThreadPoolExecutor(workers)
+    with executor:
+        chunksize = max(1, len(names) // (4 * workers)) if use_processes else 1
+        for name, (status, bytes_read, bytes_written, error) in zip(names, executor.map(convert, names, chunksize=chunksize)):
+            if status == "failed":
+                result.failures.append((name, error))
+                continue
+            setattr(result, status, getattr(result, status) + 1)
+            result.bytes_read += bytes_read
+            result.bytes_written += bytes_written
+
+    result.seconds = time.perf_counter() - started
+    return result
@@ -0,0 +1,183 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from collections.abc import Iterable
+from typing import Callable, Optional
+
+from NKDatabase.NKFile.fileReader import iter_jsonfiles_in_directory
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken is optional, approximate_token_count is used without it
+    tiktoken = None
+
+# characters per token of the OpenAI tokenizers on average for european languages
+CHARS_PER_TOKEN = 4
+
+
+def approximate_token_count(text: str) -> int:
+    """
+    Estimates the number of tokens from the length of the text, without allocating anything
+
+    Parameters:
+    text: the text to count
+    returns the estimated number of tokens
+    """
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+class CachedTokenCounter:
+    """
+    Purpose:
+    Counts tokens with a tokenizer and keeps the counts in an LRU cache keyed by a hash of the text,
+    so documents seen again are not tokenized again. Safe to share between threads
+
+    Argument:
+    count -->       function returning the number of tokens of a text
+    count_batch --> optional function returning the numbers of tokens of a list of texts
+    cache_size -->  number of counts kept
+
+    Usage:
+    counter = tiktoken_counter()
+    counter("some text"), counter.count_batch(["text", "more text"])
+    """
+
+    def __init__(
+        self,
+        count: Callable[[str], int],
+        count_batch: Optional[Callable[[list[str]], list[int]]] = None,
+        cache_size: int = 65536,
+    ):
+        self._count = count
+        self._count_batch = count_batch
+        self.cache_size = cache_size
+        self._cache: OrderedDict[bytes, int] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def _lookup(self, key: bytes) -> Optional[int]:
+        with self._lock:
+            count = self._cache.get(key)
+            if count is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._cache.move_to_end(key)
+            return count
+
+    def _store(self, key: bytes, count: int):
+        with self._lock:
+            self._cache[key] = count
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def __call__(self, text: str) -> int:
+        key = self._key(text)
+        count = self._lookup(key)
+        if count is None:
+            count = self._count(text)
+            self._store(key, count)
+        return count
+
+    def count_batch(self, texts: Iterable[str]) -> list[int]:
+        """
+        Counts many texts, the texts not in the cache are tokenized in one batch
+        """
+        texts = list(texts)
+        keys = [self._key(text) for text in texts]
+        counts = [self._lookup(key) for key in keys]
+        missing = [index for index, count in enumerate(counts) if count is None]
+        if missing:
+            if self._count_batch is not None:
+                new_counts = self._count_batch([texts[index] for index in missing])
+            else:
+                new_counts = [self._count(texts[index]) for index in missing]
+            for index, count in zip(missing, new_counts):
+                counts[index] = count
+                self._store(keys[index], count)
+        return counts
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+def tiktoken_counter(encoding: str = "cl100k_base", cache_size: int = 65536, num_threads: int = 8) -> CachedTokenCounter:
+    """
+    Creates a cached counter using a tiktoken encoding.
+    tiktoken downloads the encoding on first use, set TIKTOKEN_CACHE_DIR to a directory holding it to work offline
+
+    Parameters:
+    encoding: name of the tiktoken encoding
+    cache_size: number of counts kept
+    num_threads: threads tiktoken uses for batches
+    returns CachedTokenCounter
+    """
+    if tiktoken is None:
+        raise ImportError("tiktoken_counter needs the tiktoken package")
+    tokenizer = tiktoken.get_encoding(encoding)
+
+    def count(text: str) -> int:
+        return len(tokenizer.encode_ordinary(text))
+
+    def count_batch(texts: list[str]) -> list[int]:
+        return [len(tokens) for tokens in tokenizer.encode_ordinary_batch(texts, num_threads=num_threads)]
+
+    return CachedTokenCounter(count, count_batch, cache_size)
+
+
+_default_counter: Callable[[str], int] = approximate_token_count
+
+
+def set_default_counter(counter: Optional[Callable[[str], int]]):
+    """
+    Purpose:
+    Set the counter count_tokens uses, None restores approximate_token_count
+
+    Argument:
+    counter -->     function returning the number of tokens of a text, e.g. tiktoken_counter()
+    """
+    global _default_counter
+    _default_counter = counter if counter is not None else approximate_token_count
+
+
+def count_tokens(text: str) -> int:
+    """
+    Counts the tokens of a text with the default counter, see set_default_counter
+    """
+    return _default_counter(text)
+
+
+def count_tokens_in_directory(
+    directory, field: str = "content", counter: Optional[Callable[[str], int]] = None, batch_size: int = 100, workers: Optional[int] = None
+) -> dict[str, int]:
+    """
+    Counts the tokens of a field in all json files of a directory. Files are read in parallel
+    and counted a batch at a time
+
+    Parameters:
+    directory: name of directory to read from
+    field: key of the text to count, files without it count 0
+    counter: token counter, default the one of count_tokens. A CachedTokenCounter counts each batch at once
+    batch_size: documents per batch
+    workers: number of reading threads
+    returns filename -> number of tokens
+    """
+    counter = counter if counter is not None else _default_counter
+    counts = {}
+    for batch in iter_jsonfiles_in_directory(directory, batch_size=batch_size, workers=workers):
+        texts = [document.get(field, "") for document in batch]
+        if isinstance(counter, CachedTokenCounter):
+            batch_counts = counter.count_batch(texts)
+        else:
+            batch_counts = map(counter, texts)
+        counts.update(zip((document["filename"] for document in batch), batch_counts))
+    return counts
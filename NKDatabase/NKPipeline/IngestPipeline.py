@@ -0,0 +1,343 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from collections.abc import Callable, Iterable, Iterator, Mapping
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Optional
+
+import psycopg
+import psycopg.sql as sql
+
+from NKDatabase.NKFile.fileReader import load_json_file, map_ahead
+from NKDatabase.NKFile.fileWriter import write_atomic
+from NKDatabase.NKPostgres.VectorApps import VectorApp, get_vector_app
+from NKDatabase.NKPostgres.VectorDatabase import (
+    BulkLoadResult,
+    bulk_insert_vectordata_sleeping_table,
+    delete_data_in_sleeping_data,
+    sleeping_table_row,
+)
+from NKDatabase.NKPostgres.TableSwitch import SwitchReport, switch_tables
+from NKDatabase.NKPostgres.Transactions import commit
+from NKDatabase.NKPostgres.VectorIndexes import IndexBuildReport, build_sleeping_indexes, check_indexes
+from NKDatabase.NKPostgres.VectorSearch import RESULT_COLUMNS
+
+MANIFEST_VERSION = 1
+
+
+@dataclass
+class ManifestEntry:
+    """
+    What the manifest remembers about an ingested file
+
+    size, mtime_ns: from os.stat, used to skip hashing unchanged files
+    sha256: hash of the file content
+    ids: ids of the rows the file produced
+    """
+
+    size: int
+    mtime_ns: int
+    sha256: str
+    ids: list[str] = field(default_factory=list)
+
+
+@dataclass
+class PipelineReport:
+    """
+    Outcome of run_ingest_pipeline, times are in seconds.
+    failed_files holds file name -> error of the changed files that could not be read or converted
+    """
+
+    files_total: int = 0
+    files_changed: int = 0
+    files_unchanged: int = 0
+    files_removed: int = 0
+    rows_carried_over: int = 0
+    load: BulkLoadResult = field(default_factory=BulkLoadResult)
+    index_build: Optional[IndexBuildReport] = None
+    table_switch: Optional[SwitchReport] = None
+    problems: list[str] = field(default_factory=list)
+    failed_files: dict[str, str] = field(default_factory=dict)
+    switched: bool = False
+    scan_seconds: float = 0.0
+    load_seconds: float = 0.0
+    validate_seconds: float = 0.0
+
+
+def load_manifest(filename: str) -> dict[str, ManifestEntry]:
+    """
+    Reads a manifest written by save_manifest, a missing file gives an empty manifest
+
+    Parameters:
+    filename: manifest file
+    returns filename -> ManifestEntry
+    """
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"Unsupported manifest version in {filename}")
+    return {name: ManifestEntry(**entry) for name, entry in data["files"].items()}
+
+
+def save_manifest(filename: str, manifest: Mapping[str, ManifestEntry]):
+    """
+    Writes a manifest atomically
+
+    Parameters:
+    filename: manifest file
+    manifest: filename -> ManifestEntry
+    """
+    data = {"version": MANIFEST_VERSION, "files": {name: entry.__dict__ for name, entry in manifest.items()}}
+    write_atomic(filename, json.dumps(data, ensure_ascii=False).encode("utf-8"))
+
+
+def file_sha256(filepath: str) -> str:
+    """
+    Hashes a file in 1 MB blocks
+
+    Parameters:
+    filepath: path of the file
+    returns the hex digest
+    """
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        while block := f.read(1 << 20):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def scan_directory(
+    directory: str, manifest: Mapping[str, ManifestEntry]
+) -> tuple[dict[str, ManifestEntry], list[str], list[str]]:
+    """
+    Compares the json files of a directory with a manifest.
+    Files with the size and mtime of the manifest are not read, other files are hashed
+
+    Parameters:
+    directory: directory holding the json files
+    manifest: manifest of the last successful run
+
+    Returns:
+    (entries, changed, unchanged): entries for every file, ids are kept for unchanged files,
+    names of the new or changed files and names of the unchanged files
+    """
+    entries = {}
+    changed = []
+    unchanged = []
+    with os.scandir(directory) as scan:
+        for entry in scan:
+            if not entry.name.endswith(".json") or not entry.is_file():
+                continue
+            stat = entry.stat()
+            previous = manifest.get(entry.name)
+            if previous is not None and previous.size == stat.st_size and previous.mtime_ns == stat.st_mtime_ns:
+                entries[entry.name] = previous
+                unchanged.append(entry.name)
+                continue
+
+            sha256 = file_sha256(entry.path)
+            if previous is not None and previous.sha256 == sha256:
+                entries[entry.name] = ManifestEntry(stat.st_size, stat.st_mtime_ns, sha256, previous.ids)
+                unchanged.append(entry.name)
+            else:
+                entries[entry.name] = ManifestEntry(stat.st_size, stat.st_mtime_ns, sha256)
+                changed.append(entry.name)
+    return entries, sorted(changed), sorted(unchanged)
+
+
+def _read_and_convert(directory: str, convert: Callable[[dict], Iterable], name: str) -> tuple[str, list, Optional[str]]:
+    try:
+        document = load_json_file(os.path.join(directory, name))
+        return name, [sleeping_table_row(row) for row in convert(document)], None
+    except Exception as error:
+        return name, [], f"{type(error).__name__}: {error}"
+
+
+def convert_files(
+    executor: Executor,
+    directory: str,
+    names: Iterable[str],
+    convert: Callable[[dict], Iterable],
+    prefetch: int,
+    failed: dict[str, str],
+) -> Iterator[tuple[str, list[tuple]]]:
+    """
+    Reads and converts json files in the executor, keeping prefetch files in flight
+
+    Parameters:
+    executor: thread pool reading and converting
+    directory: directory holding the json files
+    names: names of the files
+    convert: see run_ingest_pipeline
+    prefetch: files read and converted ahead of the consumer
+    failed: a file that cannot be read or converted is left out and its error stored here by name
+
+    Returns:
+    iterator of (name, rows) in the order of names, the rows in SLEEPING_TABLE_FIELDS order
+    """
+    for name, rows, error in map_ahead(executor, partial(_read_and_convert, directory, convert), names, prefetch):
+        if error is None:
+            yield name, rows
+        else:
+            failed[name] = error
+
+
+def _active_rows(conn: psycopg.Connection, app: VectorApp, ids: list[str], batch_size: int) -> Iterator[tuple]:
+    """
+    Reads the rows of unchanged files from the active table in batches of ids,
+    in SLEEPING_TABLE_FIELDS order for the insert procedure
+    """
+    columns = sql.SQL(", ").join(map(sql.Identifier, RESULT_COLUMNS + (app.embedding_column,)))
+    query = sql.SQL("SELECT {columns} FROM {active} WHERE id = ANY(%s)").format(
+        active=sql.Identifier(app.schema, app.active_table),
+        columns=columns,
+    )
+    for start in range(0, len(ids), batch_size):
+        with conn.cursor() as cursor:
+            cursor.execute(query, (ids[start:start + batch_size],))
+            rows = cursor.fetchall()
+        yield from rows
+
+
+def _carry_over(conn: psycopg.Connection, app: VectorApp, ids: list[str], batch_size: int) -> BulkLoadResult:
+    """
+    Copies the rows of unchanged files from the active to the sleeping table through the insert procedure,
+    so the procedure's logic is applied to them like to new rows
+    """
+    return bulk_insert_vectordata_sleeping_table(app.insert_procedure, conn, _active_rows(conn, app, ids, batch_size), batch_size)
+
+
+def _count_rows(conn: psycopg.Connection, app: VectorApp) -> int:
+    with conn.cursor() as cursor:
+        cursor.execute(sql.SQL("SELECT count(*) FROM {}").format(sql.Identifier(app.schema, app.sleeping_table)))
+        count = cursor.fetchone()[0]
+    commit(conn)
+    return count
+
+
+def run_ingest_pipeline(
+    conn: psycopg.Connection,
+    app: str | VectorApp,
+    directory: str,
+    manifest_file: str,
+    convert: Callable[[dict], Iterable] = lambda document: [document],
+    batch_size: int = 500,
+    workers: int = 4,
+    prefetch: int = 32,
+    build_indexes: bool = True,
+    index_options: Optional[dict] = None,
+    archive_directory: Optional[str] = None,
+    switch: bool = True,
+    switch_options: Optional[dict] = None,
+) -> PipelineReport:
+    """
+    Loads a directory of json documents into the sleeping table of an app and switches it active.
+
+    Only new and changed files are read, converted and inserted, the rows of unchanged files are copied
+    from the active table. Reading files, converting documents and inserting batches run at the same time.
+    After the load the indexes are built, the row count and indexes are checked and only then the tables
+    are switched and the manifest saved. A run that does not switch leaves the manifest untouched.
+    Changed files that cannot be read or converted are listed in report.failed_files and left out of the load,
+    the manifest and the archive, so the next run tries them again; until then the tables have no rows of them.
+
+    Parameters:
+    conn (psycopg.connection): The database connection object.
+    app: name of the app or a VectorApp
+    directory: directory holding the json files
+    manifest_file: manifest of the last successful run, created when missing
+    convert: turns a document into rows for the insert procedure (sequences in SLEEPING_TABLE_FIELDS order
+             or mappings, see VectorDatabase.sleeping_table_row), e.g. computing the embedding.
+             Runs in worker threads. Default passes the document on as one row
+    batch_size: rows per insert batch
+    workers: threads reading and converting files
+    prefetch: documents read and converted ahead of the inserts
+    build_indexes: run build_sleeping_indexes before validating
+    index_options: keyword arguments for build_sleeping_indexes
+    archive_directory: move the files of directory here after the switch. Their manifest entries are kept,
+                       so their rows are carried over until the file shows up again.
+                       Without it files missing from directory are removed from the tables
+    switch: switch the tables when the checks pass
+    switch_options: keyword arguments for TableSwitch.switch_tables, e.g. recall_sample or lock_timeout
+
+    Returns:
+    PipelineReport
+    """
+    app = get_vector_app(app)
+    report = PipelineReport()
+
+    started = time.perf_counter()
+    manifest = load_manifest(manifest_file)
+    entries, changed, unchanged = scan_directory(directory, manifest)
+    present = list(entries)
+    if archive_directory is not None:
+        # archived files are still part of the corpus
+        for name, entry in manifest.items():
+            if name not in entries:
+                entries[name] = entry
+                unchanged.append(name)
+    report.files_total = len(entries)
+    report.files_changed = len(changed)
+    report.files_unchanged = len(unchanged)
+    report.files_removed = len([name for name in manifest if name not in entries])
+    report.scan_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    if not delete_data_in_sleeping_data(app.clean_procedure, conn):
+        report.problems.append(f"Could not clean {app.schema}.{app.sleeping_table}")
+        return report
+    carried_ids = [row_id for name in unchanged for row_id in entries[name].ids]
+    carried = _carry_over(conn, app, carried_ids, batch_size)
+    report.rows_carried_over = carried.rows_inserted
+
+    def rows() -> Iterator[tuple]:
+        for name, converted in convert_files(executor, directory, changed, convert, prefetch, report.failed_files):
+            entries[name].ids = [str(row[0]) for row in converted]
+            yield from converted
+
+    with ThreadPoolExecutor(workers) as executor:
+        report.load = bulk_insert_vectordata_sleeping_table(app.insert_procedure, conn, rows(), batch_size)
+    for name in report.failed_files:
+        del entries[name]
+        present.remove(name)
+    report.load_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    if report.load.failures:
+        report.problems.append(f"{len(report.load.failures)} batches failed to load")
+    if carried.failures:
+        report.problems.append(f"{len(carried.failures)} batches of unchanged rows failed to load")
+    elif report.rows_carried_over != len(carried_ids):
+        report.problems.append(f"{len(carried_ids) - report.rows_carried_over} unchanged rows missing in the active table")
+    expected = report.rows_carried_over + report.load.rows_inserted
+    count = _count_rows(conn, app)
+    if count != expected:
+        report.problems.append(f"{app.schema}.{app.sleeping_table} has {count} rows, expected {expected}")
+    if count == 0:
+        report.problems.append(f"{app.schema}.{app.sleeping_table} is empty")
+    if build_indexes and not report.problems:
+        report.index_build = build_sleeping_indexes(conn, app, **(index_options or {}))
+    if not report.problems:
+        report.problems.extend(check_indexes(conn, app, sleeping=True))
+        commit(conn)
+    report.validate_seconds = time.perf_counter() - started
+
+    if report.problems or not switch:
+        return report
+
+    report.table_switch = switch_tables(conn, app, **{"check_index": False, **(switch_options or {})})
+    report.switched = report.table_switch.switched
+    if not report.switched:
+        report.problems.extend(report.table_switch.problems)
+        return report
+
+    if archive_directory is not None:
+        for name in present:
+            shutil.move(os.path.join(directory, name), os.path.join(archive_directory, name))
+    save_manifest(manifest_file, entries)
+    return report
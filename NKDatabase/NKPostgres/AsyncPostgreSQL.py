@@ -0,0 +1,245 @@
+import asyncio
+import os
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+import psycopg
+from psycopg.pq import TransactionStatus
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+from NKDatabase.NKPostgres.ConnectionPool import (
+    DEFAULT_MAX_IDLE,
+    DEFAULT_MAX_SIZE,
+    DEFAULT_MIN_SIZE,
+    DEFAULT_TIMEOUT,
+    pool_options,
+)
+from NKDatabase.NKPostgres.Instrumentation import record_pool_wait, traced
+from NKDatabase.NKPostgres.PostgreSQL import connection_kwargs, load_config, stale_plan
+from NKDatabase.NKPostgres.StatementCache import delete_statement, insert_statement, select_statement, update_statement
+from NKDatabase.NKPostgres.Transactions import async_savepoint, commit_async
+from NKDatabase.NKPostgres.VectorTypes import adapt_embedding_async
+
+# An async pool belongs to the event loop it was opened in, so pools are kept per loop
+_pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[tuple[str, str], asyncio.Future]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+async def connect(config) -> psycopg.AsyncConnection:
+    """
+    Purpose:
+    Connect to the PostgreSQL database server without blocking the event loop
+
+    Argument:
+    config -->  return value from load_config(filename, section)
+    """
+    return await psycopg.AsyncConnection.connect(**connection_kwargs(config))
+
+
+async def get_pool(
+    filename: str = "database.ini",
+    section: str = "postgresql",
+    min_size: Optional[int] = None,
+    max_size: Optional[int] = None,
+    max_idle: Optional[float] = None,
+    timeout: Optional[float] = None,
+    check: Optional[bool] = None,
+    configure: Optional[Callable[[psycopg.AsyncConnection], Awaitable[None]]] = None,
+) -> AsyncConnectionPool:
+    """
+    Purpose:
+    Get the async connection pool for a database.ini section in the running event loop,
+    creating it on first use. See ConnectionPool.get_pool for the arguments
+    """
+    loop = asyncio.get_running_loop()
+    pools = _pools.setdefault(loop, {})
+    key = (os.path.abspath(filename), section)
+    future = pools.get(key)
+    if future is None:
+        future = loop.create_future()
+        pools[key] = future
+        try:
+            config = load_config(filename=filename, section=section)
+            options = {
+                "min_size": DEFAULT_MIN_SIZE,
+                "max_size": DEFAULT_MAX_SIZE,
+                "max_idle": DEFAULT_MAX_IDLE,
+                "timeout": DEFAULT_TIMEOUT,
+                "check": True,
+            }
+            options.update(pool_options(config))
+            explicit = {"min_size": min_size, "max_size": max_size, "max_idle": max_idle, "timeout": timeout, "check": check}
+            options.update({name: value for name, value in explicit.items() if value is not None})
+
+            pool = AsyncConnectionPool(
+                kwargs=connection_kwargs(config),
+                min_size=options["min_size"],
+                max_size=max(options["max_size"], options["min_size"]),
+                max_idle=options["max_idle"],
+                timeout=options["timeout"],
+                check=AsyncConnectionPool.check_connection if options["check"] else None,
+                configure=configure,
+                name=f"{section}@{key[0]}",
+                open=False,
+            )
+            await pool.open()
+            future.set_result(pool)
+        except BaseException as error:
+            del pools[key]
+            future.set_exception(error)
+            # the exception is raised below, mark it retrieved for waiters that never come
+            future.exception()
+            raise
+    return await asyncio.shield(future)
+
+
+@asynccontextmanager
+async def pooled_connection(
+    filename: str = "database.ini", section: str = "postgresql", **pool_kwargs
+) -> AsyncIterator[psycopg.AsyncConnection]:
+    """
+    Purpose:
+    Borrow a connection from the async pool for the section and give it back afterwards.
+    The transaction is committed when the block exits normally and rolled back on an exception
+
+    Usage:
+    async with pooled_connection("database.ini") as conn:
+        rows = await select_with_conditions(conn, "public", "nkinitvalues")
+    """
+    pool = await get_pool(filename, section, **pool_kwargs)
+    requested = time.perf_counter()
+    async with pool.connection() as conn:
+        record_pool_wait(conn, time.perf_counter() - requested)
+        yield conn
+
+
+async def close_pools():
+    """
+    Purpose:
+    Close the async pools of the running event loop
+    """
+    pools = _pools.pop(asyncio.get_running_loop(), {})
+    for future in pools.values():
+        if future.done() and not future.exception():
+            await future.result().close()
+
+
+async def execute_query(conn: psycopg.AsyncConnection, query: str, params=None, prepare: Optional[bool] = None):
+    """Execute a single query, see PostgreSQL.execute_query"""
+    async with async_savepoint(conn), conn.cursor() as cur:
+        with traced(conn, query, params, "execute_query") as trace:
+            await cur.execute(query, params, prepare=prepare)
+            trace.set_cursor(cur)
+        await commit_async(conn)
+        print("Query executed successfully.")
+
+
+async def fetch_query(conn: psycopg.AsyncConnection, query: str, params=None, prepare: Optional[bool] = None):
+    """Execute a query and fetch results, see PostgreSQL.execute_query for prepare"""
+    async with conn.cursor() as cur:
+        with traced(conn, query, params, "fetch_query") as trace:
+            await cur.execute(query, params, prepare=prepare)
+            result = await cur.fetchall()
+            trace.set_cursor(cur)
+        return result
+
+
+async def insert_data(conn: psycopg.AsyncConnection, table: str, columns: list[str], values: list[any]):
+    """Insert data into a table, see PostgreSQL.insert_data"""
+    await execute_query(conn, insert_statement(table, columns), values, prepare=True)
+
+
+async def update_data(
+    conn: psycopg.AsyncConnection, table: str, set_columns: list[str], set_values: list[any], condition_column: str, condition_value: any
+):
+    """Update data in a table, see PostgreSQL.update_data"""
+    await execute_query(
+        conn, update_statement(table, set_columns, [condition_column]), list(set_values) + [condition_value], prepare=True
+    )
+
+
+async def delete_data(conn: psycopg.AsyncConnection, table: str, condition_column: str, condition_value: any):
+    """Delete data from a table, see PostgreSQL.delete_data"""
+    await execute_query(conn, delete_statement(table, [condition_column]), (condition_value,), prepare=True)
+
+
+async def discard_prepared(conn: psycopg.AsyncConnection):
+    """Drops the prepared statements of a connection, see PostgreSQL.discard_prepared"""
+    if conn.info.transaction_status == TransactionStatus.INERROR:
+        await conn.rollback()
+    else:
+        await conn.execute("DEALLOCATE ALL")
+
+
+async def _execute_select(cursor: psycopg.AsyncCursor, query, params: Optional[list]):
+    """Executes a prepared SELECT and retries it once with a stale plan, see PostgreSQL._execute_select"""
+    conn = cursor.connection
+    idle = conn.info.transaction_status == TransactionStatus.IDLE
+    try:
+        await cursor.execute(query, params, prepare=True)
+    except psycopg.Error as error:
+        if not (idle and stale_plan(error)):
+            raise
+        await discard_prepared(conn)
+        await cursor.execute(query, params, prepare=True)
+
+
+async def select_with_conditions(
+    conn: psycopg.AsyncConnection, schema_name: str, table_name: str, where_conditions: dict[str, any] = None
+):
+    """
+    Select rows from a table with dynamic WHERE conditions, see PostgreSQL.select_with_conditions
+
+    Returns:
+    list: A list of dictionaries representing the rows that match the conditions.
+    """
+    async with conn.cursor(row_factory=dict_row) as cursor:
+        query = select_statement(schema_name, table_name, where_conditions.keys() if where_conditions else ())
+        params = list(where_conditions.values()) if where_conditions else None
+        with traced(conn, query, params, "select_with_conditions") as trace:
+            await _execute_select(cursor, query, params)
+            rows = await cursor.fetchall()
+            trace.set_cursor(cursor)
+        return rows
+
+
+async def update_or_insert_vectordata(
+    conn: psycopg.AsyncConnection,
+    schema_name,
+    table_name,
+    id,
+    title,
+    description,
+    content,
+    url,
+    row_updated,
+    embedded,
+    conditions: Optional[dict] = None,
+) -> bool:
+    """
+    Updates vector data, see PostgreSQL.update_or_insert_vectordata
+
+    Returns:
+        true when update or insert is succesfull
+    """
+    columns = ["id", "title", "description", "content", "url", "row_updated", "embedding"]
+    try:
+        embedded = await adapt_embedding_async(conn, embedded)
+        results = await select_with_conditions(conn, schema_name, table_name, conditions)
+        await commit_async(conn)
+        values = [id, title, description, content, url, row_updated, embedded]
+        if len(results) == 0:
+            print("inserting")
+            await insert_data(conn, f"{schema_name}.{table_name}", columns, values)
+        else:
+            print("Updating")
+            await update_data(conn, f"{schema_name}.{table_name}", columns, values, "id", id)
+        await commit_async(conn)
+        return True
+    except Exception as error:
+        print(f"Error executing query: {error}")
+        return False
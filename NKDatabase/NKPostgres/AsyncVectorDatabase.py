@@ -0,0 +1,223 @@
+import time
+from collections.abc import Iterable
+from itertools import islice
+
+import psycopg
+
+from NKDatabase.NKPostgres.Instrumentation import traced
+from NKDatabase.NKPostgres.Transactions import async_savepoint, batch_savepoint, commit_async, rollback_async
+from NKDatabase.NKPostgres.VectorDatabase import BatchFailure, BulkLoadResult, sleeping_table_row
+from NKDatabase.NKPostgres.VectorTypes import adapt_embedding_async
+
+
+# ***********************************************************************************************************************************
+# ***********************************************************************************************************************************
+# INSERTING
+# ***********************************************************************************************************************************
+# ***********************************************************************************************************************************
+async def insert_vectordata_nkgpt_sleeping_table(
+    conn, items_id, title, description, content, url, source, document_id, embedding_str
+):
+    """
+    inserts vector data into nkgpt tables, see VectorDatabase.insert_vectordata_nkgpt_sleeping_table
+    """
+    return await insert_vectordata_sleeping_table(
+        "nkgpt.insert_nkpgt_item", conn, items_id, title, description, content, url, source, document_id, embedding_str
+    )
+
+
+async def insert_vectordata_hygiejnar_sleeping_table(
+    conn, items_id, title, description, content, url, source, document_id, embedding_str
+):
+    """
+    inserts vector data into hygiejnar tables, see VectorDatabase.insert_vectordata_hygiejnar_sleeping_table
+    """
+    return await insert_vectordata_sleeping_table(
+        "nkgpt.insert_hygiejnar_item", conn, items_id, title, description, content, url, source, document_id, embedding_str
+    )
+
+
+async def insert_vectordata_sleeping_table(
+    app_procedure,
+    conn: psycopg.AsyncConnection,
+    items_id,
+    title,
+    description,
+    content,
+    url,
+    source,
+    document_id,
+    embedding_str,
+):
+    """
+    inserts vector data, see VectorDatabase.insert_vectordata_sleeping_table
+
+    Returns:
+
+    true when update or insert is succesfull
+    """
+    try:
+        if conn:
+            embedding_str = await adapt_embedding_async(conn, embedding_str)
+            async with async_savepoint(conn), conn.cursor() as cursor:
+                query = """
+                CALL {}(%s, %s, %s, %s, %s, %s, %s, %s);
+                """.format(app_procedure)
+
+                params = (items_id, title, description, content, url, source, document_id, embedding_str)
+                with traced(conn, query, params, "insert_vectordata_sleeping_table"):
+                    await cursor.execute(query, params)
+                await commit_async(conn)
+                return True
+        return False
+
+    except Exception as error:
+        print(f"Error executing query: {error}")
+        return False
+
+
+async def bulk_insert_vectordata_nkgpt_sleeping_table(conn, documents: Iterable, batch_size: int = 500) -> BulkLoadResult:
+    """
+    inserts many documents into the nkgpt sleeping tables, see bulk_insert_vectordata_sleeping_table
+    """
+    return await bulk_insert_vectordata_sleeping_table("nkgpt.insert_nkpgt_item", conn, documents, batch_size)
+
+
+async def bulk_insert_vectordata_hygiejnar_sleeping_table(conn, documents: Iterable, batch_size: int = 500) -> BulkLoadResult:
+    """
+    inserts many documents into the hygiejnar sleeping tables, see bulk_insert_vectordata_sleeping_table
+    """
+    return await bulk_insert_vectordata_sleeping_table("nkgpt.insert_hygiejnar_item", conn, documents, batch_size)
+
+
+async def bulk_insert_vectordata_sleeping_table(
+    app_procedure, conn: psycopg.AsyncConnection, documents: Iterable, batch_size: int = 500
+) -> BulkLoadResult:
+    """
+    inserts many documents through the insert procedure of an app,
+    see VectorDatabase.bulk_insert_vectordata_sleeping_table
+
+    Returns:
+
+    BulkLoadResult with row counts, throughput and the failed batches
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+
+    result = BulkLoadResult()
+    query = """
+    CALL {}(%s, %s, %s, %s, %s, %s, %s, %s);
+    """.format(app_procedure)
+
+    started = time.perf_counter()
+    documents = iter(documents)
+    first_row = 0
+    while True:
+        batch = list(islice(documents, batch_size))
+        if not batch:
+            break
+        try:
+            rows = []
+            for document in batch:
+                row = sleeping_table_row(document)
+                rows.append(row[:-1] + (await adapt_embedding_async(conn, row[-1]),))
+            async with batch_savepoint(conn), conn.cursor() as cursor:
+                with traced(conn, query, None, "bulk_insert_vectordata_sleeping_table") as trace:
+                    await cursor.executemany(query, rows)
+                    trace.set_rows(len(rows))
+            await commit_async(conn)
+            result.rows_inserted += len(batch)
+        except Exception as error:
+            await rollback_async(conn)
+            print(f"Error executing query: {error}")
+            result.rows_failed += len(batch)
+            result.failures.append(BatchFailure(result.batches, first_row, len(batch), str(error)))
+        result.batches += 1
+        first_row += len(batch)
+
+    result.seconds = time.perf_counter() - started
+    return result
+
+
+# ***********************************************************************************************************************************
+# ***********************************************************************************************************************************
+# DELETING
+# ***********************************************************************************************************************************
+# ***********************************************************************************************************************************
+async def delete_data_in_nkgpt_sleeping_data(conn):
+    """
+    deletes all vector data in the nkgpt sleeping tables
+    """
+    return await delete_data_in_sleeping_data("nkgpt.clean_sleeping_items", conn)
+
+
+async def delete_data_in_hygiejnar_sleeping_data(conn):
+    """
+    deletes all vector data in the hygiejnar sleeping tables
+    """
+    return await delete_data_in_sleeping_data("nkgpt.clean_hygiejnar_sleeping_items", conn)
+
+
+async def delete_data_in_sleeping_data(app_procedure, conn: psycopg.AsyncConnection):
+    """
+    deletes all vector data in the sleeping tables
+
+    Returns:
+
+    true when the delete is succesfull
+    """
+    try:
+        if conn:
+            async with async_savepoint(conn), conn.cursor() as cursor:
+                query = f"call {app_procedure}();"
+                with traced(conn, query, None, "delete_data_in_sleeping_data"):
+                    await cursor.execute(query)
+                await commit_async(conn)
+                return True
+        return False
+
+    except Exception as error:
+        print(f"Error executing query: {error}")
+        return False
+
+
+# ***********************************************************************************************************************************
+# ***********************************************************************************************************************************
+# SWITCH ACTIVE TABLES
+# ***********************************************************************************************************************************
+# ***********************************************************************************************************************************
+async def switch_nkgpt_active_tables(conn):
+    """
+    switches sleeping tables to active tables and vice versa
+    """
+    return await switch_active_tables("nkgpt.change_active_tables", conn)
+
+
+async def switch_hygiejnar_active_tables(conn):
+    """
+    switches sleeping tables to active tables and vice versa
+    """
+    return await switch_active_tables("nkgpt.change_hygiejnar_active_tables", conn)
+
+
+async def switch_active_tables(app_procedure, conn: psycopg.AsyncConnection):
+    """
+    switches sleeping tables to active tables and vice versa
+
+    Returns:
+
+    true when the switch is succesfull
+    """
+    try:
+        if conn:
+            async with async_savepoint(conn), conn.cursor() as cursor:
+                query = f"call {app_procedure}();"
+                with traced(conn, query, None, "switch_active_tables"):
+                    await cursor.execute(query)
+                await commit_async(conn)
+                return True
+        return False
+
+    except Exception as error:
+        print(f"Error executing query: {error}")
+        return False
@@ -0,0 +1,180 @@
+import atexit
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+import psycopg
+from psycopg_pool import ConnectionPool
+
+from NKDatabase.NKPostgres.Instrumentation import record_pool_wait
+from NKDatabase.NKPostgres.PostgreSQL import connection_kwargs, load_config
+
+# Defaults used when neither the caller nor the ini section sets a value
+DEFAULT_MIN_SIZE = 1
+DEFAULT_MAX_SIZE = 10
+DEFAULT_MAX_IDLE = 600.0
+DEFAULT_TIMEOUT = 30.0
+
+# Values of yes/no options in database.ini read as True
+TRUE_VALUES = ("y", "yes", "t", "true", "on", "1", "ja")
+
+_pools: dict[tuple[str, str], ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def pool_options(config: dict[str, any]) -> dict[str, any]:
+    """
+    Purpose:
+    Read pool settings from a database.ini section
+
+    Argument:
+    config -->  return value from load_config(filename, section).
+                Recognised keys are pool_min_size, pool_max_size, pool_max_idle (seconds),
+                pool_timeout (seconds) and pool_check (yes/no)
+
+    returns a dict with the keys min_size, max_size, max_idle, timeout and check for the keys present
+    """
+    options = {}
+    if "pool_min_size" in config:
+        options["min_size"] = int(config["pool_min_size"])
+    if "pool_max_size" in config:
+        options["max_size"] = int(config["pool_max_size"])
+    if "pool_max_idle" in config:
+        options["max_idle"] = float(config["pool_max_idle"])
+    if "pool_timeout" in config:
+        options["timeout"] = float(config["pool_timeout"])
+    if "pool_check" in config:
+        options["check"] = config["pool_check"].lower() in TRUE_VALUES
+    return options
+
+
+def open_pool(
+    config: dict[str, any],
+    name: str,
+    min_size: Optional[int] = None,
+    max_size: Optional[int] = None,
+    max_idle: Optional[float] = None,
+    timeout: Optional[float] = None,
+    check: Optional[bool] = None,
+    configure: Optional[Callable[[psycopg.Connection], None]] = None,
+) -> ConnectionPool:
+    """
+    Purpose:
+    Open a new pool for a configuration, see get_pool for the arguments.
+    The caller owns the pool and closes it, get_pool keeps the pools it opens process wide
+
+    Argument:
+    config -->  return value from load_config(filename, section)
+    name -->    name of the pool, shown in the psycopg_pool logs
+    """
+    options = {
+        "min_size": DEFAULT_MIN_SIZE,
+        "max_size": DEFAULT_MAX_SIZE,
+        "max_idle": DEFAULT_MAX_IDLE,
+        "timeout": DEFAULT_TIMEOUT,
+        "check": True,
+    }
+    options.update(pool_options(config))
+    explicit = {"min_size": min_size, "max_size": max_size, "max_idle": max_idle, "timeout": timeout, "check": check}
+    options.update({option: value for option, value in explicit.items() if value is not None})
+
+    return ConnectionPool(
+        kwargs=connection_kwargs(config),
+        min_size=options["min_size"],
+        max_size=max(options["max_size"], options["min_size"]),
+        max_idle=options["max_idle"],
+        timeout=options["timeout"],
+        check=ConnectionPool.check_connection if options["check"] else None,
+        configure=configure,
+        name=name,
+        open=True,
+    )
+
+
+def get_pool(
+    filename: str = "database.ini",
+    section: str = "postgresql",
+    min_size: Optional[int] = None,
+    max_size: Optional[int] = None,
+    max_idle: Optional[float] = None,
+    timeout: Optional[float] = None,
+    check: Optional[bool] = None,
+    configure: Optional[Callable[[psycopg.Connection], None]] = None,
+) -> ConnectionPool:
+    """
+    Purpose:
+    Get the process wide connection pool for a database.ini section, creating it on first use
+
+    Argument:
+    filename -->    File containing connection values, default database.ini
+    section -->     Section name of ini file, default is postgresql
+    min_size -->    Connections kept open, default pool_min_size from the section or 1
+    max_size -->    Upper bound of open connections, default pool_max_size from the section or 10
+    max_idle -->    Seconds an idle connection above min_size is kept, default pool_max_idle or 600
+    timeout -->     Seconds to wait for a free connection, default pool_timeout or 30
+    check -->       Health check connections before handing them out, default pool_check or True
+    configure -->   Optional callback run once on every new connection
+
+    The pool settings only take effect when the pool is created, later calls return the existing pool
+    """
+    key = (os.path.abspath(filename), section)
+    pool = _pools.get(key)
+    if pool is not None:
+        return pool
+
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            config = load_config(filename=filename, section=section)
+            pool = open_pool(config, f"{section}@{key[0]}", min_size, max_size, max_idle, timeout, check, configure)
+            _pools[key] = pool
+    return pool
+
+
+@contextmanager
+def pooled_connection(filename: str = "database.ini", section: str = "postgresql", **pool_kwargs) -> Iterator[psycopg.Connection]:
+    """
+    Purpose:
+    Borrow a connection from the pool for the section and give it back afterwards.
+    The transaction is committed when the block exits normally and rolled back on an exception
+
+    Argument:
+    filename -->    File containing connection values, default database.ini
+    section -->     Section name of ini file, default is postgresql
+    pool_kwargs --> Passed on to get_pool when the pool is created
+
+    Usage:
+    with pooled_connection("database.ini") as conn:
+        rows = select_with_conditions(conn, "public", "nkinitvalues")
+    """
+    pool = get_pool(filename, section, **pool_kwargs)
+    requested = time.perf_counter()
+    with pool.connection() as conn:
+        record_pool_wait(conn, time.perf_counter() - requested)
+        yield conn
+
+
+def check_pools():
+    """
+    Purpose:
+    Run a health check on the idle connections of every pool, broken connections are replaced
+    """
+    for pool in list(_pools.values()):
+        pool.check()
+
+
+def close_pools():
+    """
+    Purpose:
+    Close every pool and the connections it holds. Called automatically at interpreter exit
+    """
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+atexit.register(close_pools)
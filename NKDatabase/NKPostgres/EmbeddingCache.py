@@ -0,0 +1,223 @@
+import hashlib
+import sqlite3
+import threading
+from collections.abc import Callable, Iterable, Sequence
+from itertools import islice
+
+import psycopg
+import psycopg.sql as sql
+
+from NKDatabase.NKPostgres.PostgreSQL import stream_query
+from NKDatabase.NKPostgres.Transactions import commit
+from NKDatabase.NKPostgres.VectorApps import VectorApp, get_vector_app
+from NKDatabase.NKPostgres.VectorTypes import register_vector, vector_from_binary, vector_to_binary
+
+
+def text_hash(text: str) -> bytes:
+    """
+    Key of a text in the cache, sha256 of the UTF-8 text.
+    The same as sha256(convert_to(text, 'UTF8')) in PostgreSQL
+    """
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """
+    Purpose:
+    Keeps embeddings on disk keyed by a hash of the embedded text (text_to_embed), so reloading a
+    sleeping table only embeds new or changed texts. The cache can be seeded from the active table
+    of an app that stores the embedded text. Entries are kept per model, changing the model name starts from an empty cache.
+    Vectors are stored in the pgvector binary format and returned like the vector loader returns them
+
+    Argument:
+    filename -->    sqlite file, ":memory:" for a cache living as long as the object
+    model -->       name of the embedding model
+
+    Usage:
+    with EmbeddingCache("embeddings.sqlite", model="text-embedding-3-small") as cache:
+        cache.seed_from_active_table(conn, "nkgpt", "text_to_embed")
+        vectors = cache.get_or_compute(texts, embed_function)
+        print(cache.summary())
+    """
+
+    def __init__(self, filename: str = "embeddings.sqlite", model: str = ""):
+        self.filename = filename
+        self.model = model
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (model TEXT NOT NULL, hash BLOB NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, hash)) WITHOUT ROWID"
+        )
+        self._db.commit()
+        self.hits = 0
+        self.misses = 0
+        self.seeded = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT count(*) FROM embeddings WHERE model = ?", (self.model,)).fetchone()[0]
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def summary(self) -> str:
+        return f"{self.hits} hits, {self.misses} misses ({self.hit_rate:.1%} hit rate), {self.seeded} seeded from the database"
+
+    def _lookup(self, keys: Sequence[bytes]) -> dict[bytes, bytes]:
+        found = {}
+        with self._lock:
+            # stay below the sqlite limit of host parameters
+            for start in range(0, len(keys), 500):
+                part = keys[start : start + 500]
+                rows = self._db.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({', '.join('?' * len(part))})",
+                    (self.model, *part),
+                )
+                found.update(rows)
+        return found
+
+    def _store(self, rows: Iterable[tuple[bytes, bytes]]) -> int:
+        with self._lock:
+            before = self._db.total_changes
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                ((self.model, key, vector) for key, vector in rows),
+            )
+            self._db.commit()
+            return self._db.total_changes - before
+
+    def get(self, text: str):
+        """
+        Returns the cached embedding of a text or None
+        """
+        return self.get_many([text])[0]
+
+    def get_many(self, texts: Iterable[str]) -> list:
+        """
+        Returns the cached embeddings of texts, None for texts not in the cache
+        """
+        keys = [text_hash(text) for text in texts]
+        found = self._lookup(list(set(keys)))
+        vectors = [vector_from_binary(found[key]) if key in found else None for key in keys]
+        hits = sum(vector is not None for vector in vectors)
+        self.hits += hits
+        self.misses += len(vectors) - hits
+        return vectors
+
+    def put(self, text: str, vector):
+        """
+        Stores the embedding of a text
+        """
+        self.put_many([(text, vector)])
+
+    def put_many(self, items: Iterable[tuple[str, object]]):
+        """
+        Stores (text, embedding) pairs, embeddings as NumPy arrays, Vector or sequences of numbers
+        """
+        self._store((text_hash(text), vector_to_binary(vector)) for text, vector in items)
+
+    def get_or_compute(self, texts: Iterable[str], embed: Callable[[list[str]], Sequence], batch_size: int = 100) -> list:
+        """
+        Returns the embeddings of texts, texts missing from the cache are embedded and stored
+
+        Parameters:
+        texts: the texts to embed
+        embed: function embedding a list of texts, called with at most batch_size distinct texts
+        batch_size: texts per call of embed
+        returns the embeddings in the order of texts
+        """
+        texts = list(texts)
+        vectors = self.get_many(texts)
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        computed = {}
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start : start + batch_size]
+            embeddings = embed(batch)
+            if len(embeddings) != len(batch):
+                raise ValueError(f"embed returned {len(embeddings)} embeddings for {len(batch)} texts")
+            encoded = [vector_to_binary(vector) for vector in embeddings]
+            self._store(zip(map(text_hash, batch), encoded))
+            computed.update(zip(batch, map(vector_from_binary, encoded)))
+        return [vector if vector is not None else computed[text] for text, vector in zip(texts, vectors)]
+
+    def seed(self, rows: Iterable[tuple[bytes, object]]) -> int:
+        """
+        Stores embeddings under keys already hashed with text_hash, e.g. hashed by the server
+
+        Parameters:
+        rows: (text_hash of the embedded text, embedding) pairs
+        returns the number of embeddings added or replaced
+        """
+        stored = self._store((bytes(key), vector_to_binary(vector)) for key, vector in rows)
+        self.seeded += stored
+        return stored
+
+    def seed_from_active_table(
+        self, conn: psycopg.Connection, app: str | VectorApp, text_column: str, itersize: int = 2000
+    ) -> int:
+        """
+        Copies the embeddings of the active table of an app into the cache.
+        The texts are hashed by the server, so only hashes and vectors are transferred.
+        Needs a column holding the exact text each embedding was made from; the insert procedures
+        only store content, so the tables have to be extended with such a column first
+
+        Parameters:
+        conn (psycopg.connection): The database connection object.
+        app: name of the app or a VectorApp
+        text_column: column holding the text the embedding was made from, the text get and put are called with
+        itersize: rows fetched per round trip
+        returns the number of embeddings added or replaced
+        """
+        app = get_vector_app(app)
+        register_vector(conn)
+        rows = stream_query(conn, seed_query(app, text_column), itersize=itersize, row_factory="tuple")
+        stored = 0
+        while batch := list(islice(rows, itersize)):
+            stored += self.seed(batch)
+        commit(conn)
+        return stored
+
+
+def seed_query(app: VectorApp, text_column: str) -> sql.Composed:
+    """
+    The query of EmbeddingCache.seed_from_active_table: text_hash of the embedded text and the embedding
+    of every row of the active table
+    """
+    text = sql.Identifier(text_column)
+    return sql.SQL(
+        "SELECT sha256(convert_to({text}, 'UTF8')), {embedding} FROM {table} "
+        "WHERE {text} IS NOT NULL AND {embedding} IS NOT NULL"
+    ).format(text=text, embedding=sql.Identifier(app.embedding_column), table=sql.Identifier(app.schema, app.active_table))
+
+
+def cached_embedder(cache: EmbeddingCache, embed: Callable[[list[str]], Sequence], batch_size: int = 100) -> Callable[[list[str]], list]:
+    """
+    Wraps an embedding function so it goes through the cache
+
+    Parameters:
+    cache: the EmbeddingCache
+    embed: function embedding a list of texts
+    batch_size: texts per call of embed
+    returns a function embedding a list of texts
+    """
+
+    def embed_cached(texts: list[str]) -> list:
+        return cache.get_or_compute(texts, embed, batch_size)
+
+    return embed_cached
+
@@ -0,0 +1,438 @@
+import logging
+import re
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from collections import deque
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Callable, Optional
+
+import psycopg
+import psycopg.sql as sql
+from psycopg.pq import TransactionStatus
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:  # opentelemetry is optional, only needed for opentelemetry_listener
+    otel_trace = None
+
+# Default logger of slow queries, listener errors and log_report
+_logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds of the latency histogram buckets, the last bucket is unbounded
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_SPACE = re.compile(r"\s+")
+# a VALUES list of identical rows, so multi-row inserts of any size share a fingerprint
+_REPEATED_ROWS = re.compile(r"(\([^()]*\))(?:\s*,\s*\1)+")
+
+
+@lru_cache(maxsize=4096)
+def _normalize(text: str) -> str:
+    text = _STRING_LITERAL.sub("?", text)
+    text = _NUMBER.sub("?", text)
+    text = _SPACE.sub(" ", text).strip().rstrip(";").strip()
+    return _REPEATED_ROWS.sub(r"\1", text)
+
+
+def fingerprint(query, conn: Optional[psycopg.Connection] = None) -> str:
+    """
+    Normalizes a statement so executions with different literals are counted together:
+    literals become ?, whitespace is collapsed, a VALUES list of identical rows becomes one row.
+    Parameters (%s) are kept
+
+    Parameters:
+    query: SQL text or composed query
+    conn: connection used to render a composed query
+    returns the fingerprint
+    """
+    if isinstance(query, sql.Composable):
+        query = query.as_string(conn)
+    elif isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    return _normalize(query)
+
+
+class Histogram:
+    """
+    Purpose:
+    Latency histogram with the fixed LATENCY_BUCKETS, quantiles are estimated from the buckets
+    """
+
+    __slots__ = ("counts", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        self.counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """
+        Upper bound of the bucket holding the q quantile, the max for the unbounded bucket
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(LATENCY_BUCKETS[index], self.max) if index < len(LATENCY_BUCKETS) else self.max
+        return self.max
+
+
+@dataclass
+class QueryEvent:
+    """
+    One instrumented statement, passed to the listeners.
+    seconds is the execution time, pool_wait_seconds the time the connection was waited for in the pool
+    when this is the first statement after borrowing it. explain holds the plan of a slow statement
+    """
+
+    fingerprint: str
+    operation: str
+    started_ns: int
+    seconds: float
+    rows: int = -1
+    bytes: int = 0
+    pool_wait_seconds: float = 0.0
+    error: Optional[str] = None
+    slow: bool = False
+    explain: Optional[str] = None
+
+
+@dataclass
+class StatementStats:
+    """
+    Totals per statement fingerprint
+    """
+
+    fingerprint: str
+    calls: int = 0
+    errors: int = 0
+    rows: int = 0
+    bytes: int = 0
+    pool_wait_seconds: float = 0.0
+    latency: Histogram = field(default_factory=Histogram)
+
+    def summary(self) -> str:
+        return (
+            f"{self.calls} calls, {self.latency.total * 1000:.1f}ms total, mean {self.latency.mean * 1000:.2f}ms, "
+            f"p95 {self.latency.quantile(0.95) * 1000:.2f}ms, max {self.latency.max * 1000:.2f}ms, "
+            f"{self.rows} rows, {self.errors} errors: {self.fingerprint[:120]}"
+        )
+
+
+class _NoTrace:
+    """
+    Stands in for a trace while instrumentation is disabled
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set_cursor(self, cursor: psycopg.Cursor):
+        pass
+
+    def set_rows(self, rows: int):
+        pass
+
+
+_NO_TRACE = _NoTrace()
+
+
+class _Trace:
+    __slots__ = ("owner", "conn", "query", "params", "operation", "started", "started_ns", "rows", "bytes")
+
+    def __init__(self, owner: "Instrumentation", conn, query, params, operation: str):
+        self.owner = owner
+        self.conn = conn
+        self.query = query
+        self.params = params
+        self.operation = operation
+        self.rows = -1
+        self.bytes = 0
+
+    def __enter__(self):
+        self.started_ns = time.time_ns()
+        self.started = time.perf_counter()
+        return self
+
+    def set_cursor(self, cursor: psycopg.Cursor | psycopg.AsyncCursor):
+        """
+        Takes rows and bytes from a cursor that executed the statement
+        """
+        self.rows = cursor.rowcount
+        if self.owner.measure_bytes:
+            self.bytes = _result_bytes(cursor)
+
+    def set_rows(self, rows: int):
+        """
+        Sets the rows of a statement whose cursor does not count them, e.g. the rows sent with executemany
+        """
+        self.rows = rows
+
+    def __exit__(self, exc_type, exc, tb):
+        self.owner._finish(self, time.perf_counter() - self.started, exc)
+        return False
+
+
+def _result_bytes(cursor: psycopg.Cursor | psycopg.AsyncCursor) -> int:
+    """
+    Size of the values in the result of the last statement of a cursor
+    """
+    result = cursor.pgresult
+    if result is None:
+        return 0
+    total = 0
+    for row in range(result.ntuples):
+        for column in range(result.nfields):
+            value = result.get_value(row, column)
+            if value is not None:
+                total += len(value)
+    return total
+
+
+class Instrumentation:
+    """
+    Purpose:
+    Records latency, rows, bytes and pool wait time per statement fingerprint for the NKPostgres helpers.
+    Statements slower than slow_query_seconds are kept in slow_queries, with their plan when explain_slow is set,
+    and logged as warnings. Every statement is passed to the listeners as a QueryEvent.
+    Works for sync and asyncio connections, plans are only taken on sync connections. Disabled until enable() is called
+
+    Argument:
+    slow_query_seconds -->  statements taking at least this long are slow, None for no slow query tracing
+    explain_slow -->        run EXPLAIN for slow statements, the plan is not analyzed so nothing is executed twice
+    measure_bytes -->       add up the size of the returned values, costs a pass over the result
+    max_slow_queries -->    number of slow statements kept
+    logger -->              logger of slow queries, listener errors and log_report, default logger of this module
+
+    Usage:
+    instrumentation.enable(slow_query_seconds=0.5)
+    instrumentation.add_listener(opentelemetry_listener())
+    ...
+    instrumentation.log_report()
+    """
+
+    def __init__(
+        self,
+        slow_query_seconds: Optional[float] = 1.0,
+        explain_slow: bool = True,
+        measure_bytes: bool = False,
+        max_slow_queries: int = 100,
+        logger: Optional[logging.Logger] = None,
+    ):
+        self.enabled = False
+        self.logger = logger or _logger
+        self.slow_query_seconds = slow_query_seconds
+        self.explain_slow = explain_slow
+        self.measure_bytes = measure_bytes
+        self.slow_queries: deque[QueryEvent] = deque(maxlen=max_slow_queries)
+        self.pool_wait = Histogram()
+        self._listeners: list[Callable[[QueryEvent], None]] = []
+        self._stats: dict[str, StatementStats] = {}
+        self._pool_waits: "weakref.WeakKeyDictionary[psycopg.Connection, float]" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def enable(self, **options):
+        """
+        Starts recording, options set the attributes of the constructor
+        """
+        for name, value in options.items():
+            if name not in ("slow_query_seconds", "explain_slow", "measure_bytes", "logger"):
+                raise TypeError(f"Unknown option '{name}'")
+            setattr(self, name, value)
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def add_listener(self, listener: Callable[[QueryEvent], None]):
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[QueryEvent], None]):
+        self._listeners.remove(listener)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self.slow_queries.clear()
+            self.pool_wait = Histogram()
+
+    def trace(self, conn: psycopg.Connection, query, params=None, operation: str = ""):
+        """
+        Context manager timing one statement, call set_cursor on it after executing to record rows and bytes
+
+        Usage:
+        with instrumentation.trace(conn, query, params, "fetch_query") as trace:
+            cur.execute(query, params)
+            trace.set_cursor(cur)
+        """
+        if not self.enabled:
+            return _NO_TRACE
+        return _Trace(self, conn, query, params, operation)
+
+    def record_pool_wait(self, conn: psycopg.Connection, seconds: float):
+        """
+        Records the time a connection was waited for, it is added to the next statement on the connection
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self.pool_wait.add(seconds)
+            self._pool_waits[conn] = seconds
+
+    def statistics(self) -> list[StatementStats]:
+        """
+        Returns the statistics per fingerprint, highest total latency first
+        """
+        with self._lock:
+            return sorted(self._stats.values(), key=lambda stats: stats.latency.total, reverse=True)
+
+    def report(self, top: int = 10) -> str:
+        """
+        Returns a text report of the statements with the highest total latency
+        """
+        lines = [stats.summary() for stats in self.statistics()[:top]]
+        if self.pool_wait.count:
+            lines.append(
+                f"pool wait: {self.pool_wait.count} checkouts, mean {self.pool_wait.mean * 1000:.2f}ms, "
+                f"max {self.pool_wait.max * 1000:.2f}ms"
+            )
+        return "\n".join(lines)
+
+    def log_report(self, top: int = 10, level: int = logging.INFO):
+        """
+        Writes report() to the logger
+        """
+        report = self.report(top)
+        if report:
+            self.logger.log(level, "Query statistics:\n%s", report)
+
+    def _finish(self, trace: _Trace, seconds: float, exc: Optional[BaseException]):
+        try:
+            key = fingerprint(trace.query, trace.conn)
+        except Exception:
+            key = str(trace.query)
+        event = QueryEvent(key, trace.operation, trace.started_ns, seconds, trace.rows, trace.bytes)
+        if exc is not None:
+            event.error = f"{type(exc).__name__}: {exc}"
+
+        with self._lock:
+            if trace.conn is not None:
+                event.pool_wait_seconds = self._pool_waits.pop(trace.conn, 0.0)
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = StatementStats(key)
+            stats.calls += 1
+            stats.errors += exc is not None
+            stats.rows += max(trace.rows, 0)
+            stats.bytes += trace.bytes
+            stats.pool_wait_seconds += event.pool_wait_seconds
+            stats.latency.add(seconds)
+
+        if self.slow_query_seconds is not None and seconds >= self.slow_query_seconds:
+            event.slow = True
+            if self.explain_slow and exc is None and isinstance(trace.conn, psycopg.Connection):
+                event.explain = _explain(trace.conn, trace.query, trace.params)
+            self.slow_queries.append(event)
+            self.logger.warning("Slow query (%.1fms, %s): %s", seconds * 1000, trace.operation, key[:200])
+
+        for listener in self._listeners:
+            try:
+                listener(event)
+            except Exception:
+                self.logger.exception("Error in instrumentation listener")
+
+
+_EXPLAINABLE = ("select", "insert", "update", "delete", "with", "values")
+
+
+def _explain(conn: psycopg.Connection, query, params) -> Optional[str]:
+    """
+    Returns the plan of a statement, None when it cannot be explained (e.g. CALL) or the connection is busy
+    """
+    try:
+        text = fingerprint(query, conn)
+        if not text.lower().startswith(_EXPLAINABLE):
+            return None
+        if conn.closed or conn.info.transaction_status not in (TransactionStatus.IDLE, TransactionStatus.INTRANS):
+            return None
+        explain = sql.SQL("EXPLAIN ") + (query if isinstance(query, sql.Composable) else sql.SQL(query))
+        with conn.transaction():
+            with conn.cursor() as cursor:
+                cursor.execute(explain, params)
+                return "\n".join(row[0] for row in cursor.fetchall())
+    except Exception as error:
+        return f"EXPLAIN failed: {error}"
+
+
+def opentelemetry_listener(tracer=None) -> Callable[[QueryEvent], None]:
+    """
+    Creates a listener exporting every statement as an OpenTelemetry client span
+
+    Parameters:
+    tracer: OpenTelemetry tracer, default the tracer of the global tracer provider
+    returns a listener for Instrumentation.add_listener
+    """
+    if otel_trace is None:
+        raise ImportError("opentelemetry_listener needs the opentelemetry-api package")
+    tracer = tracer or otel_trace.get_tracer("NKDatabase.NKPostgres")
+
+    def listener(event: QueryEvent):
+        attributes = {"db.system": "postgresql", "db.statement": event.fingerprint, "db.operation": event.operation}
+        if event.rows >= 0:
+            attributes["db.rows"] = event.rows
+        if event.bytes:
+            attributes["db.bytes"] = event.bytes
+        if event.pool_wait_seconds:
+            attributes["db.pool_wait_ms"] = event.pool_wait_seconds * 1000
+        span = tracer.start_span(
+            event.operation or "query", kind=otel_trace.SpanKind.CLIENT, attributes=attributes, start_time=event.started_ns
+        )
+        if event.error is not None:
+            span.set_status(otel_trace.Status(otel_trace.StatusCode.ERROR, event.error))
+        span.end(end_time=event.started_ns + int(event.seconds * 1e9))
+
+    return listener
+
+
+# The instrumentation used by the NKPostgres helpers
+instrumentation = Instrumentation()
+
+
+def traced(conn: psycopg.Connection | psycopg.AsyncConnection, query, params=None, operation: str = ""):
+    """
+    Instrumentation.trace of the shared instrumentation
+    """
+    return instrumentation.trace(conn, query, params, operation)
+
+
+def record_pool_wait(conn: psycopg.Connection | psycopg.AsyncConnection, seconds: float):
+    """
+    Instrumentation.record_pool_wait of the shared instrumentation
+    """
+    instrumentation.record_pool_wait(conn, seconds)
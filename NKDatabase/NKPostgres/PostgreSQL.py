@@ -1,8 +1,26 @@
 import psycopg
 import psycopg.sql as sql
-from psycopg.rows import dict_row
+from psycopg.pq import TransactionStatus
+from psycopg.rows import dict_row, namedtuple_row, tuple_row
+import uuid
+from collections.abc import Iterable, Iterator, Mapping
+from itertools import islice
 from typing import Optional
 from configparser import ConfigParser
+from NKDatabase.NKPostgres.Instrumentation import traced
+from NKDatabase.NKPostgres.StatementCache import delete_statement, insert_statement, select_statement, update_statement
+from NKDatabase.NKPostgres.Transactions import commit, rollback, savepoint
+from NKDatabase.NKPostgres.VectorTypes import adapt_embedding
+
+# Keys in a database.ini section with these prefixes configure NKDatabase itself
+# (e.g. pool_max_size, replica_hosts) and are never passed on to psycopg.connect
+NK_OPTION_PREFIXES = ("pool_", "replica_")
+
+# Row factories for stream_query and stream_with_conditions, "columnar" is handled separately
+ROW_FACTORIES = {"dict": dict_row, "tuple": tuple_row, "namedtuple": namedtuple_row}
+
+# Columns written by update_or_insert_vectordata and the upsert functions, in parameter order
+VECTORDATA_COLUMNS = ["id", "title", "description", "content", "url", "row_updated", "embedding"]
 
 
 def load_config(filename:str = "database.ini", section:str ="postgresql") -> dict[str, any]:
@@ -35,59 +53,126 @@ def load_config(filename:str = "database.ini", section:str ="postgresql") -> dic
     except Exception:
         raise Exception(f"Section {section} not found in the {filename} file")
 
+
+def connection_kwargs(config: dict[str, any]) -> dict[str, any]:
+    """
+    Purpose:
+    Strip NKDatabase specific options from a configuration so it can be passed to psycopg
+
+    Argument:
+    config -->  return value from load_config(filename, section)
+    """
+    return {key: value for key, value in config.items() if not key.startswith(NK_OPTION_PREFIXES)}
+
+
 def connect(config):
     """
     Purpose:
-    Connect to the PostgreSQL database server
+    Connect to the PostgreSQL database server.
+    Opens a new connection on every call, prefer ConnectionPool.pooled_connection
+    for anything that runs more than once
 
     Argument:
     config -->  return value from load_config(filename, section)
     """
     try:
         # connecting to the PostgreSQL server
-        conn = psycopg.connect(**config)
+        conn = psycopg.connect(**connection_kwargs(config))
         return conn
     except (psycopg.DatabaseError, Exception) as error:
         raise error
 
-def execute_query(conn: psycopg.Connection, query: str, params=None):
-    """Execute a single query"""
-    with conn.cursor() as cur:
-        cur.execute(query, params)
-        conn.commit()
+def execute_query(conn: psycopg.Connection, query: str, params=None, prepare: Optional[bool] = None):
+    """Execute a single query, prepare=True prepares it on the server at once instead of after a few executions.
+    Commits, unless a unit of work is open on the connection, see Transactions"""
+    with savepoint(conn), conn.cursor() as cur, traced(conn, query, params, "execute_query") as trace:
+        cur.execute(query, params, prepare=prepare)
+        trace.set_cursor(cur)
+        commit(conn)
         print("Query executed successfully.")
 
 
-def fetch_query(conn: psycopg.Connection, query: str, params=None):
-    """Execute a query and fetch results"""
+def fetch_query(conn: psycopg.Connection, query: str, params=None, prepare: Optional[bool] = None):
+    """Execute a query and fetch results, see execute_query for prepare"""
     with conn.cursor() as cur:
-        cur.execute(query, params)
+        with traced(conn, query, params, "fetch_query") as trace:
+            cur.execute(query, params, prepare=prepare)
+            trace.set_cursor(cur)
         result = cur.fetchall()
         return result
 
 
 def insert_data(conn: psycopg.Connection, table: str, columns: list[str], values: list[any]):
-    """Insert data into a table"""
-    query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(values))})"
-    execute_query(conn, query, values)
+    """Insert data into a table, table may be schema.table. The statement is cached and prepared, see StatementCache"""
+    execute_query(conn, insert_statement(table, columns), values, prepare=True)
 
 
 def update_data(
     conn: psycopg.Connection, table: str, set_columns: list[str], set_values: list[any], condition_column: str, condition_value: any
 ):
-    """Update data in a table"""
-    set_clause = ", ".join([f"{col} = %s" for col in set_columns])
-    query = f"UPDATE {table} SET {set_clause} WHERE {condition_column} = %s"
-    execute_query(conn, query, set_values + [condition_value])
+    """Update data in a table, table may be schema.table. The statement is cached and prepared, see StatementCache"""
+    execute_query(conn, update_statement(table, set_columns, [condition_column]), list(set_values) + [condition_value], prepare=True)
 
 
 def delete_data(conn: psycopg.Connection, table: str, condition_column: str, condition_value: any):
-    """Delete data from a table"""
-    query = f"DELETE FROM {table} WHERE {condition_column} = %s"
-    execute_query(conn, query, (condition_value,))
+    """Delete data from a table, table may be schema.table. The statement is cached and prepared, see StatementCache"""
+    execute_query(conn, delete_statement(table, [condition_column]), (condition_value,), prepare=True)
+
+
+def _select_query(
+    schema_name: str, table_name: str, where_conditions: Optional[dict[str, any]] = None, columns: Optional[list[str]] = None
+) -> tuple[sql.Composed, list]:
+    """
+    Builds SELECT for select_with_conditions and stream_with_conditions, returns the query and its parameters.
+    The query comes from the statement cache
+    """
+    if not where_conditions:
+        return select_statement(schema_name, table_name, (), columns), []
+    return select_statement(schema_name, table_name, where_conditions.keys(), columns), list(where_conditions.values())
+
+
+def stale_plan(error: psycopg.Error) -> bool:
+    """
+    True for the error of a prepared SELECT * whose table was altered after it was prepared,
+    e.g. from another connection of the pool
+    """
+    return isinstance(error, psycopg.errors.FeatureNotSupported) and "cached plan must not change result type" in str(error)
 
 
-def select_with_conditions(conn: psycopg.Connection, schema_name: str, table_name: str, where_conditions: dict[str, any] = None):
+def discard_prepared(conn: psycopg.Connection):
+    """
+    Drops the prepared statements of a connection, the failed transaction is rolled back first
+    """
+    if conn.info.transaction_status == TransactionStatus.INERROR:
+        # rollback() also deallocates the prepared statements
+        conn.rollback()
+    else:
+        conn.execute("DEALLOCATE ALL")
+
+
+def _execute_select(cursor: psycopg.Cursor, query, params: list):
+    """
+    Executes a prepared SELECT of select_with_conditions. When the prepared plan is stale it is dropped and the SELECT
+    runs once more, unless the caller had a transaction open; that transaction is aborted and must be rolled back first
+    """
+    conn = cursor.connection
+    idle = conn.info.transaction_status == TransactionStatus.IDLE
+    try:
+        cursor.execute(query, params or None, prepare=True)
+    except psycopg.Error as error:
+        if not (idle and stale_plan(error)):
+            raise
+        discard_prepared(conn)
+        cursor.execute(query, params or None, prepare=True)
+
+
+def select_with_conditions(
+    conn: psycopg.Connection,
+    schema_name: str,
+    table_name: str,
+    where_conditions: dict[str, any] = None,
+    columns: Optional[list[str]] = None,
+):
     """
     Select rows from a table with dynamic WHERE conditions.
 
@@ -96,30 +181,17 @@ def select_with_conditions(conn: psycopg.Connection, schema_name: str, table_nam
     schema_name (str): The schema name of the table.
     table_name (str): The name of the table to query.
     where_conditions (dict): A dictionary of columns and their values to filter by.
+    columns (list): Columns to return, all columns when None.
 
     Returns:
     list: A list of dictionaries representing the rows that match the conditions.
     """
     try:
         with conn.cursor(row_factory=dict_row) as cursor:
-            # Start building the query
-            query = sql.SQL("SELECT * FROM {schema}.{table}").format(
-                schema=sql.Identifier(schema_name), table=sql.Identifier(table_name)
-            )
-
-            # If there are conditions, build the WHERE clause
-            if where_conditions:
-                conditions = [
-                    sql.SQL("{} = %s").format(sql.Identifier(k))
-                    for k in where_conditions.keys()
-                ]
-
-                query = query + sql.SQL(" WHERE ") + sql.SQL(" AND ").join(conditions)
-
-                # Execute the query
-                cursor.execute(query, list(where_conditions.values()))
-            else:
-                cursor.execute(query)
+            query, params = _select_query(schema_name, table_name, where_conditions, columns)
+            with traced(conn, query, params, "select_with_conditions") as trace:
+                _execute_select(cursor, query, params)
+                trace.set_cursor(cursor)
 
             # Fetch all the rows
             rows = cursor.fetchall()
@@ -129,6 +201,68 @@ def select_with_conditions(conn: psycopg.Connection, schema_name: str, table_nam
         raise error
 
 
+def stream_query(
+    conn: psycopg.Connection, query, params=None, itersize: int = 2000, row_factory: str = "dict"
+) -> Iterator:
+    """
+    Execute a query with a server-side cursor and yield the results, memory use does not grow with the result.
+
+    Parameters:
+    conn (psycopg.connection): The database connection object.
+    query: SQL text or composed query.
+    params: query parameters.
+    itersize (int): rows fetched from the server per round trip.
+    row_factory (str): dict, tuple or namedtuple to yield one row at a time,
+                       columnar to yield one dict of column name -> list of values per itersize rows.
+
+    The cursor lives in the current transaction, in autocommit mode a transaction is opened for the scan.
+    Stop iterating early with close() on the generator or by leaving a with/for block.
+    """
+    if row_factory != "columnar" and row_factory not in ROW_FACTORIES:
+        raise ValueError(f"Unknown row_factory '{row_factory}'. Must be one of: {sorted(ROW_FACTORIES) + ['columnar']}")
+
+    if conn.autocommit:
+        with conn.transaction():
+            yield from _stream_cursor(conn, query, params, itersize, row_factory)
+    else:
+        yield from _stream_cursor(conn, query, params, itersize, row_factory)
+
+
+def _stream_cursor(conn: psycopg.Connection, query, params, itersize: int, row_factory: str) -> Iterator:
+    factory = tuple_row if row_factory == "columnar" else ROW_FACTORIES[row_factory]
+    with conn.cursor(name=f"nk_stream_{uuid.uuid4().hex}", row_factory=factory) as cursor:
+        cursor.itersize = itersize
+        cursor.execute(query, params)
+        if row_factory != "columnar":
+            yield from cursor
+            return
+
+        names = [column.name for column in cursor.description]
+        while rows := cursor.fetchmany(itersize):
+            yield {name: list(values) for name, values in zip(names, zip(*rows))}
+
+
+def stream_with_conditions(
+    conn: psycopg.Connection,
+    schema_name: str,
+    table_name: str,
+    where_conditions: dict[str, any] = None,
+    columns: Optional[list[str]] = None,
+    itersize: int = 2000,
+    row_factory: str = "dict",
+) -> Iterator:
+    """
+    select_with_conditions with a server-side cursor, rows are yielded instead of returned as a list.
+    See stream_query for itersize and row_factory
+
+    Usage:
+    for row in stream_with_conditions(conn, "nkgpt", "items", columns=["id", "embedding"]):
+        ...
+    """
+    query, params = _select_query(schema_name, table_name, where_conditions, columns)
+    yield from stream_query(conn, query, params or None, itersize, row_factory)
+
+
 def update_or_insert_vectordata(
     conn: psycopg.Connection,
     schema_name,
@@ -141,6 +275,7 @@ def update_or_insert_vectordata(
     row_updated,
     embedded,
     conditions: Optional[str] = None,
+    upsert: bool = False,
 ) -> bool:
     """
     Updates vector data
@@ -155,15 +290,21 @@ def update_or_insert_vectordata(
         content = content of the document
         url = url of the document
         row_updated = datetime typically now()
-        embedded = embedded text
+        embedded = embedding as text, or as NumPy float32 array / buffer which is sent in binary
+        conditions = columns and values identifying the existing row
+        upsert = write with a single INSERT ... ON CONFLICT (id) statement instead, see upsert_vectordata.
+                 conditions are not used then, the row is matched on id
 
     Returns:
         true when update or insert is succesfull
     """
+    if upsert:
+        return upsert_vectordata(conn, schema_name, table_name, id, title, description, content, url, row_updated, embedded)
 
     try:
+        embedded = adapt_embedding(conn, embedded)
         results = select_with_conditions(conn, schema_name, table_name, conditions)
-        conn.commit()
+        commit(conn)
 
         if len(results) == 0:
             print("inserting")
@@ -200,9 +341,132 @@ def update_or_insert_vectordata(
                 id,
             )
 
-        conn.commit()
+        commit(conn)
+
+        return True
+    except Exception as error:
+        print(f"Error executing query: {error}")
+        return False
+
+
+def _upsert_vectordata_query(schema_name: str, table_name: str, rows: int, force_embedding: bool) -> sql.Composed:
+    """
+    Builds INSERT ... ON CONFLICT (id) DO UPDATE for rows rows of VECTORDATA_COLUMNS
+    """
+    row = sql.SQL("({})").format(sql.SQL(", ").join([sql.Placeholder()] * len(VECTORDATA_COLUMNS)))
+    updates = [
+        sql.SQL("{column} = EXCLUDED.{column}").format(column=sql.Identifier(column))
+        for column in VECTORDATA_COLUMNS
+        if column not in ("id", "embedding")
+    ]
+    if force_embedding:
+        updates.append(sql.SQL("embedding = EXCLUDED.embedding"))
+    else:
+        # Keeping the stored value also keeps its TOAST pointer, the vector is not written again
+        updates.append(
+            sql.SQL(
+                "embedding = CASE WHEN t.content IS DISTINCT FROM EXCLUDED.content OR t.embedding IS NULL "
+                "THEN EXCLUDED.embedding ELSE t.embedding END"
+            )
+        )
+    return sql.SQL("INSERT INTO {table} AS t ({columns}) VALUES {rows} ON CONFLICT (id) DO UPDATE SET {updates}").format(
+        table=sql.Identifier(schema_name, table_name),
+        columns=sql.SQL(", ").join(map(sql.Identifier, VECTORDATA_COLUMNS)),
+        rows=sql.SQL(", ").join([row] * rows),
+        updates=sql.SQL(", ").join(updates),
+    )
+
+
+def upsert_vectordata(
+    conn: psycopg.Connection,
+    schema_name,
+    table_name,
+    id,
+    title,
+    description,
+    content,
+    url,
+    row_updated,
+    embedded,
+    force_embedding: bool = False,
+) -> bool:
+    """
+    Inserts or updates vector data in one statement and one transaction.
+    The table must have a unique constraint on id. The stored embedding is kept when content is unchanged
+
+    Parameters:
+        conn (psycopg.connection): The database connection object.
+        schema_name (str): The schema name of the table.
+        table_name (str): The name of the table.
+        id ... embedded: see update_or_insert_vectordata
+        force_embedding: write the embedding even when content is unchanged, e.g. after changing embedding model
 
+    Returns:
+        true when update or insert is succesfull
+    """
+    try:
+        query = _upsert_vectordata_query(schema_name, table_name, 1, force_embedding)
+        values = [id, title, description, content, url, row_updated, adapt_embedding(conn, embedded)]
+        with savepoint(conn), conn.cursor() as cursor, traced(conn, query, values, "upsert_vectordata") as trace:
+            cursor.execute(query, values)
+            trace.set_cursor(cursor)
+        commit(conn)
         return True
     except Exception as error:
+        rollback(conn)
         print(f"Error executing query: {error}")
         return False
+
+
+def upsert_vectordata_batch(
+    conn: psycopg.Connection,
+    schema_name: str,
+    table_name: str,
+    rows: Iterable,
+    batch_size: int = 500,
+    force_embedding: bool = False,
+) -> int:
+    """
+    Inserts or updates many rows of vector data with one statement and one commit per batch, see upsert_vectordata.
+    When a batch holds the same id more than once the last row wins
+
+    Parameters:
+        conn (psycopg.connection): The database connection object.
+        schema_name (str): The schema name of the table.
+        table_name (str): The name of the table.
+        rows: sequences in VECTORDATA_COLUMNS order or mappings with those keys
+        batch_size: rows per statement
+        force_embedding: write the embeddings even when content is unchanged
+
+    Returns:
+        number of rows inserted or updated, a failing batch is rolled back and raises
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+
+    written = 0
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        by_id = {}
+        for row in batch:
+            values = [row[column] for column in VECTORDATA_COLUMNS] if isinstance(row, Mapping) else list(row)
+            if len(values) != len(VECTORDATA_COLUMNS):
+                raise ValueError(f"Expected {len(VECTORDATA_COLUMNS)} values, got {len(values)}")
+            values[-1] = adapt_embedding(conn, values[-1])
+            by_id[values[0]] = values
+
+        query = _upsert_vectordata_query(schema_name, table_name, len(by_id), force_embedding)
+        try:
+            params = [value for values in by_id.values() for value in values]
+            with savepoint(conn), conn.cursor() as cursor, traced(conn, query, params, "upsert_vectordata_batch") as trace:
+                cursor.execute(query, params)
+                trace.set_cursor(cursor)
+                written += cursor.rowcount
+            commit(conn)
+        except Exception:
+            rollback(conn)
+            raise
+    return written
@@ -0,0 +1,411 @@
+import atexit
+import contextvars
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+import psycopg
+from psycopg_pool import ConnectionPool, PoolTimeout
+
+from NKDatabase.NKPostgres.ConnectionPool import TRUE_VALUES, open_pool, pooled_connection
+from NKDatabase.NKPostgres.PostgreSQL import execute_query, fetch_query, load_config, select_with_conditions
+from NKDatabase.NKPostgres.Transactions import connection_database, database_key, last_write_time
+from NKDatabase.NKPostgres.VectorSearch import SearchResult, search_many
+
+STRATEGIES = ("least_loaded", "round_robin")
+
+# Defaults used when the ini section does not set a value
+DEFAULT_STRATEGY = "least_loaded"
+DEFAULT_REPLICA_TIMEOUT = 2.0
+DEFAULT_COOLDOWN = 30.0
+DEFAULT_PIN_SECONDS = 5.0
+
+_routers: dict[tuple[str, str], "ReplicaRouter"] = {}
+_routers_lock = threading.Lock()
+
+
+def replica_options(config: dict[str, any]) -> dict[str, any]:
+    """
+    Purpose:
+    Read replica settings from a database.ini section
+
+    Argument:
+    config -->  return value from load_config(filename, section).
+                Recognised keys are replica_hosts (comma separated host or host:port),
+                replica_strategy (least_loaded or round_robin), replica_timeout (seconds to wait for a replica
+                connection before failing over), replica_cooldown (seconds a failed replica is skipped),
+                replica_pin_seconds (seconds reads stay on the primary after a write) and
+                replica_fallback (yes/no, read from the primary when every replica is down)
+
+    returns a dict with the keys hosts, strategy, timeout, cooldown, pin_seconds and fallback for the keys present
+    """
+    options = {}
+    if "replica_hosts" in config:
+        options["hosts"] = [host.strip() for host in config["replica_hosts"].split(",") if host.strip()]
+    if "replica_strategy" in config:
+        options["strategy"] = config["replica_strategy"].strip().lower()
+    if "replica_timeout" in config:
+        options["timeout"] = float(config["replica_timeout"])
+    if "replica_cooldown" in config:
+        options["cooldown"] = float(config["replica_cooldown"])
+    if "replica_pin_seconds" in config:
+        options["pin_seconds"] = float(config["replica_pin_seconds"])
+    if "replica_fallback" in config:
+        options["fallback"] = config["replica_fallback"].lower() in TRUE_VALUES
+    return options
+
+
+def replica_config(config: dict[str, any], host: str) -> dict[str, any]:
+    """
+    Purpose:
+    Connection configuration of a replica: the primary configuration with host and port replaced
+
+    Argument:
+    config -->  return value from load_config(filename, section)
+    host -->    host or host:port of the replica, the port of the primary is used when none is given
+    """
+    replica = dict(config)
+    name, separator, port = host.rpartition(":")
+    if separator and port.isdigit() and name:
+        replica["host"] = name.strip("[]")
+        replica["port"] = port
+    else:
+        replica["host"] = host
+    return replica
+
+
+@dataclass
+class _Replica:
+    """
+    A replica pool with its load and health
+    """
+
+    host: str
+    pool: ConnectionPool
+    in_use: int = 0
+    reads: int = 0
+    failures: int = 0
+    down_until: float = 0.0
+
+
+class ReplicaRouter:
+    """
+    Purpose:
+    Routes read-only work to the replica hosts of a database.ini section and writes to the primary.
+    Replicas are picked least loaded (fewest borrowed connections) or round robin. A replica that cannot be
+    connected to within replica_timeout, or whose connection breaks, is skipped for replica_cooldown seconds
+    and the read fails over to the next one, and to the primary when all are down. A replica whose connections
+    are all in use is only passed over for this read. Errors of the statements in the read block are raised
+    without failing over.
+    After a write the reads of the same thread or asyncio task go to the primary for pin_seconds, so they see
+    their own writes despite replication lag. A write is a block of write_connection, a call of pin, or any
+    commit of the NKDatabase helpers (insert_data, upsert_vectordata, the bulk loads, unit_of_work, ...)
+    on a connection to the primary database of the router (same host, port and dbname),
+    see Transactions.record_write. Without replica_hosts every read goes to the primary pool
+
+    Argument:
+    filename -->    File containing connection values, default database.ini
+    section -->     Section name of ini file, default is postgresql
+    strategy, timeout, cooldown, pin_seconds, fallback --> override the replica_ keys of the section
+    pool_kwargs --> Passed on to the pools, see ConnectionPool.get_pool
+
+    Usage:
+    router = get_router("database.ini")
+    rows = router.fetch_query("SELECT id FROM public.nkinitvalues")
+    with router.write_connection() as conn:
+        insert_data(conn, "public.nkinitvalues", columns, values)
+    router.select_with_conditions("public", "nkinitvalues", {"id": appname})   # read on the primary
+    """
+
+    def __init__(
+        self,
+        filename: str = "database.ini",
+        section: str = "postgresql",
+        strategy: Optional[str] = None,
+        timeout: Optional[float] = None,
+        cooldown: Optional[float] = None,
+        pin_seconds: Optional[float] = None,
+        fallback: Optional[bool] = None,
+        **pool_kwargs,
+    ):
+        config = load_config(filename=filename, section=section)
+        options = {
+            "hosts": [],
+            "strategy": DEFAULT_STRATEGY,
+            "timeout": DEFAULT_REPLICA_TIMEOUT,
+            "cooldown": DEFAULT_COOLDOWN,
+            "pin_seconds": DEFAULT_PIN_SECONDS,
+            "fallback": True,
+        }
+        options.update(replica_options(config))
+        explicit = {"strategy": strategy, "timeout": timeout, "cooldown": cooldown, "pin_seconds": pin_seconds, "fallback": fallback}
+        options.update({option: value for option, value in explicit.items() if value is not None})
+        if options["strategy"] not in STRATEGIES:
+            raise ValueError(f"Unknown replica strategy '{options['strategy']}'. Must be one of: {list(STRATEGIES)}")
+
+        self.filename = filename
+        self.section = section
+        self.strategy = options["strategy"]
+        self.timeout = options["timeout"]
+        self.cooldown = options["cooldown"]
+        self.pin_seconds = options["pin_seconds"]
+        self.fallback = options["fallback"]
+        self.primary_reads = 0
+        # database_key of the primary, replaced by the values of the server once a primary connection is borrowed
+        self.database = database_key(config.get("host"), config.get("port"), config.get("dbname"))
+        self._pool_kwargs = pool_kwargs
+        self._lock = threading.Lock()
+        self._turn = itertools.count()
+        self._pinned_until = contextvars.ContextVar(f"nk_pinned_until_{id(self)}", default=0.0)
+        self._unpinned_at = contextvars.ContextVar(f"nk_unpinned_at_{id(self)}", default=0.0)
+        self.replicas = [
+            _Replica(host, open_pool(replica_config(config, host), f"{section}@{host}", **pool_kwargs))
+            for host in options["hosts"]
+        ]
+
+    def pin(self, seconds: Optional[float] = None):
+        """
+        Send the reads of the current thread or asyncio task to the primary for seconds, default pin_seconds
+        """
+        self._pinned_until.set(time.monotonic() + (self.pin_seconds if seconds is None else seconds))
+
+    def unpin(self):
+        """
+        Let the reads of the current thread or asyncio task go to the replicas again, also after earlier commits
+        """
+        self._pinned_until.set(0.0)
+        self._unpinned_at.set(time.monotonic())
+
+    def pinned(self) -> bool:
+        """
+        True when the reads of the current thread or asyncio task go to the primary
+        """
+        now = time.monotonic()
+        if self._pinned_until.get() > now:
+            return True
+        written = last_write_time(self.database)
+        return written > self._unpinned_at.get() and written + self.pin_seconds > now
+
+    def _candidates(self) -> list[_Replica]:
+        """
+        The healthy replicas in the order they are tried
+        """
+        now = time.monotonic()
+        with self._lock:
+            healthy = [replica for replica in self.replicas if replica.down_until <= now]
+            if not healthy:
+                return []
+            start = next(self._turn) % len(healthy)
+            ordered = healthy[start:] + healthy[:start]
+            if self.strategy == "least_loaded":
+                # stable sort, replicas with equal load take turns
+                ordered.sort(key=lambda replica: replica.in_use)
+            return ordered
+
+    def _saturated(self, replica: _Replica) -> bool:
+        """
+        True when every connection of the replica pool is borrowed by the router
+        """
+        with self._lock:
+            return replica.in_use >= replica.pool.max_size
+
+    def _mark_down(self, replica: _Replica, error: Exception | str):
+        with self._lock:
+            replica.failures += 1
+            replica.down_until = time.monotonic() + self.cooldown
+        print(f"Replica {replica.host} skipped for {self.cooldown:g} seconds: {error}")
+
+    @contextmanager
+    def primary_connection(self) -> Iterator[psycopg.Connection]:
+        """
+        Borrow a connection to the primary, see ConnectionPool.pooled_connection
+        """
+        with pooled_connection(self.filename, self.section, **self._pool_kwargs) as conn:
+            self.database = connection_database(conn)
+            yield conn
+
+    @contextmanager
+    def write_connection(self) -> Iterator[psycopg.Connection]:
+        """
+        Borrow a connection to the primary and pin the reads of the caller to the primary
+        when the block exits normally
+        """
+        with self.primary_connection() as conn:
+            yield conn
+        self.pin()
+
+    @contextmanager
+    def read_connection(self) -> Iterator[psycopg.Connection]:
+        """
+        Borrow a connection for read-only work: a replica, or the primary when the caller is pinned,
+        there are no replicas or no replica is available and fallback is on.
+        Raises psycopg_pool.PoolTimeout when no replica is available and fallback is off
+        """
+        if self.replicas and not self.pinned():
+            for replica in self._candidates():
+                acquired = False
+                try:
+                    with replica.pool.connection(timeout=self.timeout) as conn:
+                        acquired = True
+                        with self._lock:
+                            replica.in_use += 1
+                            replica.reads += 1
+                        try:
+                            yield conn
+                        finally:
+                            with self._lock:
+                                replica.in_use -= 1
+                            if conn.broken:
+                                self._mark_down(replica, "connection broken")
+                    return
+                except psycopg.OperationalError as error:
+                    if acquired:
+                        # an error of the caller's statements, the read is not repeated elsewhere
+                        raise
+                    if isinstance(error, PoolTimeout) and self._saturated(replica):
+                        # busy, not down: try the next replica without a cooldown
+                        continue
+                    self._mark_down(replica, error)
+            if not self.fallback:
+                raise PoolTimeout(f"No replica of section {self.section} in {self.filename} is available")
+
+        with self._lock:
+            self.primary_reads += 1
+        with self.primary_connection() as conn:
+            yield conn
+
+    def fetch_query(self, query: str, params=None, prepare: Optional[bool] = None):
+        """
+        PostgreSQL.fetch_query on a read connection
+        """
+        with self.read_connection() as conn:
+            return fetch_query(conn, query, params, prepare)
+
+    def select_with_conditions(self, schema_name: str, table_name: str, where_conditions: dict[str, any] = None):
+        """
+        PostgreSQL.select_with_conditions on a read connection
+        """
+        with self.read_connection() as conn:
+            return select_with_conditions(conn, schema_name, table_name, where_conditions)
+
+    def search(self, app, query_vector, k: int = 10, **search_kwargs) -> list[SearchResult]:
+        """
+        VectorSearch.search on a read connection
+        """
+        return self.search_many(app, [query_vector], k, **search_kwargs)[0]
+
+    def search_many(self, app, query_vectors, k: int = 10, **search_kwargs) -> list[list[SearchResult]]:
+        """
+        VectorSearch.search_many on a read connection
+        """
+        with self.read_connection() as conn:
+            return search_many(conn, app, query_vectors, k, **search_kwargs)
+
+    def execute_query(self, query: str, params=None, prepare: Optional[bool] = None):
+        """
+        PostgreSQL.execute_query on the primary, pins the reads of the caller to the primary
+        """
+        with self.write_connection() as conn:
+            execute_query(conn, query, params, prepare)
+
+    def statistics(self) -> list[dict[str, any]]:
+        """
+        Load and health per replica: host, in_use, reads, failures and down (seconds left in the cooldown)
+        """
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "host": replica.host,
+                    "in_use": replica.in_use,
+                    "reads": replica.reads,
+                    "failures": replica.failures,
+                    "down": max(0.0, replica.down_until - now),
+                }
+                for replica in self.replicas
+            ]
+
+    def close(self):
+        """
+        Close the replica pools, the primary pool belongs to ConnectionPool
+        """
+        for replica in self.replicas:
+            replica.pool.close()
+
+
+def get_router(filename: str = "database.ini", section: str = "postgresql", **router_kwargs) -> ReplicaRouter:
+    """
+    Purpose:
+    Get the process wide ReplicaRouter for a database.ini section, creating it on first use
+
+    Argument:
+    filename -->        File containing connection values, default database.ini
+    section -->         Section name of ini file, default is postgresql
+    router_kwargs -->   Passed on to ReplicaRouter when the router is created
+    """
+    key = (os.path.abspath(filename), section)
+    router = _routers.get(key)
+    if router is not None:
+        return router
+
+    with _routers_lock:
+        router = _routers.get(key)
+        if router is None:
+            router = ReplicaRouter(filename, section, **router_kwargs)
+            _routers[key] = router
+    return router
+
+
+@contextmanager
+def read_connection(filename: str = "database.ini", section: str = "postgresql") -> Iterator[psycopg.Connection]:
+    """
+    Purpose:
+    Borrow a connection for read-only work from the router of the section, see ReplicaRouter.read_connection
+
+    Usage:
+    with read_connection("database.ini") as conn:
+        rows = select_with_conditions(conn, "public", "nkinitvalues")
+    """
+    with get_router(filename, section).read_connection() as conn:
+        yield conn
+
+
+@contextmanager
+def primary_connection(filename: str = "database.ini", section: str = "postgresql") -> Iterator[psycopg.Connection]:
+    """
+    Purpose:
+    Borrow a connection to the primary for reads that must not lag behind, without pinning,
+    see ReplicaRouter.primary_connection
+    """
+    with get_router(filename, section).primary_connection() as conn:
+        yield conn
+
+
+@contextmanager
+def write_connection(filename: str = "database.ini", section: str = "postgresql") -> Iterator[psycopg.Connection]:
+    """
+    Purpose:
+    Borrow a connection to the primary and pin the reads of the caller to it afterwards,
+    see ReplicaRouter.write_connection
+    """
+    with get_router(filename, section).write_connection() as conn:
+        yield conn
+
+
+def close_routers():
+    """
+    Purpose:
+    Close every router and its replica pools. Called automatically at interpreter exit
+    """
+    with _routers_lock:
+        routers = list(_routers.values())
+        _routers.clear()
+    for router in routers:
+        router.close()
+
+
+atexit.register(close_routers)
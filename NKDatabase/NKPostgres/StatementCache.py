@@ -0,0 +1,154 @@
+import threading
+from collections import OrderedDict
+from collections.abc import Iterable
+from typing import Callable, Optional
+
+import psycopg.sql as sql
+
+DEFAULT_MAX_SIZE = 256
+
+
+class StatementCache:
+    """
+    Purpose:
+    Bounded LRU cache of composed statements, so the CRUD helpers build the SQL for a table, column set
+    and condition set once. The statements are executed with prepare=True, the server then parses and plans
+    them once per connection. Set prepare_threshold = None on a connection to turn server-side preparing off,
+    e.g. behind a pgbouncer in transaction mode. A prepared SELECT * goes stale when its table is altered,
+    select_with_conditions then drops the prepared statements of the connection and runs it once more
+
+    Argument:
+    max_size -->    number of statements kept
+
+    Contains:
+    hits, misses -> lookups served from the cache and statements built
+    """
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        self._statements: OrderedDict[tuple, sql.Composed] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._statements)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, key: tuple, build: Callable[[], sql.Composed]) -> sql.Composed:
+        """
+        Returns the statement for key, building it with build() when it is not cached
+        """
+        with self._lock:
+            statement = self._statements.get(key)
+            if statement is not None:
+                self.hits += 1
+                self._statements.move_to_end(key)
+                return statement
+            self.misses += 1
+
+        statement = build()
+        with self._lock:
+            self._statements[key] = statement
+            while len(self._statements) > self.max_size:
+                self._statements.popitem(last=False)
+        return statement
+
+    def clear(self):
+        with self._lock:
+            self._statements.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+# The cache used by the helpers in PostgreSQL and AsyncPostgreSQL
+statement_cache = StatementCache()
+
+
+def table_identifier(table: str) -> sql.Identifier:
+    """
+    Quotes a table name, "schema.table" is split into schema and table.
+    Names are quoted as given, so they are case sensitive
+
+    Parameters:
+    table: table or schema.table
+    returns the identifier
+    """
+    return sql.Identifier(*table.split("."))
+
+
+def _column_list(columns: Iterable[str]) -> sql.Composed:
+    return sql.SQL(", ").join(map(sql.Identifier, columns))
+
+
+def _conditions(columns: Iterable[str]) -> sql.Composed:
+    return sql.SQL(" AND ").join(sql.SQL("{} = %s").format(sql.Identifier(column)) for column in columns)
+
+
+def insert_statement(table: str, columns: Iterable[str]) -> sql.Composed:
+    """
+    INSERT INTO table (columns) VALUES (%s, ...)
+    """
+    columns = tuple(columns)
+    return statement_cache.get(
+        ("insert", table, columns, ()),
+        lambda: sql.SQL("INSERT INTO {table} ({columns}) VALUES ({values})").format(
+            table=table_identifier(table),
+            columns=_column_list(columns),
+            values=sql.SQL(", ").join([sql.Placeholder()] * len(columns)),
+        ),
+    )
+
+
+def update_statement(table: str, set_columns: Iterable[str], condition_columns: Iterable[str]) -> sql.Composed:
+    """
+    UPDATE table SET column = %s, ... WHERE condition = %s AND ...
+    """
+    set_columns = tuple(set_columns)
+    condition_columns = tuple(condition_columns)
+    return statement_cache.get(
+        ("update", table, set_columns, condition_columns),
+        lambda: sql.SQL("UPDATE {table} SET {assignments} WHERE {conditions}").format(
+            table=table_identifier(table),
+            assignments=sql.SQL(", ").join(sql.SQL("{} = %s").format(sql.Identifier(column)) for column in set_columns),
+            conditions=_conditions(condition_columns),
+        ),
+    )
+
+
+def delete_statement(table: str, condition_columns: Iterable[str]) -> sql.Composed:
+    """
+    DELETE FROM table WHERE condition = %s AND ...
+    """
+    condition_columns = tuple(condition_columns)
+    return statement_cache.get(
+        ("delete", table, (), condition_columns),
+        lambda: sql.SQL("DELETE FROM {table} WHERE {conditions}").format(
+            table=table_identifier(table), conditions=_conditions(condition_columns)
+        ),
+    )
+
+
+def select_statement(
+    schema_name: str, table_name: str, condition_columns: Iterable[str] = (), columns: Optional[Iterable[str]] = None
+) -> sql.Composed:
+    """
+    SELECT columns FROM schema.table [WHERE condition = %s AND ...], all columns when columns is None
+    """
+    condition_columns = tuple(condition_columns)
+    columns = tuple(columns) if columns else ()
+
+    def build() -> sql.Composed:
+        query = sql.SQL("SELECT {columns} FROM {table}").format(
+            columns=_column_list(columns) if columns else sql.SQL("*"),
+            table=sql.Identifier(schema_name, table_name),
+        )
+        if condition_columns:
+            query = query + sql.SQL(" WHERE ") + _conditions(condition_columns)
+        return query
+
+    return statement_cache.get(("select", (schema_name, table_name), columns, condition_columns), build)
@@ -0,0 +1,205 @@
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+import psycopg
+import psycopg.errors
+import psycopg.sql as sql
+
+from NKDatabase.NKPostgres.Instrumentation import traced
+from NKDatabase.NKPostgres.Transactions import record_write
+from NKDatabase.NKPostgres.VectorApps import VectorApp, get_vector_app
+from NKDatabase.NKPostgres.VectorIndexes import check_indexes
+from NKDatabase.NKPostgres.VectorSearch import search_many
+
+
+@dataclass
+class SwitchReport:
+    """
+    Outcome of switch_tables, times are in seconds.
+    lock_wait_seconds is the wait for the table locks in the successful attempt,
+    switch_seconds the time from requesting the locks to the commit, i.e. how long readers could be blocked
+    """
+
+    app: str
+    switched: bool = False
+    problems: list[str] = field(default_factory=list)
+    active_rows: int = 0
+    sleeping_rows: int = 0
+    recall: Optional[float] = None
+    attempts: int = 0
+    lock_wait_seconds: float = 0.0
+    switch_seconds: float = 0.0
+    validation_seconds: float = 0.0
+
+    def summary(self) -> str:
+        if not self.switched:
+            return f"{self.app} not switched: {'; '.join(self.problems)}"
+        recall = f", recall {self.recall:.3f}" if self.recall is not None else ""
+        return (
+            f"{self.app} switched to {self.sleeping_rows} rows (was {self.active_rows}){recall} after {self.attempts} attempts, "
+            f"lock wait {self.lock_wait_seconds * 1000:.1f}ms, switch {self.switch_seconds * 1000:.1f}ms, "
+            f"validation {self.validation_seconds:.2f}s"
+        )
+
+
+def _count_rows(cursor: psycopg.Cursor, app: VectorApp, table: str) -> int:
+    query = sql.SQL("SELECT count(*) FROM {}").format(sql.Identifier(app.schema, table))
+    with traced(cursor.connection, query, None, "switch_tables"):
+        cursor.execute(query)
+    return cursor.fetchone()[0]
+
+
+def sample_recall(
+    conn: psycopg.Connection,
+    app: str | VectorApp,
+    sample_size: int = 20,
+    k: int = 10,
+    metric: str = "cosine",
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None,
+) -> Optional[float]:
+    """
+    Measures the recall of the vector index of the sleeping table: embeddings of random rows are searched
+    with the index and by an exact scan, recall is the share of the exact results the index finds
+
+    Parameters:
+    conn (psycopg.connection): The database connection object.
+    app: name of the app or a VectorApp
+    sample_size: number of query vectors taken from the table
+    k: results per query
+    metric, ef_search, probes: see VectorSearch.search
+    returns the recall between 0 and 1, None when the table has no embeddings
+    """
+    app = get_vector_app(app)
+    with conn.transaction():
+        with conn.cursor() as cursor:
+            query = sql.SQL("SELECT {embedding} FROM {table} WHERE {embedding} IS NOT NULL ORDER BY random() LIMIT %s").format(
+                embedding=sql.Identifier(app.embedding_column), table=sql.Identifier(app.schema, app.sleeping_table)
+            )
+            with traced(conn, query, (sample_size,), "sample_recall") as trace:
+                cursor.execute(query, (sample_size,))
+                trace.set_cursor(cursor)
+            vectors = [row[0] for row in cursor.fetchall()]
+    if not vectors:
+        return None
+
+    approximate = search_many(conn, app, vectors, k, metric=metric, ef_search=ef_search, probes=probes, sleeping=True)
+    with conn.transaction():
+        with conn.cursor() as cursor:
+            # without index scans the search sorts the whole table, giving the exact neighbours
+            cursor.execute("SELECT set_config('enable_indexscan', 'off', true)")
+        exact = search_many(conn, app, vectors, k, metric=metric, sleeping=True)
+
+    found = 0
+    expected = 0
+    for approximate_rows, exact_rows in zip(approximate, exact):
+        exact_ids = {row.id for row in exact_rows}
+        found += len(exact_ids.intersection(row.id for row in approximate_rows))
+        expected += len(exact_ids)
+    return found / expected if expected else None
+
+
+def switch_tables(
+    conn: psycopg.Connection,
+    app: str | VectorApp,
+    min_rows: int = 1,
+    max_row_drop: Optional[float] = None,
+    btree_columns: tuple[str, ...] = ("document_id", "source"),
+    check_index: bool = True,
+    recall_sample: int = 0,
+    min_recall: float = 0.9,
+    recall_k: int = 10,
+    metric: str = "cosine",
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None,
+    lock_timeout: float = 2.0,
+    retries: int = 5,
+    retry_delay: float = 1.0,
+) -> SwitchReport:
+    """
+    Switches the sleeping table of an app active after pre-flight checks.
+
+    Before the switch the sleeping table must have at least min_rows rows, no more than max_row_drop
+    fewer rows than the active table, valid indexes and, when recall_sample is set, a sample recall of
+    at least min_recall. The switch procedure then runs in a transaction that first locks both tables
+    with lock_timeout. A switch waiting behind a long running reader gives up after lock_timeout instead
+    of queueing every new reader behind it, and is retried up to retries times with a growing delay
+
+    Parameters:
+    conn (psycopg.connection): The database connection object.
+    app: name of the app or a VectorApp
+    min_rows: rows the sleeping table must have at least
+    max_row_drop: fraction of the active rows the sleeping table may have fewer, e.g. 0.1, None for no check
+    btree_columns: see VectorIndexes.check_indexes
+    check_index: check the indexes of the sleeping table
+    recall_sample: query vectors for the recall check, 0 for no recall check
+    min_recall: recall the vector index must reach
+    recall_k, metric, ef_search, probes: see sample_recall
+    lock_timeout: seconds to wait for the table locks per attempt
+    retries: attempts after the first one when the locks are not granted
+    retry_delay: seconds before the first retry, doubled for every retry
+
+    Returns:
+    SwitchReport, switched is True when the tables were switched
+    """
+    app = get_vector_app(app)
+    report = SwitchReport(app.name)
+    if not conn.autocommit:
+        conn.commit()
+
+    started = time.perf_counter()
+    with conn.transaction():
+        with conn.cursor() as cursor:
+            report.active_rows = _count_rows(cursor, app, app.active_table)
+            report.sleeping_rows = _count_rows(cursor, app, app.sleeping_table)
+    if report.sleeping_rows < min_rows:
+        report.problems.append(f"{app.schema}.{app.sleeping_table} has {report.sleeping_rows} rows, expected at least {min_rows}")
+    if max_row_drop is not None and report.sleeping_rows < report.active_rows * (1 - max_row_drop):
+        report.problems.append(
+            f"{app.schema}.{app.sleeping_table} has {report.sleeping_rows} rows, "
+            f"more than {max_row_drop:.0%} fewer than the {report.active_rows} active rows"
+        )
+    if check_index:
+        with conn.transaction():
+            report.problems.extend(check_indexes(conn, app, sleeping=True, btree_columns=btree_columns))
+    if recall_sample > 0 and not report.problems:
+        report.recall = sample_recall(conn, app, recall_sample, recall_k, metric, ef_search, probes)
+        if report.recall is None or report.recall < min_recall:
+            report.problems.append(f"Recall {report.recall} of {app.schema}.{app.sleeping_table} is below {min_recall}")
+    report.validation_seconds = time.perf_counter() - started
+    if report.problems:
+        return report
+
+    lock_query = sql.SQL("LOCK TABLE {active}, {sleeping} IN ACCESS EXCLUSIVE MODE").format(
+        active=sql.Identifier(app.schema, app.active_table), sleeping=sql.Identifier(app.schema, app.sleeping_table)
+    )
+    call_query = sql.SQL("CALL {}()").format(sql.Identifier(*app.switch_procedure.split(".")))
+    delay = retry_delay
+    for attempt in range(retries + 1):
+        report.attempts = attempt + 1
+        try:
+            requested = time.perf_counter()
+            with conn.transaction():
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT set_config('lock_timeout', %s, true)", (f"{int(lock_timeout * 1000)}ms",))
+                    requested = time.perf_counter()
+                    with traced(conn, lock_query, None, "switch_tables"):
+                        cursor.execute(lock_query)
+                    report.lock_wait_seconds = time.perf_counter() - requested
+                    with traced(conn, call_query, None, "switch_tables"):
+                        cursor.execute(call_query)
+            report.switch_seconds = time.perf_counter() - requested
+            report.switched = True
+            record_write(conn)
+            return report
+        except psycopg.errors.LockNotAvailable:
+            if attempt < retries:
+                time.sleep(delay)
+                delay *= 2
+        except psycopg.Error as error:
+            report.problems.append(f"{app.switch_procedure} failed: {error}")
+            return report
+
+    report.problems.append(f"Could not lock the {app.name} tables within {lock_timeout}s in {report.attempts} attempts")
+    return report
@@ -0,0 +1,216 @@
+import contextvars
+import time
+import weakref
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from typing import AsyncIterator, Iterator, Optional
+
+import psycopg
+import psycopg.errors
+from psycopg.pq import TransactionStatus
+
+# Connection -> stack of open units of work, True for the units using savepoints
+_units: "weakref.WeakKeyDictionary[psycopg.Connection | psycopg.AsyncConnection, list[bool]]" = weakref.WeakKeyDictionary()
+
+# database_key -> time.monotonic() of the last commit of the current thread or asyncio task on that database,
+# ReplicaRouter keeps the reads of the caller on the primary for a while after it.
+# The dict is replaced, never changed, so tasks started from a context do not share later writes
+last_write: contextvars.ContextVar[Optional[dict[tuple[str, int, str], float]]] = contextvars.ContextVar(
+    "nk_last_write", default=None
+)
+
+
+def database_key(host: Optional[str], port: Optional[int | str], dbname: Optional[str]) -> tuple[str, int, str]:
+    """
+    Identifies a database by host, port and dbname, the port defaults to 5432 like libpq
+    """
+    return host or "", int(port) if port else 5432, dbname or ""
+
+
+def connection_database(conn: psycopg.Connection | psycopg.AsyncConnection) -> tuple[str, int, str]:
+    """
+    database_key of the database a connection is connected to
+    """
+    return database_key(conn.info.host, conn.info.port, conn.info.dbname)
+
+
+def record_write(conn: psycopg.Connection | psycopg.AsyncConnection):
+    """
+    Records a write of the current thread or asyncio task on the database of conn, called on every commit of
+    commit(), commit_async() and unit_of_work. Call it after writes committed another way, so ReplicaRouter
+    reads them on the primary
+    """
+    writes = dict(last_write.get() or {})
+    writes[connection_database(conn)] = time.monotonic()
+    last_write.set(writes)
+
+
+def last_write_time(database: tuple[str, int, str]) -> float:
+    """
+    time.monotonic() of the last write of the current thread or asyncio task on a database_key, 0.0 when none
+    """
+    return (last_write.get() or {}).get(database, 0.0)
+
+
+def in_unit_of_work(conn: psycopg.Connection | psycopg.AsyncConnection) -> bool:
+    """
+    True when a unit of work is open on the connection
+    """
+    return bool(_units.get(conn))
+
+
+def uses_savepoints(conn: psycopg.Connection | psycopg.AsyncConnection) -> bool:
+    """
+    True when the innermost unit of work on the connection wraps every helper call in a savepoint
+    """
+    units = _units.get(conn)
+    return bool(units) and units[-1]
+
+
+def _check_not_failed(conn: psycopg.Connection | psycopg.AsyncConnection):
+    # psycopg ends a failed transaction block with a silent rollback, make it visible instead
+    if conn.info.transaction_status == TransactionStatus.INERROR:
+        raise psycopg.errors.InFailedSqlTransaction(
+            "A statement in the unit of work failed, the transaction was rolled back"
+        )
+
+
+@contextmanager
+def unit_of_work(conn: psycopg.Connection, savepoints: bool = False, synchronous_commit: bool = True) -> Iterator[psycopg.Connection]:
+    """
+    Purpose:
+    Groups the calls of the NKDatabase helpers on a connection into one transaction.
+    Inside the block the helpers do not commit, the work is committed once when the block exits normally
+    and rolled back on an exception. A unit of work inside another one becomes a savepoint.
+    Work pending on the connection is committed before the outermost unit starts.
+    A helper that fails inside a unit of work without savepoints leaves the transaction failed,
+    the block then raises InFailedSqlTransaction at exit instead of committing
+
+    Argument:
+    conn -->                connection to work on
+    savepoints -->          run every helper call in its own savepoint, so a failing call (returning False)
+                            only undoes itself and the rest of the unit still commits. Costs a round trip per call
+    synchronous_commit -->  False sets synchronous_commit off for this transaction: the commit does not wait for
+                            the WAL flush. A server crash can lose the last commits, but never corrupts data
+
+    Usage:
+    with unit_of_work(conn, synchronous_commit=False):
+        delete_data_in_nkgpt_sleeping_data(conn)
+        bulk_insert_vectordata_nkgpt_sleeping_table(conn, documents)
+    """
+    units = _units.setdefault(conn, [])
+    if not units and conn.info.transaction_status == TransactionStatus.INTRANS:
+        conn.commit()
+    with conn.transaction():
+        units.append(savepoints)
+        try:
+            if not synchronous_commit:
+                conn.execute("SELECT set_config('synchronous_commit', 'off', true)")
+            yield conn
+            _check_not_failed(conn)
+        finally:
+            units.pop()
+    record_write(conn)
+
+
+@asynccontextmanager
+async def async_unit_of_work(
+    conn: psycopg.AsyncConnection, savepoints: bool = False, synchronous_commit: bool = True
+) -> AsyncIterator[psycopg.AsyncConnection]:
+    """
+    Purpose:
+    unit_of_work for asyncio connections and the helpers in AsyncPostgreSQL and AsyncVectorDatabase
+    """
+    units = _units.setdefault(conn, [])
+    if not units and conn.info.transaction_status == TransactionStatus.INTRANS:
+        await conn.commit()
+    async with conn.transaction():
+        units.append(savepoints)
+        try:
+            if not synchronous_commit:
+                await conn.execute("SELECT set_config('synchronous_commit', 'off', true)")
+            yield conn
+            _check_not_failed(conn)
+        finally:
+            units.pop()
+    record_write(conn)
+
+
+def commit(conn: psycopg.Connection):
+    """
+    Commits, unless a unit of work is open on the connection, which then commits at its end
+    """
+    if not in_unit_of_work(conn):
+        conn.commit()
+        record_write(conn)
+
+
+def rollback(conn: psycopg.Connection):
+    """
+    Rolls back, unless a unit of work is open on the connection. A failed statement then either was undone
+    by its savepoint or leaves the transaction failed for unit_of_work to report
+    """
+    if not in_unit_of_work(conn):
+        conn.rollback()
+
+
+async def commit_async(conn: psycopg.AsyncConnection):
+    """
+    commit for asyncio connections
+    """
+    if not in_unit_of_work(conn):
+        await conn.commit()
+        record_write(conn)
+
+
+async def rollback_async(conn: psycopg.AsyncConnection):
+    """
+    rollback for asyncio connections
+    """
+    if not in_unit_of_work(conn):
+        await conn.rollback()
+
+
+def savepoint(conn: psycopg.Connection):
+    """
+    Context for one helper call: a savepoint when the unit of work uses savepoints, otherwise nothing
+    """
+    return conn.transaction() if uses_savepoints(conn) else nullcontext()
+
+
+def async_savepoint(conn: psycopg.AsyncConnection):
+    """
+    savepoint for asyncio connections
+    """
+    return conn.transaction() if uses_savepoints(conn) else nullcontext()
+
+
+def batch_savepoint(conn: psycopg.Connection | psycopg.AsyncConnection):
+    """
+    Context for one batch of a bulk load: inside any unit of work a savepoint, so a failing batch is undone
+    and the load continues as it does outside one. Works with sync and asyncio connections
+    """
+    return conn.transaction() if in_unit_of_work(conn) else nullcontext()
+
+
+@contextmanager
+def asynchronous_commits(conn: psycopg.Connection) -> Iterator[psycopg.Connection]:
+    """
+    Purpose:
+    Turns synchronous_commit off for the session while the block runs, for bulk jobs that commit often
+    (e.g. bulk_insert_vectordata_sleeping_table commits per batch) and accept losing the last commits
+    on a server crash. The setting is reset at the end, also on pooled connections
+
+    Usage:
+    with asynchronous_commits(conn):
+        bulk_insert_vectordata_nkgpt_sleeping_table(conn, documents)
+    """
+    commit(conn)
+    conn.execute("SET synchronous_commit = off")
+    commit(conn)
+    try:
+        yield conn
+    finally:
+        if conn.info.transaction_status == TransactionStatus.INERROR:
+            rollback(conn)
+        conn.execute("RESET synchronous_commit")
+        commit(conn)
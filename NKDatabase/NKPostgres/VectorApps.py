@@ -0,0 +1,79 @@
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class VectorApp:
+    """
+    Purpose:
+    Describes the tables and procedures of a vector app (nkgpt, hygiejnar, ...)
+
+    Contains:
+    name -> name used to look the app up
+    schema -> schema of the tables
+    active_table -> table queried by the application
+    sleeping_table -> table loaded before switch_active_tables
+    insert_procedure -> procedure inserting one item into the sleeping table
+    clean_procedure -> procedure emptying the sleeping table
+    switch_procedure -> procedure switching sleeping and active table
+    embedding_column -> name of the vector column
+    """
+
+    name: str
+    schema: str
+    active_table: str
+    sleeping_table: str
+    insert_procedure: str
+    clean_procedure: str
+    switch_procedure: str
+    embedding_column: str = "embedding"
+
+
+# Table names follow the naming of the clean/switch procedures,
+# use register_vector_app to override them for another database
+VECTOR_APPS: dict[str, VectorApp] = {
+    "nkgpt": VectorApp(
+        name="nkgpt",
+        schema="nkgpt",
+        active_table="items",
+        sleeping_table="sleeping_items",
+        insert_procedure="nkgpt.insert_nkpgt_item",
+        clean_procedure="nkgpt.clean_sleeping_items",
+        switch_procedure="nkgpt.change_active_tables",
+    ),
+    "hygiejnar": VectorApp(
+        name="hygiejnar",
+        schema="nkgpt",
+        active_table="hygiejnar_items",
+        sleeping_table="hygiejnar_sleeping_items",
+        insert_procedure="nkgpt.insert_hygiejnar_item",
+        clean_procedure="nkgpt.clean_hygiejnar_sleeping_items",
+        switch_procedure="nkgpt.change_hygiejnar_active_tables",
+    ),
+}
+
+
+def register_vector_app(app: VectorApp):
+    """
+    Purpose:
+    Add a vector app or replace the definition of an existing one
+
+    Argument:
+    app --> the app definition
+    """
+    VECTOR_APPS[app.name] = app
+
+
+def get_vector_app(app: str | VectorApp) -> VectorApp:
+    """
+    Purpose:
+    Look up a vector app by name, VectorApp objects are returned unchanged
+
+    Argument:
+    app --> name of the app or a VectorApp
+    """
+    if isinstance(app, VectorApp):
+        return app
+    try:
+        return VECTOR_APPS[app]
+    except KeyError:
+        raise ValueError(f"Unknown vector app '{app}'. Must be one of: {sorted(VECTOR_APPS)}") from None
@@ -1,3 +1,27 @@
+import time
+from collections.abc import Iterable, Mapping
+from dataclasses import dataclass, field
+from itertools import islice
+
+from NKDatabase.NKPostgres.Instrumentation import traced
+from NKDatabase.NKPostgres.Transactions import batch_savepoint, commit, rollback, savepoint
+from NKDatabase.NKPostgres.VectorTypes import adapt_embedding
+
+# Parameter order of the nkgpt insert procedures
+SLEEPING_TABLE_FIELDS = (
+    "items_id",
+    "title",
+    "description",
+    "content",
+    "url",
+    "source",
+    "document_id",
+    "embedding_str",
+)
+# Alternative document keys accepted for a procedure parameter
+_SLEEPING_TABLE_ALIASES = {"items_id": "id", "embedding_str": "embedding"}
+
+
 # ***********************************************************************************************************************************
 # ***********************************************************************************************************************************
 # INSERTING
@@ -92,7 +116,7 @@ def insert_vectordata_sleeping_table(
     description: description of the document
     content: content of the document
     url: url of the document
-    embedded: embedded text
+    embedding_str: embedding as text, or as NumPy float32 array / buffer which is sent in binary
 
     Returns:
 
@@ -100,30 +124,30 @@ def insert_vectordata_sleeping_table(
     """
     try:
         if conn:
-            with conn.cursor() as cursor:
+            embedding_str = adapt_embedding(conn, embedding_str)
+            with savepoint(conn), conn.cursor() as cursor:
                 query = """
                 CALL {}(%s, %s, %s, %s, %s, %s, %s, %s);
                 """.format(app_procedure)
 
-                cursor.execute(
-                    query,
-                    (
-                        items_id,
-                        title,
-                        description,
-                        content,
-                        url,
-                        source,
-                        document_id,
-                        embedding_str,
-                    ),
+                params = (
+                    items_id,
+                    title,
+                    description,
+                    content,
+                    url,
+                    source,
+                    document_id,
+                    embedding_str,
                 )
+                with traced(conn, query, params, "insert_vectordata_sleeping_table"):
+                    cursor.execute(query, params)
 
                 # cursor.execute("""
                 # CALL %s(%s, %s, %s, %s, %s, %s, %s, %s);
                 # """, (app_procedure, items_id, title, description, content, url, source, document_id, embedding_str))
 
-                conn.commit()
+                commit(conn)
                 return True
         return False
 
@@ -132,6 +156,155 @@ def insert_vectordata_sleeping_table(
         return False
 
 
+# ***********************************************************************************************************************************
+# ***********************************************************************************************************************************
+# BULK INSERTING
+# ***********************************************************************************************************************************
+# ***********************************************************************************************************************************
+@dataclass
+class BatchFailure:
+    """
+    A batch that could not be inserted, the rows of the batch are rolled back
+
+    batch_number: 0-based number of the batch
+    first_row: 0-based position of the first document of the batch in the input
+    rows: number of documents in the batch
+    error: text of the exception
+    """
+
+    batch_number: int
+    first_row: int
+    rows: int
+    error: str
+
+
+@dataclass
+class BulkLoadResult:
+    """
+    Outcome of a bulk load into a sleeping table
+    """
+
+    rows_inserted: int = 0
+    rows_failed: int = 0
+    batches: int = 0
+    seconds: float = 0.0
+    failures: list[BatchFailure] = field(default_factory=list)
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows_inserted / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def succeeded(self) -> bool:
+        return not self.failures
+
+    def summary(self) -> str:
+        return (
+            f"{self.rows_inserted} rows inserted in {self.batches} batches "
+            f"in {self.seconds:.2f}s ({self.rows_per_second:.0f} rows/s), "
+            f"{len(self.failures)} failed batches with {self.rows_failed} rows"
+        )
+
+
+def sleeping_table_row(document) -> tuple:
+    """
+    Converts a document to the parameter tuple of the insert procedures
+
+    Parameters:
+    document: either a sequence in SLEEPING_TABLE_FIELDS order or a mapping with those keys.
+              A mapping may use "id" for items_id and "embedding" for embedding_str
+
+    Returns:
+
+    tuple of 8 values
+    """
+    if isinstance(document, Mapping):
+        row = []
+        for name in SLEEPING_TABLE_FIELDS:
+            if name in document:
+                row.append(document[name])
+            elif _SLEEPING_TABLE_ALIASES.get(name) in document:
+                row.append(document[_SLEEPING_TABLE_ALIASES[name]])
+            else:
+                raise KeyError(f"Document is missing '{name}'")
+        return tuple(row)
+
+    row = tuple(document)
+    if len(row) != len(SLEEPING_TABLE_FIELDS):
+        raise ValueError(f"Expected {len(SLEEPING_TABLE_FIELDS)} values, got {len(row)}")
+    return row
+
+
+def bulk_insert_vectordata_nkgpt_sleeping_table(conn, documents: Iterable, batch_size: int = 500) -> BulkLoadResult:
+    """
+    inserts many documents into the nkgpt sleeping tables, see bulk_insert_vectordata_sleeping_table
+    """
+    return bulk_insert_vectordata_sleeping_table("nkgpt.insert_nkpgt_item", conn, documents, batch_size)
+
+
+def bulk_insert_vectordata_hygiejnar_sleeping_table(conn, documents: Iterable, batch_size: int = 500) -> BulkLoadResult:
+    """
+    inserts many documents into the hygiejnar sleeping tables, see bulk_insert_vectordata_sleeping_table
+    """
+    return bulk_insert_vectordata_sleeping_table("nkgpt.insert_hygiejnar_item", conn, documents, batch_size)
+
+
+def bulk_insert_vectordata_sleeping_table(app_procedure, conn, documents: Iterable, batch_size: int = 500) -> BulkLoadResult:
+    """
+    inserts many documents through the insert procedure of an app.
+
+    The documents are consumed lazily in batches of batch_size. Each batch is sent with executemany,
+    which psycopg pipelines into a single round trip, and committed once. A failing batch is rolled back
+    and recorded in the result, the load continues with the next batch.
+    Inside a unit of work (see Transactions) the batches are savepoints and the unit commits.
+
+    Parameters:
+    app_procedure: name of insert procedure
+    conn (psycopg.connection): The database connection object.
+    documents: iterable of documents, see sleeping_table_row. Embeddings may be text or NumPy arrays / buffers
+    batch_size: number of documents per batch and transaction
+
+    Returns:
+
+    BulkLoadResult with row counts, throughput and the failed batches
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+
+    result = BulkLoadResult()
+    query = """
+    CALL {}(%s, %s, %s, %s, %s, %s, %s, %s);
+    """.format(app_procedure)
+
+    started = time.perf_counter()
+    documents = iter(documents)
+    first_row = 0
+    while True:
+        batch = list(islice(documents, batch_size))
+        if not batch:
+            break
+        try:
+            rows = []
+            for document in batch:
+                row = sleeping_table_row(document)
+                rows.append(row[:-1] + (adapt_embedding(conn, row[-1]),))
+            with batch_savepoint(conn), conn.cursor() as cursor, traced(conn, query, None, "bulk_insert_vectordata_sleeping_table") as trace:
+                cursor.executemany(query, rows)
+                trace.set_rows(len(rows))
+            commit(conn)
+            result.rows_inserted += len(batch)
+        except Exception as error:
+            rollback(conn)
+            print(f"Error executing query: {error}")
+            result.rows_failed += len(batch)
+            result.failures.append(BatchFailure(result.batches, first_row, len(batch), str(error)))
+        result.batches += 1
+        first_row += len(batch)
+
+    result.seconds = time.perf_counter() - started
+    return result
+
+
 # ***********************************************************************************************************************************
 # ***********************************************************************************************************************************
 # DELETING
@@ -169,10 +342,11 @@ def delete_data_in_sleeping_data(app_procedure, conn):
     """
     try:
         if conn:
-            with conn.cursor() as cursor:
+            with savepoint(conn), conn.cursor() as cursor:
                 strCaller = f"call {app_procedure}();"
-                cursor.execute(strCaller)
-                conn.commit()
+                with traced(conn, strCaller, None, "delete_data_in_sleeping_data"):
+                    cursor.execute(strCaller)
+                commit(conn)
                 return True
         return False
 
@@ -218,10 +392,11 @@ def switch_active_tables(app_procedure, conn):
     """
     try:
         if conn:
-            with conn.cursor() as cursor:
+            with savepoint(conn), conn.cursor() as cursor:
                 strCaller = f"call {app_procedure}();"
-                cursor.execute(strCaller)
-                conn.commit()
+                with traced(conn, strCaller, None, "switch_active_tables"):
+                    cursor.execute(strCaller)
+                commit(conn)
                 return True
         return False
 
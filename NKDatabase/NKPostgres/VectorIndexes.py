@@ -0,0 +1,245 @@
+import math
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+import psycopg
+import psycopg.sql as sql
+
+from NKDatabase.NKPostgres.VectorApps import VectorApp, get_vector_app
+from NKDatabase.NKPostgres.VectorDatabase import switch_active_tables
+
+# pgvector operator classes per distance metric, see VectorSearch.METRIC_OPERATORS
+INDEX_OPERATOR_CLASSES = {
+    "cosine": "vector_cosine_ops",
+    "l2": "vector_l2_ops",
+    "inner_product": "vector_ip_ops",
+}
+VECTOR_INDEX_METHODS = ("hnsw", "ivfflat")
+
+
+@dataclass
+class IndexInfo:
+    """
+    An index as found in pg_index
+    """
+
+    name: str
+    method: str
+    columns: list[str]
+    valid: bool
+    ready: bool
+
+
+@dataclass
+class IndexBuildReport:
+    """
+    Outcome of build_sleeping_indexes, times are in seconds
+    """
+
+    table: str
+    indexes: list[IndexInfo] = field(default_factory=list)
+    build_seconds: float = 0.0
+    analyze_seconds: float = 0.0
+
+    @property
+    def seconds(self) -> float:
+        return self.build_seconds + self.analyze_seconds
+
+
+def table_indexes(conn: psycopg.Connection, schema_name: str, table_name: str) -> list[IndexInfo]:
+    """
+    Lists the indexes of a table
+
+    Parameters:
+    conn (psycopg.connection): The database connection object.
+    schema_name (str): The schema name of the table.
+    table_name (str): The name of the table.
+
+    Returns:
+    list of IndexInfo
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT i.relname, am.amname, ix.indisvalid, ix.indisready,
+                   array(SELECT a.attname FROM unnest(ix.indkey) WITH ORDINALITY AS k(attnum, ord)
+                         JOIN pg_attribute a ON a.attrelid = ix.indrelid AND a.attnum = k.attnum
+                         ORDER BY k.ord)
+            FROM pg_index ix
+            JOIN pg_class i ON i.oid = ix.indexrelid
+            JOIN pg_class t ON t.oid = ix.indrelid
+            JOIN pg_namespace n ON n.oid = t.relnamespace
+            JOIN pg_am am ON am.oid = i.relam
+            WHERE n.nspname = %s AND t.relname = %s
+            ORDER BY i.relname
+            """,
+            (schema_name, table_name),
+        )
+        return [IndexInfo(name, method, list(columns), valid, ready) for name, method, valid, ready, columns in cursor.fetchall()]
+
+
+def check_indexes(
+    conn: psycopg.Connection, app: str | VectorApp, sleeping: bool = True, btree_columns: tuple[str, ...] = ("document_id", "source")
+) -> list[str]:
+    """
+    Checks that a table of an app has a valid vector index and btree indexes on btree_columns
+
+    Parameters:
+    conn (psycopg.connection): The database connection object.
+    app: name of the app or a VectorApp
+    sleeping: check the sleeping table, otherwise the active table
+    btree_columns: columns that must lead a valid btree index
+
+    Returns:
+    list of problems, empty when the indexes are usable
+    """
+    app = get_vector_app(app)
+    table = app.sleeping_table if sleeping else app.active_table
+    indexes = table_indexes(conn, app.schema, table)
+    problems = [f"Index {index.name} is not valid" for index in indexes if not (index.valid and index.ready)]
+
+    usable = [index for index in indexes if index.valid and index.ready]
+    if not any(index.method in VECTOR_INDEX_METHODS and app.embedding_column in index.columns for index in usable):
+        problems.append(f"No valid vector index on {app.schema}.{table}.{app.embedding_column}")
+    for column in btree_columns:
+        if not any(index.method == "btree" and index.columns[:1] == [column] for index in usable):
+            problems.append(f"No valid btree index on {app.schema}.{table}.{column}")
+    return problems
+
+
+def build_sleeping_indexes(
+    conn: psycopg.Connection,
+    app: str | VectorApp,
+    method: str = "hnsw",
+    metric: str = "cosine",
+    m: Optional[int] = None,
+    ef_construction: Optional[int] = None,
+    lists: Optional[int] = None,
+    btree_columns: tuple[str, ...] = ("document_id", "source"),
+    reindex_btree: bool = False,
+    concurrently: bool = False,
+    maintenance_workers: Optional[int] = None,
+    maintenance_work_mem: Optional[str] = None,
+) -> IndexBuildReport:
+    """
+    (Re)builds the indexes of the sleeping table after a load and runs ANALYZE.
+
+    The vector indexes on the table are dropped and created again, invalid indexes left by an
+    interrupted concurrent build are dropped, missing btree indexes on btree_columns are created.
+    The statements run in autocommit mode, work pending on the connection is committed first.
+
+    Parameters:
+    conn (psycopg.connection): The database connection object.
+    app: name of the app or a VectorApp
+    method: hnsw or ivfflat
+    metric: cosine, l2 or inner_product, must match the metric used by search
+    m, ef_construction: hnsw build parameters, server defaults when None
+    lists: ivfflat lists, when None rows / 1000 (sqrt(rows) above a million rows), at least 10
+    btree_columns: columns that get a btree index
+    reindex_btree: also rebuild the existing btree indexes, useful when the table was emptied with DELETE
+    concurrently: build without blocking writers, slower
+    maintenance_workers: max_parallel_maintenance_workers for the build
+    maintenance_work_mem: maintenance_work_mem for the build, e.g. '2GB'
+
+    Returns:
+    IndexBuildReport with the resulting indexes and the time spent
+    """
+    app = get_vector_app(app)
+    if method not in VECTOR_INDEX_METHODS:
+        raise ValueError(f"Unknown index method '{method}'. Must be one of: {list(VECTOR_INDEX_METHODS)}")
+    try:
+        operator_class = INDEX_OPERATOR_CLASSES[metric]
+    except KeyError:
+        raise ValueError(f"Unknown metric '{metric}'. Must be one of: {sorted(INDEX_OPERATOR_CLASSES)}") from None
+
+    table = sql.Identifier(app.schema, app.sleeping_table)
+    concurrent = sql.SQL(" CONCURRENTLY") if concurrently else sql.SQL("")
+    report = IndexBuildReport(table=f"{app.schema}.{app.sleeping_table}")
+
+    if not conn.autocommit:
+        conn.commit()
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            if maintenance_workers is not None:
+                cursor.execute("SELECT set_config('max_parallel_maintenance_workers', %s, false)", (str(int(maintenance_workers)),))
+            if maintenance_work_mem is not None:
+                cursor.execute("SELECT set_config('maintenance_work_mem', %s, false)", (maintenance_work_mem,))
+
+            started = time.perf_counter()
+            btree_present = set()
+            for index in table_indexes(conn, app.schema, app.sleeping_table):
+                name = sql.Identifier(app.schema, index.name)
+                if not index.valid or (index.method in VECTOR_INDEX_METHODS and app.embedding_column in index.columns):
+                    cursor.execute(sql.SQL("DROP INDEX{} IF EXISTS {}").format(concurrent, name))
+                elif index.method == "btree" and index.columns:
+                    btree_present.add(index.columns[0])
+                    if reindex_btree:
+                        cursor.execute(sql.SQL("REINDEX INDEX{} {}").format(concurrent, name))
+
+            options = {}
+            if method == "hnsw":
+                if m is not None:
+                    options["m"] = int(m)
+                if ef_construction is not None:
+                    options["ef_construction"] = int(ef_construction)
+            else:
+                if lists is None:
+                    cursor.execute(sql.SQL("SELECT count(*) FROM {}").format(table))
+                    rows = cursor.fetchone()[0]
+                    lists = rows // 1000 if rows <= 1_000_000 else int(math.sqrt(rows))
+                options["lists"] = max(int(lists), 10)
+            with_clause = sql.SQL("")
+            if options:
+                with_clause = sql.SQL(" WITH ({})").format(
+                    sql.SQL(", ").join(sql.SQL("{} = {}").format(sql.SQL(key), sql.Literal(value)) for key, value in options.items())
+                )
+
+            # Index names are left to the server, the switch renames tables and explicit names would collide
+            cursor.execute(
+                sql.SQL("CREATE INDEX{} ON {} USING {} ({} {}){}").format(
+                    concurrent, table, sql.SQL(method), sql.Identifier(app.embedding_column), sql.SQL(operator_class), with_clause
+                )
+            )
+            for column in btree_columns:
+                if column not in btree_present:
+                    cursor.execute(sql.SQL("CREATE INDEX{} ON {} ({})").format(concurrent, table, sql.Identifier(column)))
+            report.build_seconds = time.perf_counter() - started
+
+            started = time.perf_counter()
+            cursor.execute(sql.SQL("ANALYZE {}").format(table))
+            report.analyze_seconds = time.perf_counter() - started
+    finally:
+        # the settings are per session, do not leave them on a pooled connection
+        if maintenance_workers is not None:
+            conn.execute("RESET max_parallel_maintenance_workers")
+        if maintenance_work_mem is not None:
+            conn.execute("RESET maintenance_work_mem")
+        conn.autocommit = autocommit
+
+    report.indexes = table_indexes(conn, app.schema, app.sleeping_table)
+    if not conn.autocommit:
+        conn.commit()
+    return report
+
+
+def switch_active_tables_when_indexed(
+    conn: psycopg.Connection, app: str | VectorApp, btree_columns: tuple[str, ...] = ("document_id", "source")
+) -> bool:
+    """
+    switches sleeping tables to active tables, but only when the sleeping table has valid indexes
+
+    Returns:
+
+    true when the switch is succesfull, false when the indexes are missing/invalid or the switch failed
+    """
+    app = get_vector_app(app)
+    problems = check_indexes(conn, app, sleeping=True, btree_columns=btree_columns)
+    if not conn.autocommit:
+        conn.commit()
+    if problems:
+        print(f"Not switching {app.name} tables: {'; '.join(problems)}")
+        return False
+    return switch_active_tables(app.switch_procedure, conn)
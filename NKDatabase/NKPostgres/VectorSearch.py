@@ -0,0 +1,159 @@
+from collections.abc import Iterable, Mapping
+from dataclasses import dataclass
+from typing import Optional
+
+import psycopg
+import psycopg.sql as sql
+from psycopg.rows import class_row
+
+from NKDatabase.NKPostgres.Instrumentation import traced
+from NKDatabase.NKPostgres.VectorApps import VectorApp, get_vector_app
+from NKDatabase.NKPostgres.VectorTypes import adapt_embedding
+
+# pgvector distance operators, inner_product returns the negative inner product
+METRIC_OPERATORS = {
+    "cosine": "<=>",
+    "l2": "<->",
+    "inner_product": "<#>",
+}
+
+# Columns that can be used in search filters
+FILTER_COLUMNS = ("id", "source", "document_id", "url")
+
+RESULT_COLUMNS = ("id", "title", "description", "content", "url", "source", "document_id")
+
+
+@dataclass
+class SearchResult:
+    """
+    A row found by a similarity search, distance is smaller for closer rows
+    """
+
+    id: str
+    title: Optional[str]
+    description: Optional[str]
+    content: Optional[str]
+    url: Optional[str]
+    source: Optional[str]
+    document_id: Optional[str]
+    distance: float
+
+
+def _search_query(app: VectorApp, metric: str, filters: Optional[Mapping], sleeping: bool) -> tuple[sql.Composed, list]:
+    """
+    Builds the search statement, returns the query and the filter parameters
+    """
+    try:
+        operator = sql.SQL(METRIC_OPERATORS[metric])
+    except KeyError:
+        raise ValueError(f"Unknown metric '{metric}'. Must be one of: {sorted(METRIC_OPERATORS)}") from None
+
+    conditions = []
+    params = []
+    for column, value in (filters or {}).items():
+        if column not in FILTER_COLUMNS:
+            raise ValueError(f"Cannot filter on '{column}'. Must be one of: {list(FILTER_COLUMNS)}")
+        if isinstance(value, (list, tuple, set, frozenset)):
+            conditions.append(sql.SQL("{} = ANY(%s)").format(sql.Identifier(column)))
+            params.append(list(value))
+        else:
+            conditions.append(sql.SQL("{} = %s").format(sql.Identifier(column)))
+            params.append(value)
+
+    query = sql.SQL(
+        "SELECT {columns}, {embedding} {operator} %s::vector AS distance FROM {schema}.{table}"
+    ).format(
+        columns=sql.SQL(", ").join(map(sql.Identifier, RESULT_COLUMNS)),
+        embedding=sql.Identifier(app.embedding_column),
+        operator=operator,
+        schema=sql.Identifier(app.schema),
+        table=sql.Identifier(app.sleeping_table if sleeping else app.active_table),
+    )
+    if conditions:
+        query = query + sql.SQL(" WHERE ") + sql.SQL(" AND ").join(conditions)
+    query = query + sql.SQL(" ORDER BY distance LIMIT %s")
+    return query, params
+
+
+def _set_index_parameters(cursor: psycopg.Cursor, ef_search: Optional[int], probes: Optional[int]):
+    """
+    Sets the pgvector index parameters for the current transaction
+    """
+    if ef_search is not None:
+        cursor.execute("SELECT set_config('hnsw.ef_search', %s, true)", (str(int(ef_search)),))
+    if probes is not None:
+        cursor.execute("SELECT set_config('ivfflat.probes', %s, true)", (str(int(probes)),))
+
+
+def search(
+    conn: psycopg.Connection,
+    app: str | VectorApp,
+    query_vector,
+    k: int = 10,
+    filters: Optional[Mapping[str, any]] = None,
+    metric: str = "cosine",
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None,
+    sleeping: bool = False,
+) -> list[SearchResult]:
+    """
+    Finds the k rows closest to a vector in the active table of an app
+
+    Parameters:
+    conn (psycopg.connection): The database connection object.
+    app: name of the app (nkgpt, hygiejnar) or a VectorApp
+    query_vector: NumPy array, Vector, sequence of numbers or vector text
+    k: number of rows to return
+    filters: column -> value, a list/tuple/set value matches any of its values.
+             Columns must be in FILTER_COLUMNS
+    metric: cosine, l2 or inner_product, should match the operator class of the index
+    ef_search: hnsw.ef_search for this query, higher gives better recall and slower queries
+    probes: ivfflat.probes for this query, higher gives better recall and slower queries
+    sleeping: search the sleeping table instead of the active table
+
+    Returns:
+
+    list of SearchResult, closest first
+    """
+    return search_many(conn, app, [query_vector], k, filters, metric, ef_search, probes, sleeping)[0]
+
+
+def search_many(
+    conn: psycopg.Connection,
+    app: str | VectorApp,
+    query_vectors: Iterable,
+    k: int = 10,
+    filters: Optional[Mapping[str, any]] = None,
+    metric: str = "cosine",
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None,
+    sleeping: bool = False,
+) -> list[list[SearchResult]]:
+    """
+    Runs a similarity search for every vector in query_vectors, all searches are pipelined
+    into one round trip. See search for the parameters
+
+    Returns:
+
+    a list of results per query vector, in the order of query_vectors
+    """
+    query, params = _search_query(get_vector_app(app), metric, filters, sleeping)
+    vectors = [adapt_embedding(conn, vector) for vector in query_vectors]
+    if not vectors:
+        return []
+
+    with conn.transaction(), traced(conn, query, None, "search_many") as trace:
+        with conn.pipeline():
+            with conn.cursor() as cursor:
+                _set_index_parameters(cursor, ef_search, probes)
+            cursors = []
+            for vector in vectors:
+                cursor = conn.cursor(row_factory=class_row(SearchResult))
+                cursor.execute(query, [vector, *params, k])
+                cursors.append(cursor)
+        results = []
+        for cursor in cursors:
+            results.append(cursor.fetchall())
+            cursor.close()
+        trace.set_rows(sum(map(len, results)))
+    return results
@@ -0,0 +1,227 @@
+import struct
+import sys
+import weakref
+from array import array
+
+import psycopg
+from psycopg.adapt import Dumper, Loader
+from psycopg.pq import Format, TransactionStatus
+from psycopg.types import TypeInfo
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, vectors are then loaded as array.array("f")
+    np = None
+
+# pgvector binary format: uint16 dimensions, uint16 unused, dimensions * big endian float4
+_HEADER = struct.Struct(">HH")
+
+_registered: "weakref.WeakSet[psycopg.Connection | psycopg.AsyncConnection]" = weakref.WeakSet()
+
+
+class Vector:
+    """
+    Purpose:
+    Marks a float32 buffer as a pgvector value.
+    Wrap any buffer-protocol object (array.array("f"), memoryview, bytes of native float32)
+    or a sequence of numbers; NumPy arrays can be passed without wrapping
+
+    Contains:
+    data -> the wrapped object
+    """
+
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __len__(self):
+        return len(_to_float32(self.data))
+
+
+def _to_float32(value) -> array:
+    """
+    Converts a buffer or a sequence of numbers to a native array.array("f")
+    """
+    if isinstance(value, Vector):
+        value = value.data
+    if isinstance(value, array) and value.typecode == "f":
+        return value
+    try:
+        view = memoryview(value)
+    except TypeError:
+        return array("f", value)
+    if view.format in ("f", "B", "b", "c"):
+        # float32 buffers and raw bytes are taken as native float32 data
+        floats = array("f")
+        floats.frombytes(view.tobytes())
+        return floats
+    return array("f", view.tolist())
+
+
+def vector_to_binary(value) -> bytes:
+    """
+    Purpose:
+    Encodes a vector in the pgvector binary wire format
+
+    Argument:
+    value -->   NumPy array, Vector or any buffer-protocol object / sequence of numbers
+
+    returns the encoded bytes
+    """
+    if np is not None and isinstance(value, np.ndarray):
+        data = np.ascontiguousarray(value.reshape(-1), dtype=">f4")
+        return _HEADER.pack(data.shape[0], 0) + data.tobytes()
+
+    floats = _to_float32(value)
+    if sys.byteorder == "little":
+        floats = array("f", floats)
+        floats.byteswap()
+    return _HEADER.pack(len(floats), 0) + floats.tobytes()
+
+
+def vector_from_binary(data):
+    """
+    Purpose:
+    Decodes a vector in the pgvector binary wire format.
+    With NumPy the result is a read-only big endian float32 view on the received buffer, no copy is made.
+    Use .astype(numpy.float32) when a writable native array is needed
+
+    Argument:
+    data -->    bytes or memoryview as received from the server
+
+    returns a numpy.ndarray or, without NumPy, an array.array("f")
+    """
+    dimensions, _ = _HEADER.unpack_from(data)
+    if np is not None:
+        return np.frombuffer(data, dtype=">f4", count=dimensions, offset=_HEADER.size)
+    floats = array("f")
+    floats.frombytes(bytes(data[_HEADER.size : _HEADER.size + 4 * dimensions]))
+    if sys.byteorder == "little":
+        floats.byteswap()
+    return floats
+
+
+def vector_from_text(data):
+    """
+    Purpose:
+    Decodes a vector in the pgvector text format, e.g. [1,2,3]
+    """
+    text = bytes(data).decode("ascii").strip()[1:-1]
+    if np is not None:
+        return np.array(text.split(",") if text else [], dtype=np.float32)
+    return array("f", map(float, text.split(","))) if text else array("f")
+
+
+class VectorBinaryDumper(Dumper):
+    format = Format.BINARY
+
+    def dump(self, obj):
+        return vector_to_binary(obj)
+
+
+class VectorBinaryLoader(Loader):
+    format = Format.BINARY
+
+    def load(self, data):
+        return vector_from_binary(data)
+
+
+class VectorTextLoader(Loader):
+    format = Format.TEXT
+
+    def load(self, data):
+        return vector_from_text(data)
+
+
+def _register_vector_info(conn: psycopg.Connection | psycopg.AsyncConnection, info: TypeInfo | None) -> bool:
+    """
+    Registers the adapters for the vector type described by info
+    """
+    if info is None:
+        return False
+
+    dumper = type("VectorBinaryDumper", (VectorBinaryDumper,), {"oid": info.oid})
+    conn.adapters.register_dumper(Vector, dumper)
+    if np is not None:
+        conn.adapters.register_dumper(np.ndarray, dumper)
+    conn.adapters.register_loader(info.oid, VectorTextLoader)
+    conn.adapters.register_loader(info.oid, VectorBinaryLoader)
+    _registered.add(conn)
+    return True
+
+
+def register_vector(conn: psycopg.Connection) -> bool:
+    """
+    Purpose:
+    Registers the pgvector dumper and loaders on a connection.
+    NumPy arrays and Vector objects are then sent in binary, vector columns are loaded as arrays.
+    Can be used as configure callback of ConnectionPool.get_pool
+
+    Argument:
+    conn -->    connection to register the adapters on
+
+    returns True when registered, False when the vector extension is not installed
+    """
+    if conn in _registered:
+        return True
+
+    was_idle = conn.info.transaction_status == TransactionStatus.IDLE
+    info = TypeInfo.fetch(conn, "vector")
+    if was_idle and not conn.autocommit:
+        conn.commit()
+    return _register_vector_info(conn, info)
+
+
+async def register_vector_async(conn: psycopg.AsyncConnection) -> bool:
+    """
+    Purpose:
+    register_vector for asyncio connections
+    """
+    if conn in _registered:
+        return True
+
+    was_idle = conn.info.transaction_status == TransactionStatus.IDLE
+    info = await TypeInfo.fetch(conn, "vector")
+    if was_idle and not conn.autocommit:
+        await conn.commit()
+    return _register_vector_info(conn, info)
+
+
+def _adapt_registered(embedding, registered: bool):
+    """
+    Wraps an embedding for the binary dumper, or formats it as text when the vector type is unknown
+    """
+    if registered:
+        if np is not None and isinstance(embedding, np.ndarray):
+            return embedding
+        return embedding if isinstance(embedding, Vector) else Vector(embedding)
+    if np is not None and isinstance(embedding, np.ndarray):
+        return "[" + ",".join(map(str, embedding.reshape(-1).tolist())) + "]"
+    return "[" + ",".join(map(str, _to_float32(embedding).tolist())) + "]"
+
+
+def adapt_embedding(conn: psycopg.Connection, embedding):
+    """
+    Purpose:
+    Prepares an embedding for use as query parameter.
+    Text (the classic embedding_str) and None are passed unchanged, anything else is sent in binary.
+    When the vector extension cannot be found the embedding is formatted as text
+
+    Argument:
+    conn -->        connection the embedding is sent on
+    embedding -->   str, NumPy array, Vector, buffer-protocol object or sequence of numbers
+    """
+    if embedding is None or isinstance(embedding, str):
+        return embedding
+    return _adapt_registered(embedding, register_vector(conn))
+
+
+async def adapt_embedding_async(conn: psycopg.AsyncConnection, embedding):
+    """
+    Purpose:
+    adapt_embedding for asyncio connections
+    """
+    if embedding is None or isinstance(embedding, str):
+        return embedding
+    return _adapt_registered(embedding, await register_vector_async(conn))
@@ -0,0 +1,360 @@
+"""
+Benchmarks the NKDatabase hot paths against a throwaway PostgreSQL with pgvector and writes the timings as JSON.
+
+The server is one of
+    --ini FILE          an existing database, the section must point at an empty database the script may fill
+    --docker            a pgvector/pgvector container (needs docker)
+    (default)           a cluster made with initdb from PATH or --pg-bin, pgvector must be installed there
+
+Usage:
+    python benchmarks/run_benchmarks.py --sizes 100,1000,10000 --output results.json
+    python benchmarks/run_benchmarks.py --compare previous.json --output results.json
+
+Each result holds the timings of every repeat, the median and, where rows are involved, rows per second.
+--compare prints the change of every median against an earlier result file.
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import psycopg
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from NKDatabase.InitialValues.InitialValues import Configuration  # noqa: E402
+from NKDatabase.NKPipeline.IngestPipeline import run_ingest_pipeline  # noqa: E402
+from NKDatabase.NKPostgres.ConnectionPool import close_pools  # noqa: E402
+from NKDatabase.NKPostgres.PostgreSQL import (  # noqa: E402
+    connect,
+    load_config,
+    select_with_conditions,
+    update_or_insert_vectordata,
+)
+from NKDatabase.NKPostgres.TableSwitch import switch_tables  # noqa: E402
+from NKDatabase.NKPostgres.VectorDatabase import (  # noqa: E402
+    bulk_insert_vectordata_nkgpt_sleeping_table,
+    delete_data_in_nkgpt_sleeping_data,
+    insert_vectordata_nkgpt_sleeping_table,
+    switch_nkgpt_active_tables,
+)
+from NKDatabase.NKPostgres.VectorIndexes import build_sleeping_indexes  # noqa: E402
+
+SCHEMA_FILE = Path(__file__).resolve().parent / "schema.sql"
+DOCKER_IMAGE = "pgvector/pgvector:pg16"
+APP_NAME = "nk-benchmark"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _write_ini(directory: str, **settings) -> str:
+    filename = os.path.join(directory, "database.ini")
+    with open(filename, "w") as f:
+        f.write("[postgresql]\n")
+        for key, value in settings.items():
+            f.write(f"{key}={value}\n")
+    return filename
+
+
+def _wait_ready(config: dict, seconds: float = 60.0):
+    deadline = time.monotonic() + seconds
+    while True:
+        try:
+            with psycopg.connect(**config, connect_timeout=2):
+                return
+        except psycopg.OperationalError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.5)
+
+
+@contextlib.contextmanager
+def local_server(pg_bin: str | None):
+    """
+    Starts a temporary cluster with initdb and pg_ctl, yields the ini file
+    """
+    def tool(name):
+        path = os.path.join(pg_bin, name) if pg_bin else shutil.which(name)
+        if not path or not os.path.exists(path):
+            raise SystemExit(f"{name} not found, put the PostgreSQL binaries on PATH or use --pg-bin, --docker or --ini")
+        return path
+
+    directory = tempfile.mkdtemp(prefix="nk_benchmark_")
+    data = os.path.join(directory, "data")
+    port = _free_port()
+    subprocess.run([tool("initdb"), "-D", data, "-U", "postgres", "-A", "trust", "-E", "UTF8"], check=True, capture_output=True)
+    subprocess.run(
+        [tool("pg_ctl"), "-D", data, "-l", os.path.join(directory, "server.log"), "-w", "start",
+         "-o", f"-p {port} -k {directory} -c listen_addresses='' -c fsync=off -c synchronous_commit=off"],
+        check=True,
+        capture_output=True,
+    )
+    try:
+        ini = _write_ini(directory, host=directory, port=port, dbname="postgres", user="postgres")
+        _wait_ready(load_config(ini))
+        yield ini
+    finally:
+        subprocess.run([tool("pg_ctl"), "-D", data, "-m", "immediate", "stop"], capture_output=True)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+@contextlib.contextmanager
+def docker_server(image: str):
+    """
+    Starts a pgvector container, yields the ini file
+    """
+    directory = tempfile.mkdtemp(prefix="nk_benchmark_")
+    port = _free_port()
+    container = subprocess.run(
+        ["docker", "run", "-d", "--rm", "-p", f"127.0.0.1:{port}:5432", "-e", "POSTGRES_PASSWORD=benchmark", image,
+         "-c", "fsync=off", "-c", "synchronous_commit=off"],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+    try:
+        ini = _write_ini(directory, host="127.0.0.1", port=port, dbname="postgres", user="postgres", password="benchmark")
+        _wait_ready(load_config(ini))
+        yield ini
+    finally:
+        subprocess.run(["docker", "stop", container], capture_output=True)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def create_schema(ini: str, dim: int, apps: int):
+    with connect(load_config(ini)) as conn:
+        conn.execute(SCHEMA_FILE.read_text().replace("{dim}", str(dim)))
+        values = []
+        for app in range(apps):
+            for debugmode in (False, True):
+                for number in range(10):
+                    values += [
+                        (f"{APP_NAME}-{app}", debugmode, f"text_{number}", 1, f"value {number}"),
+                        (f"{APP_NAME}-{app}", debugmode, f"int_{number}", 2, str(number)),
+                        (f"{APP_NAME}-{app}", debugmode, f"list_{number}", 7, "1.5,2.5,3.5"),
+                    ]
+        with conn.cursor() as cursor:
+            cursor.executemany("INSERT INTO public.nkinitvalues VALUES (%s, %s, %s, %s, %s)", values)
+            cursor.execute("ANALYZE")
+
+
+def embedding_text(rng: random.Random, dim: int) -> str:
+    return "[" + ",".join(f"{rng.random():.6f}" for _ in range(dim)) + "]"
+
+
+def documents(size: int, dim: int, seed: int = 1) -> list[dict]:
+    rng = random.Random(seed)
+    return [
+        {
+            "id": f"doc-{number}",
+            "title": f"Titel {number}",
+            "description": "Beskrivelse",
+            "content": "Indhold " * rng.randint(20, 200),
+            "url": f"https://example.org/{number}",
+            "source": "benchmark",
+            "document_id": f"document-{number // 4}",
+            "embedding": embedding_text(rng, dim),
+        }
+        for number in range(size)
+    ]
+
+
+class Runner:
+    def __init__(self, repeat: int):
+        self.repeat = repeat
+        self.results = []
+
+    def run(self, name: str, size: int, function, setup=None, rows: int | None = None):
+        timings = []
+        for _ in range(self.repeat):
+            if setup is not None:
+                setup()
+            started = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - started)
+        median = statistics.median(timings)
+        result = {"name": name, "size": size, "seconds": timings, "median": median}
+        if rows:
+            result["rows_per_second"] = rows / median if median else None
+        self.results.append(result)
+        rate = f", {result['rows_per_second']:.0f} rows/s" if rows else ""
+        print(f"{name:<40} size {size:>7}: {median * 1000:10.2f}ms{rate}")
+
+
+def run_benchmarks(ini: str, sizes: list[int], dim: int, repeat: int) -> list[dict]:
+    runner = Runner(repeat)
+    conn = connect(load_config(ini))
+
+    appname = f"{APP_NAME}-0"
+    runner.run("configuration", 1, lambda: Configuration(appname, ini_file=ini))
+    Configuration(appname, ini_file=ini, cached=True)
+    runner.run("configuration_cached", 1, lambda: Configuration(appname, ini_file=ini, cached=True))
+    runner.run(
+        "select_with_conditions", 60, lambda: select_with_conditions(conn, "public", "nkinitvalues", {"id": appname}), rows=60
+    )
+
+    for size in sizes:
+        docs = documents(size, dim)
+        clean = lambda: delete_data_in_nkgpt_sleeping_data(conn)  # noqa: E731
+
+        if size <= 10000:
+            def per_row():
+                for d in docs:
+                    insert_vectordata_nkgpt_sleeping_table(
+                        conn, d["id"], d["title"], d["description"], d["content"], d["url"], d["source"], d["document_id"], d["embedding"]
+                    )
+
+            runner.run("insert_sleeping_per_row", size, per_row, setup=clean, rows=size)
+        runner.run("insert_sleeping_bulk", size, lambda: bulk_insert_vectordata_nkgpt_sleeping_table(conn, docs), setup=clean, rows=size)
+
+        sample = docs[: min(size, 1000)]
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for upsert in (False, True):
+            def write_vectors():
+                # the helpers print a line per row
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    for d in sample:
+                        update_or_insert_vectordata(
+                            conn, "nkgpt", "vectors", d["id"], d["title"], d["description"], d["content"], d["url"], now,
+                            d["embedding"], {"id": d["id"]}, upsert=upsert,
+                        )
+
+            name = "upsert_vectordata" if upsert else "update_or_insert_vectordata"
+            write_vectors()  # the timed runs update existing rows
+            runner.run(name, len(sample), write_vectors, rows=len(sample))
+
+        runner.run("switch_active_tables", size, lambda: switch_nkgpt_active_tables(conn))
+
+        def reload_sleeping():
+            # every switch leaves the previous active table sleeping, so it is loaded again before each run
+            clean()
+            bulk_insert_vectordata_nkgpt_sleeping_table(conn, docs)
+
+        def validated_switch():
+            report = switch_tables(conn, "nkgpt", check_index=False)
+            if not report.switched:
+                raise RuntimeError(report.summary())
+
+        runner.run("switch_tables_validated", size, validated_switch, setup=reload_sleeping)
+        runner.run("build_sleeping_indexes", size, lambda: build_sleeping_indexes(conn, "nkgpt"), rows=size)
+
+        with tempfile.TemporaryDirectory() as directory:
+            files = os.path.join(directory, "files")
+            os.mkdir(files)
+            for d in docs:
+                with open(os.path.join(files, f"{d['id']}.json"), "w", encoding="utf-8") as f:
+                    json.dump(d, f)
+            manifest = os.path.join(directory, "manifest.json")
+
+            def full_ingest():
+                if os.path.exists(manifest):
+                    os.remove(manifest)
+                run_ingest_pipeline(conn, "nkgpt", files, manifest, batch_size=500)
+
+            runner.run("ingest_directory_full", size, full_ingest, rows=size)
+
+            changed = docs[: max(1, size // 10)]
+
+            def touch_changed():
+                for d in changed:
+                    d["content"] += " ændret"
+                    with open(os.path.join(files, f"{d['id']}.json"), "w", encoding="utf-8") as f:
+                        json.dump(d, f)
+
+            runner.run(
+                "ingest_directory_incremental_10pct",
+                size,
+                lambda: run_ingest_pipeline(conn, "nkgpt", files, manifest, batch_size=500),
+                setup=touch_changed,
+                rows=size,
+            )
+
+    conn.close()
+    close_pools()
+    return runner.results
+
+
+def metadata(ini: str, dim: int) -> dict:
+    with connect(load_config(ini)) as conn:
+        server = conn.execute("SHOW server_version").fetchone()[0]
+        vector = conn.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'").fetchone()[0]
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=Path(__file__).resolve().parent, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "psycopg": psycopg.__version__,
+        "postgresql": server,
+        "pgvector": vector,
+        "platform": platform.platform(),
+        "dimensions": dim,
+    }
+
+
+def compare(previous_file: str, results: list[dict]):
+    with open(previous_file, encoding="utf-8") as f:
+        previous = {(r["name"], r["size"]): r["median"] for r in json.load(f)["results"]}
+    print(f"\nChange against {previous_file} (positive is slower):")
+    for result in results:
+        before = previous.get((result["name"], result["size"]))
+        if before:
+            change = (result["median"] - before) / before
+            print(f"{result['name']:<40} size {result['size']:>7}: {change:+8.1%}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100,1000,10000", help="corpus sizes, comma separated")
+    parser.add_argument("--dim", type=int, default=384, help="embedding dimensions")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark, the median is reported")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file for the results")
+    parser.add_argument("--compare", help="earlier JSON result file to compare with")
+    server = parser.add_mutually_exclusive_group()
+    server.add_argument("--ini", help="database.ini of an existing empty database (section postgresql)")
+    server.add_argument("--docker", action="store_true", help=f"start a {DOCKER_IMAGE} container")
+    parser.add_argument("--pg-bin", help="directory with initdb and pg_ctl for the local cluster")
+    args = parser.parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    if args.ini:
+        server_context = contextlib.nullcontext(args.ini)
+    elif args.docker:
+        server_context = docker_server(DOCKER_IMAGE)
+    else:
+        server_context = local_server(args.pg_bin)
+
+    with server_context as ini:
+        create_schema(ini, args.dim, apps=20)
+        results = run_benchmarks(ini, sizes, args.dim, args.repeat)
+        output = {"metadata": metadata(ini, args.dim), "results": results}
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(output, f, indent=2)
+    print(f"\nResults written to {args.output}")
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+-- Schema mimicking the production tables the NKDatabase helpers work on.
+-- {dim} is replaced with the embedding dimension by run_benchmarks.py
+CREATE EXTENSION IF NOT EXISTS vector;
+
+CREATE TABLE public.nkinitvalues (id text, debugmode boolean, name text, type_id int, value text);
+CREATE INDEX ON public.nkinitvalues (id, debugmode);
+
+CREATE SCHEMA nkgpt;
+CREATE TABLE nkgpt.items (
+    id text PRIMARY KEY, title text, description text, content text, url text, source text, document_id text,
+    embedding vector({dim})
+);
+CREATE TABLE nkgpt.sleeping_items (LIKE nkgpt.items INCLUDING ALL);
+CREATE TABLE nkgpt.vectors (
+    id text PRIMARY KEY, title text, description text, content text, url text, row_updated timestamptz,
+    embedding vector({dim})
+);
+
+CREATE PROCEDURE nkgpt.insert_nkpgt_item(
+    p_id text, p_title text, p_description text, p_content text, p_url text, p_source text, p_document_id text,
+    p_embedding vector
+) LANGUAGE sql AS $$
+    INSERT INTO nkgpt.sleeping_items VALUES (p_id, p_title, p_description, p_content, p_url, p_source, p_document_id, p_embedding)
+$$;
+CREATE PROCEDURE nkgpt.clean_sleeping_items() LANGUAGE sql AS $$ TRUNCATE nkgpt.sleeping_items $$;
+CREATE PROCEDURE nkgpt.change_active_tables() LANGUAGE plpgsql AS $$
+BEGIN
+    ALTER TABLE nkgpt.items RENAME TO items_switch;
+    ALTER TABLE nkgpt.sleeping_items RENAME TO items;
+    ALTER TABLE nkgpt.items_switch RENAME TO sleeping_items;
+END
+$$;
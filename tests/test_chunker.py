@@ -0,0 +1,71 @@
+from unittest import TestCase
+from NKDatabase.NKFile.chunker import chunk_document, chunk_documents, chunk_spans
+
+
+def count_words(text):
+    return len(text.split())
+
+
+class TestChunker(TestCase):
+    def setUp(self) -> None:
+        self.text = " ".join(f"ord{number}" for number in range(10))
+
+    def test_spans(self):
+        """
+        Testing if chunks hold at most max_tokens words and repeat overlap_tokens words
+        """
+        spans = chunk_spans(self.text, max_tokens=4, overlap_tokens=1, counter=count_words)
+        chunks = [self.text[start:end].split() for start, end in spans]
+        self.assertEqual([len(chunk) for chunk in chunks], [4, 4, 4])
+        self.assertEqual(chunks[0][-1], chunks[1][0])
+        self.assertEqual(chunks[-1][-1], "ord9")
+
+    def test_token_budget(self):
+        """
+        Testing if every chunk measured as a whole stays within max_tokens, also with the default counter
+        """
+        text = " ".join(f"ord{number}" for number in range(40))
+        chunks = chunk_document({"document_id": "d1", "content": text}, max_tokens=8, overlap_tokens=2)
+        token_sizes = [chunk["token_size"] for chunk in chunks]
+        self.assertLessEqual(max(token_sizes), 8)
+        self.assertTrue(chunks[-1]["content"].endswith("ord39"))
+
+    def test_long_word(self):
+        """
+        Testing if a word longer than max_tokens is cut into pieces within the budget
+        """
+        text = "kort " + "x" * 50 + " slut"
+        spans = chunk_spans(text, max_tokens=4, overlap_tokens=0)
+        pieces = [text[start:end] for start, end in spans]
+        self.assertEqual("".join(pieces).replace(" ", ""), text.replace(" ", ""))
+        self.assertTrue(all(len(piece) <= 16 for piece in pieces))
+
+    def test_short_document(self):
+        """
+        Testing if a short document becomes one chunk with a stable id
+        """
+        chunks = chunk_document({"document_id": "d1", "content": "kort tekst"}, counter=count_words)
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(chunks[0]["id"], "d1:0")
+        self.assertEqual(chunks[0]["content"], "kort tekst")
+        self.assertEqual(chunks[0]["token_size"], 2)
+
+    def test_stable_chunks(self):
+        """
+        Testing if chunking again gives the same ids and hashes
+        """
+        document = {"id": "d2", "title": "titel", "content": self.text}
+        first = chunk_document(document, max_tokens=3, overlap_tokens=0, counter=count_words)
+        second = chunk_document(document, max_tokens=3, overlap_tokens=0, counter=count_words)
+        self.assertEqual([(chunk["id"], chunk["chunk_hash"]) for chunk in first], [(chunk["id"], chunk["chunk_hash"]) for chunk in second])
+        self.assertEqual([chunk["id"] for chunk in first], ["d2:0", "d2:1", "d2:2", "d2:3"])
+        self.assertTrue(all(chunk["document_id"] == "d2" and chunk["title"] == "titel" for chunk in first))
+
+    def test_many_documents(self):
+        """
+        Testing if chunks of many documents come in document order
+        """
+        documents = [{"document_id": f"d{number}", "content": self.text} for number in range(20)]
+        chunks = list(chunk_documents(documents, max_tokens=5, overlap_tokens=0, counter=count_words, workers=4, prefetch=3))
+        self.assertEqual(len(chunks), 40)
+        self.assertEqual([chunk["id"] for chunk in chunks[:3]], ["d0:0", "d0:1", "d1:0"])
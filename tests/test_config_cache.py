@@ -0,0 +1,89 @@
+import threading
+from unittest import TestCase
+from NKDatabase.InitialValues.ConfigCache import ConfigCache
+
+
+class TestConfigCache(TestCase):
+    def setUp(self) -> None:
+        self.loads: list[str] = []
+
+        def load_values(appname: str, debugging: bool, ini_file: str) -> dict:
+            self.loads.append(appname)
+            return {"name": appname, "debugging": debugging}
+
+        def load_app_names(ini_file: str) -> set[str]:
+            self.loads.append(ini_file)
+            return {"nk-edoc-geocoding"}
+
+        self.cache = ConfigCache(load_values, load_app_names, ttl=60)
+
+    def test_served_from_memory(self):
+        """
+        Testing if a second lookup does not load again
+        """
+        first = self.cache.get_config("nk-edoc-geocoding")
+        second = self.cache.get_config("nk-edoc-geocoding")
+        self.assertEqual(first, second)
+        self.assertEqual(self.loads, ["nk-edoc-geocoding"])
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_debugging_is_part_of_key(self):
+        """
+        Testing if production and debugging values are cached separately
+        """
+        self.assertFalse(self.cache.get_config("nk-edoc-geocoding")["debugging"])
+        self.assertTrue(self.cache.get_config("nk-edoc-geocoding", debugging=True)["debugging"])
+
+    def test_expiry(self):
+        """
+        Testing if entries are loaded again after the ttl
+        """
+        self.cache.ttl = 0
+        self.cache.get_unique_app_names()
+        self.cache.get_unique_app_names()
+        self.assertEqual(len(self.loads), 2)
+
+    def test_invalidate_app(self):
+        """
+        Testing if invalidating an app only drops that app
+        """
+        self.cache.get_config("nk-edoc-geocoding")
+        self.cache.get_config("nk-other-app")
+        self.cache.invalidate("nk-other-app")
+        self.cache.get_config("nk-edoc-geocoding")
+        self.cache.get_config("nk-other-app")
+        self.assertEqual(self.loads, ["nk-edoc-geocoding", "nk-other-app", "nk-other-app"])
+
+    def test_returns_copies(self):
+        """
+        Testing if changing a returned value does not change the cache
+        """
+        self.cache.get_unique_app_names().add("something-else")
+        self.assertEqual(self.cache.get_unique_app_names(), {"nk-edoc-geocoding"})
+
+    def test_invalidate_during_load(self):
+        """
+        Testing if values loaded before an invalidate are returned but not cached
+        """
+        started = threading.Event()
+        release = threading.Event()
+        versions = iter(["old", "new"])
+
+        def slow_load_values(appname: str, debugging: bool, ini_file: str) -> dict:
+            version = next(versions)
+            if version == "old":
+                started.set()
+                release.wait(5)
+            return {"version": version}
+
+        cache = ConfigCache(slow_load_values, lambda ini_file: set(), ttl=60)
+        results = []
+        thread = threading.Thread(target=lambda: results.append(cache.get_config("nk-edoc-geocoding")))
+        thread.start()
+        self.assertTrue(started.wait(5))
+        cache.invalidate("nk-edoc-geocoding")
+        release.set()
+        thread.join()
+        self.assertEqual(results, [{"version": "old"}])
+        self.assertEqual(cache.get_config("nk-edoc-geocoding"), {"version": "new"})
+        self.assertEqual(cache.get_config("nk-edoc-geocoding"), {"version": "new"})
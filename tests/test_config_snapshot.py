@@ -0,0 +1,110 @@
+import os
+import tempfile
+import time
+from datetime import datetime
+from unittest import TestCase
+from NKDatabase.InitialValues.ConfigSnapshot import ConfigSnapshot, SnapshotRefresher, open_snapshot, write_snapshot
+from NKDatabase.InitialValues.InitialValues import Configuration
+
+
+class TestConfigSnapshot(TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "nkinitvalues.snapshot")
+        self.rows = [
+            {"id": "nk-edoc-geocoding", "debugmode": False, "name": "url", "type_id": 1, "value": "https://example.org"},
+            {"id": "nk-edoc-geocoding", "debugmode": False, "name": "retries", "type_id": 2, "value": "3"},
+            {"id": "nk-edoc-geocoding", "debugmode": False, "name": "since", "type_id": 8, "value": "31-01-2024"},
+            {"id": "nk-edoc-geocoding", "debugmode": True, "name": "url", "type_id": 1, "value": "http://localhost"},
+            {"id": "nk-edoc-geocoding", "debugmode": True, "name": "retries", "type_id": 2, "value": "1"},
+            {"id": "nk-edoc-geocoding", "debugmode": True, "name": "since", "type_id": 8, "value": "31-01-2024"},
+            {"id": "nk-edoc-geocoding", "debugmode": True, "name": "odd", "type_id": 99, "value": "x"},
+        ]
+        self.appnames = ["nk-edoc-geocoding", "nk-empty-app"]
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        """
+        Testing if the rows are decoded on lookup per app and debugmode
+        """
+        self.assertTrue(write_snapshot(self.filename, self.rows, self.appnames))
+        with ConfigSnapshot(self.filename) as snapshot:
+            self.assertEqual(len(snapshot), 4)
+            self.assertEqual(snapshot.app_names(), {"nk-edoc-geocoding", "nk-empty-app"})
+            self.assertEqual(
+                snapshot.get("nk-edoc-geocoding"),
+                {"url": "https://example.org", "retries": 3, "since": datetime(2024, 1, 31)},
+            )
+            self.assertEqual(snapshot.get("nk-edoc-geocoding", True)["retries"], 1)
+            self.assertIsNone(snapshot.get("nk-edoc-geocoding", True)["odd"])
+            self.assertEqual(snapshot.get("nk-empty-app"), {})
+            self.assertIsNone(snapshot.get("nk-unknown-app"))
+
+    def test_only_if_changed(self):
+        """
+        Testing if an unchanged snapshot is not written again, but its checked time is updated
+        """
+        write_snapshot(self.filename, self.rows, self.appnames)
+        with ConfigSnapshot(self.filename) as snapshot:
+            created = snapshot.created
+            time.sleep(0.01)
+            self.assertFalse(write_snapshot(self.filename, self.rows, self.appnames, only_if_changed=True))
+            self.assertEqual(snapshot.created, created)
+            self.assertGreater(snapshot.checked, created)
+            self.assertTrue(snapshot.is_current())
+        self.rows.append({"id": "nk-empty-app", "debugmode": False, "name": "retries", "type_id": 2, "value": "2"})
+        self.assertTrue(write_snapshot(self.filename, self.rows, self.appnames, only_if_changed=True))
+
+    def test_open_snapshot(self):
+        """
+        Testing if a replaced file is opened again and missing or damaged files give None
+        """
+        self.assertIsNone(open_snapshot(self.filename))
+        write_snapshot(self.filename, self.rows, self.appnames)
+        first = open_snapshot(self.filename)
+        self.assertIs(open_snapshot(self.filename), first)
+
+        self.rows.append({"id": "nk-empty-app", "debugmode": False, "name": "retries", "type_id": 2, "value": "2"})
+        write_snapshot(self.filename, self.rows, self.appnames)
+        self.assertEqual(open_snapshot(self.filename).get("nk-empty-app"), {"retries": 2})
+
+        with open(self.filename, "wb") as f:
+            f.write(b"not a snapshot")
+        self.assertIsNone(open_snapshot(self.filename))
+
+    def test_refresher(self):
+        """
+        Testing if a failing load leaves the existing snapshot in place
+        """
+        loads = [self.rows]
+
+        def load_rows():
+            return loads.pop()
+
+        refresher = SnapshotRefresher(self.filename, load_rows, appnames=self.appnames)
+        self.assertTrue(refresher.refresh())
+        self.assertFalse(refresher.refresh())
+        self.assertEqual((refresher.refreshes, refresher.failures), (1, 1))
+        self.assertEqual(open_snapshot(self.filename).get("nk-edoc-geocoding")["retries"], 3)
+
+    def test_configuration_from_snapshot(self):
+        """
+        Testing if Configuration loads an app in the snapshot without the database
+        """
+        write_snapshot(self.filename, self.rows, self.appnames)
+        config = Configuration("nk-edoc-geocoding", debugging=True, ini_file="missing.ini", snapshot_file=self.filename)
+        self.assertEqual(config.url, "http://localhost")
+        self.assertEqual(config.since, datetime(2024, 1, 31))
+
+    def test_max_age(self):
+        """
+        Testing if a snapshot that was not checked within max_age is not used
+        """
+        write_snapshot(self.filename, self.rows, self.appnames)
+        self.assertIsNotNone(open_snapshot(self.filename, max_age=60))
+        time.sleep(0.05)
+        self.assertIsNone(open_snapshot(self.filename, max_age=0.01))
+        write_snapshot(self.filename, self.rows, self.appnames, only_if_changed=True)
+        self.assertIsNotNone(open_snapshot(self.filename, max_age=0.01))
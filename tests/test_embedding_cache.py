@@ -0,0 +1,63 @@
+import os
+import tempfile
+from unittest import TestCase
+from NKDatabase.NKPostgres.EmbeddingCache import EmbeddingCache, seed_query, text_hash
+from NKDatabase.NKPostgres.VectorApps import get_vector_app
+
+
+class TestEmbeddingCache(TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "embeddings.sqlite")
+        self.calls = []
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def embed(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def test_compute_once(self):
+        """
+        Testing if only texts missing from the cache are embedded, once each
+        """
+        with EmbeddingCache(self.filename, model="test") as cache:
+            first = cache.get_or_compute(["a", "bb", "a"], self.embed)
+            second = cache.get_or_compute(["bb", "ccc"], self.embed)
+            self.assertEqual([list(vector) for vector in first], [[1.0, 1.0], [2.0, 1.0], [1.0, 1.0]])
+            self.assertEqual(list(second[1]), [3.0, 1.0])
+            self.assertEqual(self.calls, [["a", "bb"], ["ccc"]])
+            self.assertEqual((cache.hits, cache.misses), (1, 4))
+
+    def test_persistent_per_model(self):
+        """
+        Testing if embeddings survive reopening the file and are kept apart per model
+        """
+        with EmbeddingCache(self.filename, model="test") as cache:
+            cache.put("tekst", [0.5, 0.25])
+        with EmbeddingCache(self.filename, model="test") as cache:
+            self.assertEqual(list(cache.get("tekst")), [0.5, 0.25])
+        with EmbeddingCache(self.filename, model="other") as cache:
+            self.assertIsNone(cache.get("tekst"))
+            self.assertEqual(len(cache), 0)
+
+    def test_seeded_entry_found(self):
+        """
+        Testing if an embedding seeded under the server side hash of the embedded text is returned by get
+        """
+        with EmbeddingCache(self.filename, model="test") as cache:
+            self.assertEqual(cache.seed([(text_hash("tekst æøå"), [0.5, 0.25])]), 1)
+            self.assertEqual(list(cache.get("tekst æøå")), [0.5, 0.25])
+            self.assertEqual(list(cache.get_or_compute(["tekst æøå"], self.embed)[0]), [0.5, 0.25])
+            self.assertEqual((cache.seeded, self.calls), (1, []))
+
+    def test_seed_query(self):
+        """
+        Testing if seeding hashes the given text column of the active table and has no default column
+        """
+        query = seed_query(get_vector_app("nkgpt"), "embedded_text").as_string(None)
+        self.assertIn("sha256(convert_to(\"embedded_text\", 'UTF8'))", query)
+        self.assertIn('FROM "nkgpt"."items"', query)
+        with self.assertRaises(TypeError):
+            seed_query(get_vector_app("nkgpt"))
@@ -0,0 +1,51 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+from NKDatabase.NKFile.fileReader import iter_jsonfiles_in_directory, pool_workers, read_jsonfiles_in_directory
+
+
+class TestFileReader(TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        for number in range(25):
+            with open(os.path.join(self.directory.name, f"doc{number:02d}.json"), "w", encoding="utf-8") as f:
+                json.dump({"id": number, "content": "æøå"}, f)
+        with open(os.path.join(self.directory.name, "readme.txt"), "w") as f:
+            f.write("not json")
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_same_documents(self):
+        """
+        Testing if the batched reader returns the documents of read_jsonfiles_in_directory
+        """
+        expected = read_jsonfiles_in_directory(self.directory.name)
+        documents = [document for batch in iter_jsonfiles_in_directory(self.directory.name, batch_size=10) for document in batch]
+        self.assertEqual(documents, expected)
+        self.assertEqual(len(documents), 25)
+        self.assertEqual(documents[0]["content"], "æøå")
+
+    def test_batches(self):
+        """
+        Testing if the documents are yielded in batches of batch_size
+        """
+        batches = list(iter_jsonfiles_in_directory(self.directory.name, batch_size=10, workers=2, prefetch=3, json_backend="json"))
+        self.assertEqual([len(batch) for batch in batches], [10, 10, 5])
+
+    def test_filename(self):
+        """
+        Testing if every document knows its file
+        """
+        for batch in iter_jsonfiles_in_directory(self.directory.name):
+            for document in batch:
+                self.assertEqual(document["filename"], f"doc{document['id']:02d}.json")
+
+    def test_pool_workers(self):
+        """
+        Testing if an explicit worker count is kept and the default follows the executor defaults
+        """
+        self.assertEqual(pool_workers(3), 3)
+        self.assertEqual(pool_workers(None, use_processes=True), os.cpu_count() or 1)
+        self.assertEqual(pool_workers(None), min(32, (os.cpu_count() or 1) + 4))
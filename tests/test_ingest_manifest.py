@@ -0,0 +1,87 @@
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+from NKDatabase.NKPipeline.IngestPipeline import convert_files, load_manifest, save_manifest, scan_directory
+
+
+class TestIngestManifest(TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.manifest_file = os.path.join(self.directory.name, "manifest")
+        self.files = os.path.join(self.directory.name, "files")
+        os.mkdir(self.files)
+        for number in range(3):
+            self.write(f"doc{number}.json", {"id": number})
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def write(self, name, document):
+        with open(os.path.join(self.files, name), "w", encoding="utf-8") as f:
+            json.dump(document, f)
+
+    def test_new_files_changed(self):
+        """
+        Testing if every file is changed against an empty manifest
+        """
+        entries, changed, unchanged = scan_directory(self.files, load_manifest(self.manifest_file))
+        self.assertEqual(changed, ["doc0.json", "doc1.json", "doc2.json"])
+        self.assertEqual(unchanged, [])
+        self.assertEqual(len(entries["doc0.json"].sha256), 64)
+
+    def test_changed_file(self):
+        """
+        Testing if only the rewritten file is changed after saving the manifest, and ids are kept for the others
+        """
+        entries, _, _ = scan_directory(self.files, {})
+        for name, entry in entries.items():
+            entry.ids = [name]
+        save_manifest(self.manifest_file, entries)
+
+        self.write("doc1.json", {"id": "new"})
+        entries, changed, unchanged = scan_directory(self.files, load_manifest(self.manifest_file))
+        self.assertEqual(changed, ["doc1.json"])
+        self.assertEqual(unchanged, ["doc0.json", "doc2.json"])
+        self.assertEqual(entries["doc0.json"].ids, ["doc0.json"])
+        self.assertEqual(entries["doc1.json"].ids, [])
+
+    def test_touched_file(self):
+        """
+        Testing if a file with a new mtime but the same content is unchanged
+        """
+        entries, _, _ = scan_directory(self.files, {})
+        save_manifest(self.manifest_file, entries)
+        path = os.path.join(self.files, "doc2.json")
+        os.utime(path, ns=(0, 0))
+        _, changed, unchanged = scan_directory(self.files, load_manifest(self.manifest_file))
+        self.assertEqual(changed, [])
+        self.assertEqual(len(unchanged), 3)
+
+    def test_broken_file(self):
+        """
+        Testing if a file with bad json is left out and reported while the other files are converted
+        """
+        with open(os.path.join(self.files, "doc1.json"), "w", encoding="utf-8") as f:
+            f.write("{broken")
+        failed = {}
+
+        def convert(document):
+            return [{"id": document["id"], "title": "", "description": "", "content": "", "url": "", "source": "",
+                     "document_id": "", "embedding": "[0]"}]
+
+        with ThreadPoolExecutor(2) as executor:
+            converted = list(convert_files(executor, self.files, ["doc0.json", "doc1.json", "doc2.json"], convert, 2, failed))
+        self.assertEqual([name for name, _ in converted], ["doc0.json", "doc2.json"])
+        self.assertEqual(converted[1][1][0][0], 2)
+        self.assertEqual(list(failed), ["doc1.json"])
+
+    def test_manifest_mode(self):
+        """
+        Testing if the manifest gets the mode of a file written with open()
+        """
+        save_manifest(self.manifest_file, {})
+        plain = os.path.join(self.directory.name, "plain")
+        open(plain, "w").close()
+        self.assertEqual(os.stat(self.manifest_file).st_mode, os.stat(plain).st_mode)
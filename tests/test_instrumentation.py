@@ -0,0 +1,70 @@
+from unittest import TestCase
+from NKDatabase.NKPostgres.Instrumentation import Histogram, Instrumentation, fingerprint
+
+
+class TestInstrumentation(TestCase):
+    def test_fingerprint(self):
+        """
+        Testing if literals, whitespace and repeated VALUES rows are normalized
+        """
+        self.assertEqual(fingerprint("SELECT *  FROM t\n WHERE id = 'a''b' AND n = 42;"), "SELECT * FROM t WHERE id = ? AND n = ?")
+        self.assertEqual(
+            fingerprint("INSERT INTO t VALUES (%s, %s), (%s, %s), (%s, %s)"),
+            fingerprint("INSERT INTO t VALUES (%s, %s)"),
+        )
+
+    def test_histogram(self):
+        """
+        Testing if the histogram counts and estimates quantiles from its buckets
+        """
+        histogram = Histogram()
+        for seconds in [0.0001] * 90 + [0.3] * 10:
+            histogram.add(seconds)
+        self.assertEqual(histogram.count, 100)
+        self.assertEqual(histogram.quantile(0.5), 0.0005)
+        self.assertEqual(histogram.quantile(0.99), 0.3)
+
+    def test_trace(self):
+        """
+        Testing if traces are counted per fingerprint, errors and slow statements are recorded and listeners called
+        """
+        instrumentation = Instrumentation(slow_query_seconds=0.0, explain_slow=False)
+        events = []
+        instrumentation.add_listener(events.append)
+        with instrumentation.trace(None, "SELECT 1"):
+            pass
+        self.assertEqual(events, [])
+
+        instrumentation.enable()
+        for number in range(3):
+            with instrumentation.trace(None, f"SELECT {number}", operation="fetch_query"):
+                pass
+        with self.assertRaises(ValueError):
+            with instrumentation.trace(None, "SELECT 1"):
+                raise ValueError("broken")
+
+        stats = instrumentation.statistics()
+        self.assertEqual(len(stats), 1)
+        self.assertEqual((stats[0].fingerprint, stats[0].calls, stats[0].errors), ("SELECT ?", 4, 1))
+        self.assertEqual(len(events), 4)
+        self.assertTrue(all(event.slow for event in events))
+        self.assertEqual(events[-1].error, "ValueError: broken")
+
+    def test_logging_and_rows(self):
+        """
+        Testing if slow statements, listener errors and the report go to the logger and set_rows is counted
+        """
+        instrumentation = Instrumentation(slow_query_seconds=0.0, explain_slow=False)
+        instrumentation.enable()
+
+        def broken_listener(event):
+            raise RuntimeError("listener")
+
+        instrumentation.add_listener(broken_listener)
+        with self.assertLogs("NKDatabase.NKPostgres.Instrumentation", level="INFO") as logs:
+            with instrumentation.trace(None, "INSERT INTO t VALUES (%s)", operation="bulk") as trace:
+                trace.set_rows(500)
+            instrumentation.log_report()
+        self.assertEqual([record.levelname for record in logs.records], ["WARNING", "ERROR", "INFO"])
+        self.assertIn("Slow query", logs.records[0].getMessage())
+        self.assertEqual(instrumentation.statistics()[0].rows, 500)
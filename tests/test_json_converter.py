@@ -0,0 +1,95 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+from NKDatabase.NKFile.jsonConverter import jsonConvert, jsonConvertParallel, write_atomic
+
+
+def tag_transform(data, source_name):
+    return {"id": data["Id"], "source": source_name}
+
+
+class TestJsonConverter(TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.directory.name, "source")
+        self.target = os.path.join(self.directory.name, "target")
+        os.mkdir(self.source)
+        os.mkdir(self.target)
+        for number in range(10):
+            self.write(number, f"indhold nummer {number}")
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def write(self, number, content):
+        with open(os.path.join(self.source, f"doc{number}.json"), "w", encoding="utf-8") as f:
+            json.dump({"Id": number, "Content": content, "Embedding": "tekst æøå"}, f)
+
+    def read_target(self, directory):
+        documents = {}
+        for name in os.listdir(directory):
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                documents[name] = json.load(f)
+        return documents
+
+    def test_same_as_jsonConvert(self):
+        """
+        Testing if the parallel conversion writes the documents of jsonConvert
+        """
+        sequential = os.path.join(self.directory.name, "sequential")
+        os.mkdir(sequential)
+        jsonConvert(self.source, sequential, "test")
+        result = jsonConvertParallel(self.source, self.target, "test", workers=4)
+        self.assertEqual(result.converted, 10)
+        self.assertEqual(result.failures, [])
+        self.assertEqual(self.read_target(self.target), self.read_target(sequential))
+        self.assertEqual(self.read_target(self.target)["doc3.json"]["token_size"], 4)
+
+    def test_skip_mtime(self):
+        """
+        Testing if targets newer than their source are skipped
+        """
+        jsonConvertParallel(self.source, self.target, "test")
+        os.utime(os.path.join(self.source, "doc1.json"), ns=(2**62, 2**62))
+        result = jsonConvertParallel(self.source, self.target, "test")
+        self.assertEqual((result.converted, result.skipped), (1, 9))
+
+    def test_skip_hash(self):
+        """
+        Testing if identical targets are not rewritten
+        """
+        jsonConvertParallel(self.source, self.target, "test")
+        self.write(2, "nyt indhold")
+        result = jsonConvertParallel(self.source, self.target, "test", skip="hash")
+        self.assertEqual((result.converted, result.unchanged), (1, 9))
+
+    def test_transform_and_failures(self):
+        """
+        Testing if a custom transform is used and a broken file is reported without stopping the others
+        """
+        with open(os.path.join(self.source, "broken.json"), "w") as f:
+            f.write("{")
+        result = jsonConvertParallel(self.source, self.target, "tag", transform=tag_transform, use_processes=True, workers=2)
+        self.assertEqual(result.converted, 10)
+        self.assertEqual([name for name, _ in result.failures], ["broken.json"])
+        self.assertEqual(self.read_target(self.target)["doc4.json"], {"id": 4, "source": "tag"})
+        self.assertEqual([name for name in os.listdir(self.target) if name.endswith(".tmp")], [])
+
+    def test_write_atomic_mode(self):
+        """
+        Testing if an atomically written file gets the mode of a file written with open()
+        """
+        path = os.path.join(self.target, "written.json")
+        plain = os.path.join(self.source, "plain.json")
+        open(plain, "w").close()
+        write_atomic(path, b"{}")
+        self.assertEqual(os.stat(path).st_mode, os.stat(plain).st_mode)
+        self.assertEqual(os.listdir(self.target), ["written.json"])
+
+        previous = os.umask(0o077)
+        try:
+            write_atomic(path, b"[]")
+        finally:
+            os.umask(previous)
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
@@ -0,0 +1,177 @@
+import os
+import tempfile
+from contextlib import contextmanager
+from types import SimpleNamespace
+from unittest import TestCase
+
+import psycopg.errors
+from psycopg_pool import PoolTimeout
+
+from NKDatabase.NKPostgres.PostgreSQL import connection_kwargs
+from NKDatabase.NKPostgres.ReplicaRouter import ReplicaRouter, _Replica, replica_config, replica_options
+from NKDatabase.NKPostgres.Transactions import commit
+
+
+class TestReplicaRouter(TestCase):
+    config = {
+        "host": "primary",
+        "port": "5432",
+        "dbname": "nk",
+        "replica_hosts": "replica1, replica2:5433,",
+        "replica_strategy": "Round_Robin",
+        "replica_cooldown": "10",
+        "replica_fallback": "no",
+    }
+
+    def test_replica_options(self):
+        """
+        Testing if the replica_ keys are read and never passed on to psycopg
+        """
+        options = replica_options(self.config)
+        self.assertEqual(options["hosts"], ["replica1", "replica2:5433"])
+        self.assertEqual(options["strategy"], "round_robin")
+        self.assertEqual(options["cooldown"], 10.0)
+        self.assertFalse(options["fallback"])
+        self.assertNotIn("timeout", options)
+        self.assertEqual(connection_kwargs(self.config), {"host": "primary", "port": "5432", "dbname": "nk"})
+
+    def test_replica_config(self):
+        """
+        Testing if a replica replaces host and port of the primary configuration
+        """
+        self.assertEqual(replica_config(self.config, "replica1")["host"], "replica1")
+        self.assertEqual(replica_config(self.config, "replica1")["port"], "5432")
+        replica = replica_config(self.config, "replica2:5433")
+        self.assertEqual((replica["host"], replica["port"]), ("replica2", "5433"))
+        replica = replica_config(self.config, "[::1]:5434")
+        self.assertEqual((replica["host"], replica["port"]), ("::1", "5434"))
+        self.assertEqual(self.config["host"], "primary")
+
+
+class StubConnection:
+    def __init__(self, host: str, dbname: str = "nk"):
+        self.host = host
+        self.broken = False
+        self.info = SimpleNamespace(host=host, port=5432, dbname=dbname)
+
+    def commit(self):
+        pass
+
+
+class StubPool:
+    """Pool handing out StubConnections, or raising error when set"""
+
+    def __init__(self, host: str, error: Exception = None, max_size: int = 2):
+        self.host = host
+        self.error = error
+        self.max_size = max_size
+
+    @contextmanager
+    def connection(self, timeout=None):
+        if self.error is not None:
+            raise self.error
+        yield StubConnection(self.host)
+
+    def close(self):
+        pass
+
+
+class TestRouting(TestCase):
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        ini_file = os.path.join(directory.name, "database.ini")
+        with open(ini_file, "w") as f:
+            f.write("[postgresql]\nhost=primary\ndbname=nk\n")
+        self.router = self.make_router(ini_file)
+
+    def make_router(self, ini_file: str, **router_kwargs) -> ReplicaRouter:
+        router = ReplicaRouter(ini_file, **router_kwargs)
+        router.replicas = [_Replica(host, StubPool(host)) for host in ("replica1", "replica2", "replica3")]
+
+        @contextmanager
+        def primary_connection():
+            yield StubConnection("primary")
+
+        router.primary_connection = primary_connection
+        # commits of earlier tests in this thread would pin the reads
+        router.unpin()
+        self.ini_file = ini_file
+        return router
+
+    def read_host(self, router: ReplicaRouter = None) -> str:
+        with (router or self.router).read_connection() as conn:
+            return conn.host
+
+    def test_candidate_order(self):
+        """
+        Testing if round robin takes turns and least loaded prefers the replica with fewest borrowed connections
+        """
+        router = self.make_router(self.ini_file, strategy="round_robin")
+        self.assertEqual([self.read_host(router) for _ in range(4)], ["replica1", "replica2", "replica3", "replica1"])
+
+        self.router.replicas[0].in_use = 2
+        self.router.replicas[1].in_use = 1
+        self.assertEqual([replica.host for replica in self.router._candidates()], ["replica3", "replica2", "replica1"])
+
+    def test_cooldown(self):
+        """
+        Testing if a replica that cannot connect is skipped for the cooldown, and a saturated one only for the read
+        """
+        self.router.replicas[0].pool.error = PoolTimeout("couldn't get a connection")
+        self.assertEqual(self.read_host(), "replica2")
+        self.assertEqual(self.router.statistics()[0]["failures"], 1)
+        self.assertGreater(self.router.statistics()[0]["down"], 0)
+        self.assertNotIn("replica1", [replica.host for replica in self.router._candidates()])
+
+        self.router.replicas[1].in_use = self.router.replicas[1].pool.max_size
+        self.router.replicas[1].pool.error = PoolTimeout("couldn't get a connection")
+        self.assertEqual(self.read_host(), "replica3")
+        self.assertEqual(self.router.statistics()[1]["failures"], 0)
+
+    def test_query_errors(self):
+        """
+        Testing if errors inside the read block are raised without a cooldown, unless the connection broke
+        """
+        with self.assertRaises(psycopg.errors.LockNotAvailable):
+            with self.router.read_connection():
+                raise psycopg.errors.LockNotAvailable("lock timeout")
+        self.assertEqual(sum(stats["failures"] for stats in self.router.statistics()), 0)
+
+        with self.assertRaises(psycopg.OperationalError):
+            with self.router.read_connection() as conn:
+                conn.broken = True
+                raise psycopg.OperationalError("server closed the connection")
+        self.assertEqual(sum(stats["failures"] for stats in self.router.statistics()), 1)
+
+    def test_fallback(self):
+        """
+        Testing if reads go to the primary when every replica is down, or raise PoolTimeout without fallback
+        """
+        router = self.make_router(self.ini_file, fallback=False)
+        for replica in self.router.replicas + router.replicas:
+            replica.pool.error = psycopg.OperationalError("connection refused")
+        self.assertEqual(self.read_host(), "primary")
+        with self.assertRaises(PoolTimeout):
+            self.read_host(router)
+
+    def test_pinned_after_commit(self):
+        """
+        Testing if a commit of the helpers sends the reads of the caller to the primary until unpin
+        """
+        self.assertNotEqual(self.read_host(), "primary")
+        commit(StubConnection("primary"))
+        self.assertTrue(self.router.pinned())
+        self.assertEqual(self.read_host(), "primary")
+        self.router.unpin()
+        self.assertNotEqual(self.read_host(), "primary")
+
+    def test_pinned_per_database(self):
+        """
+        Testing if only commits on the primary database of the router pin its reads
+        """
+        commit(StubConnection("primary", dbname="other"))
+        commit(StubConnection("elsewhere"))
+        self.assertFalse(self.router.pinned())
+        commit(StubConnection("primary"))
+        self.assertTrue(self.router.pinned())
@@ -0,0 +1,88 @@
+from types import SimpleNamespace
+from unittest import TestCase
+
+import psycopg
+from psycopg.pq import TransactionStatus
+
+from NKDatabase.NKPostgres.PostgreSQL import _execute_select
+from NKDatabase.NKPostgres.StatementCache import (
+    StatementCache,
+    delete_statement,
+    insert_statement,
+    select_statement,
+    statement_cache,
+    update_statement,
+)
+
+
+class TestStatementCache(TestCase):
+    def setUp(self) -> None:
+        statement_cache.clear()
+
+    def test_quoted_statements(self):
+        """
+        Testing if table and column names are quoted and schema.table is split
+        """
+        self.assertEqual(
+            insert_statement("nkgpt.vectors", ["id", "title"]).as_string(None),
+            'INSERT INTO "nkgpt"."vectors" ("id", "title") VALUES (%s, %s)',
+        )
+        self.assertEqual(
+            update_statement("nkgpt.vectors", ["title"], ["id"]).as_string(None),
+            'UPDATE "nkgpt"."vectors" SET "title" = %s WHERE "id" = %s',
+        )
+        self.assertEqual(delete_statement("items", ["id"]).as_string(None), 'DELETE FROM "items" WHERE "id" = %s')
+        self.assertEqual(
+            select_statement("public", "nkinitvalues", ["id", "debugmode"]).as_string(None),
+            'SELECT * FROM "public"."nkinitvalues" WHERE "id" = %s AND "debugmode" = %s',
+        )
+
+    def test_reuse(self):
+        """
+        Testing if the same table, columns and conditions give the cached statement
+        """
+        first = select_statement("public", "nkinitvalues", ["id"])
+        self.assertIs(select_statement("public", "nkinitvalues", ("id",)), first)
+        self.assertIsNot(select_statement("public", "nkinitvalues", ["id"], ["name"]), first)
+        self.assertEqual((statement_cache.hits, statement_cache.misses), (1, 2))
+
+    def test_bounded(self):
+        """
+        Testing if the least recently used statement is dropped
+        """
+        cache = StatementCache(max_size=2)
+        cache.get(("a",), lambda: "a")
+        cache.get(("b",), lambda: "b")
+        cache.get(("a",), lambda: "a")
+        cache.get(("c",), lambda: "c")
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get(("b",), lambda: "rebuilt"), "rebuilt")
+
+
+class StaleCursor:
+    """Cursor whose first prepared statement fails like a SELECT * on an altered table"""
+
+    def __init__(self, status: TransactionStatus):
+        self.calls = []
+        self.connection = SimpleNamespace(info=SimpleNamespace(transaction_status=status), execute=self.calls.append)
+
+    def execute(self, query, params=None, prepare=None):
+        self.calls.append(query)
+        if len(self.calls) == 1:
+            self.connection.info.transaction_status = TransactionStatus.IDLE
+            raise psycopg.errors.FeatureNotSupported("cached plan must not change result type")
+
+
+class TestStalePlan(TestCase):
+    def test_retry(self):
+        """
+        Testing if a stale prepared SELECT is deallocated and run once more outside a transaction, and raised inside one
+        """
+        cursor = StaleCursor(TransactionStatus.IDLE)
+        _execute_select(cursor, "SELECT *", [])
+        self.assertEqual(cursor.calls, ["SELECT *", "DEALLOCATE ALL", "SELECT *"])
+
+        cursor = StaleCursor(TransactionStatus.INTRANS)
+        with self.assertRaises(psycopg.errors.FeatureNotSupported):
+            _execute_select(cursor, "SELECT *", [])
+        self.assertEqual(cursor.calls, ["SELECT *"])
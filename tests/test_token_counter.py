@@ -0,0 +1,55 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+from NKDatabase.NKFile.tokenCounter import CachedTokenCounter, approximate_token_count, count_tokens_in_directory
+
+
+class TestTokenCounter(TestCase):
+    def setUp(self) -> None:
+        self.calls = []
+
+        def count(text):
+            self.calls.append(text)
+            return len(text.split())
+
+        self.counter = CachedTokenCounter(count, cache_size=2)
+
+    def test_approximate(self):
+        """
+        Testing if the approximate counter rounds up characters / 4
+        """
+        self.assertEqual(approximate_token_count(""), 0)
+        self.assertEqual(approximate_token_count("abcd"), 1)
+        self.assertEqual(approximate_token_count("abcde"), 2)
+
+    def test_cache(self):
+        """
+        Testing if a text is only counted once and the least recently used count is evicted
+        """
+        self.assertEqual(self.counter("a b"), 2)
+        self.assertEqual(self.counter("a b"), 2)
+        self.counter("c")
+        self.counter("d")
+        self.counter("a b")
+        self.assertEqual(self.calls, ["a b", "c", "d", "a b"])
+        self.assertEqual((self.counter.hits, self.counter.misses), (1, 4))
+
+    def test_batch(self):
+        """
+        Testing if a batch only counts the texts missing from the cache
+        """
+        self.counter("a b")
+        self.assertEqual(self.counter.count_batch(["a b", "c d e"]), [2, 3])
+        self.assertEqual(self.calls, ["a b", "c d e"])
+
+    def test_directory(self):
+        """
+        Testing if the tokens of every file in a directory are counted
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            for number in range(3):
+                with open(os.path.join(directory, f"doc{number}.json"), "w", encoding="utf-8") as f:
+                    json.dump({"content": "ord " * number}, f)
+            counts = count_tokens_in_directory(directory, counter=self.counter, batch_size=2)
+        self.assertEqual(counts, {"doc0.json": 0, "doc1.json": 1, "doc2.json": 2})
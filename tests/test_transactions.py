@@ -0,0 +1,122 @@
+from contextlib import contextmanager
+from types import SimpleNamespace
+from unittest import TestCase
+
+import psycopg.errors
+from psycopg.pq import TransactionStatus
+
+from NKDatabase.NKPostgres.Transactions import (
+    _check_not_failed,
+    batch_savepoint,
+    commit,
+    in_unit_of_work,
+    rollback,
+    savepoint,
+    unit_of_work,
+    uses_savepoints,
+)
+
+
+class StubConnection:
+    """Connection recording transaction blocks, savepoints, commits and rollbacks like psycopg runs them"""
+
+    def __init__(self):
+        self.info = SimpleNamespace(transaction_status=TransactionStatus.IDLE, host="primary", port=5432, dbname="nk")
+        self.events: list[str] = []
+        self._depth = 0
+
+    @contextmanager
+    def transaction(self):
+        outermost = self._depth == 0
+        self.events.append("begin" if outermost else "savepoint")
+        self.info.transaction_status = TransactionStatus.INTRANS
+        self._depth += 1
+        try:
+            yield
+        except BaseException:
+            self.events.append("rollback" if outermost else "rollback to savepoint")
+            raise
+        else:
+            self.events.append("commit" if outermost else "release")
+        finally:
+            self._depth -= 1
+            if outermost:
+                self.info.transaction_status = TransactionStatus.IDLE
+
+    def execute(self, query, params=None):
+        self.events.append(query)
+
+    def commit(self):
+        self.events.append("commit")
+        self.info.transaction_status = TransactionStatus.IDLE
+
+    def rollback(self):
+        self.events.append("rollback")
+        self.info.transaction_status = TransactionStatus.IDLE
+
+
+class TestTransactions(TestCase):
+    def setUp(self) -> None:
+        self.conn = StubConnection()
+
+    def test_commit_once(self):
+        """
+        Testing if commit and rollback of the helpers are suppressed inside a unit of work, which commits once
+        """
+        with unit_of_work(self.conn):
+            self.assertTrue(in_unit_of_work(self.conn))
+            commit(self.conn)
+            rollback(self.conn)
+        self.assertFalse(in_unit_of_work(self.conn))
+        self.assertEqual(self.conn.events, ["begin", "commit"])
+        commit(self.conn)
+        rollback(self.conn)
+        self.assertEqual(self.conn.events, ["begin", "commit", "commit", "rollback"])
+
+    def test_nesting(self):
+        """
+        Testing if a nested unit of work becomes a savepoint and savepoints apply to the innermost unit only
+        """
+        with unit_of_work(self.conn):
+            self.assertFalse(uses_savepoints(self.conn))
+            with unit_of_work(self.conn, savepoints=True):
+                self.assertTrue(uses_savepoints(self.conn))
+                with savepoint(self.conn):
+                    pass
+            self.assertFalse(uses_savepoints(self.conn))
+            with batch_savepoint(self.conn):
+                pass
+        self.assertEqual(
+            self.conn.events, ["begin", "savepoint", "savepoint", "release", "release", "savepoint", "release", "commit"]
+        )
+
+    def test_pending_work_committed_first(self):
+        """
+        Testing if work pending on the connection is committed before the outermost unit starts
+        """
+        self.conn.info.transaction_status = TransactionStatus.INTRANS
+        with unit_of_work(self.conn, synchronous_commit=False):
+            pass
+        self.assertEqual(
+            self.conn.events, ["commit", "begin", "SELECT set_config('synchronous_commit', 'off', true)", "commit"]
+        )
+
+    def test_rollback_on_exception(self):
+        """
+        Testing if an exception in the block rolls the unit of work back and is raised
+        """
+        with self.assertRaises(KeyError):
+            with unit_of_work(self.conn):
+                raise KeyError("failed")
+        self.assertEqual(self.conn.events, ["begin", "rollback"])
+        self.assertFalse(in_unit_of_work(self.conn))
+
+    def test_failed_transaction(self):
+        """
+        Testing if a unit of work whose transaction failed raises InFailedSqlTransaction instead of committing
+        """
+        _check_not_failed(self.conn)
+        with self.assertRaises(psycopg.errors.InFailedSqlTransaction):
+            with unit_of_work(self.conn):
+                self.conn.info.transaction_status = TransactionStatus.INERROR
+        self.assertEqual(self.conn.events, ["begin", "rollback"])
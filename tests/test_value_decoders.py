@@ -0,0 +1,58 @@
+from datetime import datetime
+from unittest import TestCase
+from NKDatabase.InitialValues.InitialValues import get_parameter, get_parameter_value
+from NKDatabase.InitialValues.ValueDecoders import DECODERS, DateParser, register_decoder
+
+
+class TestValueDecoders(TestCase):
+    def setUp(self) -> None:
+        self.rows = [
+            ({"name": "text", "type_id": 1, "value": "abc"}, "abc"),
+            ({"name": "integer", "type_id": 2, "value": "42"}, 42),
+            ({"name": "float", "type_id": 3, "value": "0.5"}, 0.5),
+            ({"name": "flag", "type_id": 4, "value": "Ja"}, True),
+            ({"name": "flag", "type_id": 4, "value": "nej"}, False),
+            ({"name": "texts", "type_id": 5, "value": "a,b"}, ["a", "b"]),
+            ({"name": "integers", "type_id": 6, "value": "1, 2,3"}, [1, 2, 3]),
+            ({"name": "floats", "type_id": 7, "value": "1.5,2"}, [1.5, 2.0]),
+            ({"name": "date", "type_id": 8, "value": "01-02-2024"}, datetime(2024, 2, 1)),
+            ({"name": "date", "type_id": 8, "value": "2024-02-01 10:11:12"}, datetime(2024, 2, 1, 10, 11, 12)),
+        ]
+
+    def test_known_types(self):
+        """
+        Testing if every built in type_id decodes as before
+        """
+        for row, expected in self.rows:
+            self.assertEqual(get_parameter_value(row), expected)
+            self.assertEqual(get_parameter(row).value, expected)
+            self.assertEqual(get_parameter(row).parameter, row["name"])
+
+    def test_unknown_type(self):
+        """
+        Testing if an unknown type_id gives None
+        """
+        row = {"name": "unknown", "type_id": 999, "value": "x"}
+        self.assertIsNone(get_parameter_value(row))
+        self.assertIsNone(get_parameter(row))
+
+    def test_register_decoder(self):
+        """
+        Testing if a custom type_id can be added
+        """
+        register_decoder(100, lambda value: value[::-1])
+        try:
+            self.assertEqual(get_parameter_value({"name": "reversed", "type_id": 100, "value": "abc"}), "cba")
+        finally:
+            del DECODERS[100]
+
+    def test_date_parser_remembers_format(self):
+        """
+        Testing if the last working format is tried first and bad dates still raise
+        """
+        parser = DateParser(["%d-%m-%Y", "%Y-%m-%d"])
+        self.assertEqual(parser("2024-02-01"), datetime(2024, 2, 1))
+        self.assertEqual(parser("2024-03-01"), datetime(2024, 3, 1))
+        self.assertEqual(parser("01-04-2024"), datetime(2024, 4, 1))
+        with self.assertRaises(ValueError):
+            parser("not a date")
@@ -0,0 +1,49 @@
+from unittest import TestCase
+from NKDatabase.NKPostgres.VectorApps import get_vector_app
+from NKDatabase.NKPostgres.VectorSearch import FILTER_COLUMNS, _search_query, search, search_many
+
+
+class TestVectorSearch(TestCase):
+    def setUp(self) -> None:
+        self.app = get_vector_app("nkgpt")
+
+    def test_active_or_sleeping_table(self):
+        """
+        Testing if the active table is searched by default and the sleeping table when asked for
+        """
+        query, params = _search_query(self.app, "cosine", None, sleeping=False)
+        self.assertIn('FROM "nkgpt"."items" ORDER BY distance LIMIT %s', query.as_string(None))
+        self.assertEqual(params, [])
+        query, _ = _search_query(self.app, "cosine", None, sleeping=True)
+        self.assertIn('FROM "nkgpt"."sleeping_items"', query.as_string(None))
+
+    def test_metrics(self):
+        """
+        Testing if every metric uses its pgvector operator and an unknown metric raises ValueError
+        """
+        for metric, operator in (("cosine", "<=>"), ("l2", "<->"), ("inner_product", "<#>")):
+            query, _ = _search_query(self.app, metric, None, sleeping=False)
+            self.assertIn(f'"embedding" {operator} %s::vector AS distance', query.as_string(None))
+        with self.assertRaises(ValueError):
+            _search_query(self.app, "manhattan", None, sleeping=False)
+        with self.assertRaises(ValueError):
+            search(None, "nkgpt", [0.1, 0.2], metric="manhattan")
+
+    def test_filters(self):
+        """
+        Testing if filters become parameters, sequences use ANY and columns outside FILTER_COLUMNS are refused
+        """
+        query, params = _search_query(
+            self.app, "cosine", {"source": "web", "document_id": ("a", "b")}, sleeping=False
+        )
+        self.assertIn('WHERE "source" = %s AND "document_id" = ANY(%s) ORDER BY', query.as_string(None))
+        self.assertEqual(params, ["web", ["a", "b"]])
+        self.assertNotIn("content", FILTER_COLUMNS)
+        with self.assertRaises(ValueError):
+            _search_query(self.app, "cosine", {"content": "x; DROP TABLE items"}, sleeping=False)
+
+    def test_no_query_vectors(self):
+        """
+        Testing if searching without query vectors returns no results without using the connection
+        """
+        self.assertEqual(search_many(None, "nkgpt", []), [])
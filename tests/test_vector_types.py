@@ -0,0 +1,36 @@
+from array import array
+from unittest import TestCase
+from NKDatabase.NKPostgres.VectorTypes import Vector, vector_from_binary, vector_from_text, vector_to_binary
+
+
+class TestVectorTypes(TestCase):
+    def setUp(self) -> None:
+        self.values = [0.5, -1.25, 3.0]
+        # dimensions 3, unused 0, then big endian float4
+        self.encoded = bytes.fromhex("00030000" "3f000000" "bfa00000" "40400000")
+
+    def test_encode_sequence(self):
+        """
+        Testing if a list of numbers is encoded in the pgvector binary format
+        """
+        self.assertEqual(vector_to_binary(self.values), self.encoded)
+
+    def test_encode_buffer(self):
+        """
+        Testing if a float32 buffer wrapped in Vector is encoded the same way
+        """
+        self.assertEqual(vector_to_binary(Vector(array("f", self.values))), self.encoded)
+        self.assertEqual(vector_to_binary(Vector(memoryview(array("f", self.values)))), self.encoded)
+
+    def test_decode_binary(self):
+        """
+        Testing if the binary format decodes to the original values
+        """
+        self.assertEqual(list(vector_from_binary(self.encoded)), self.values)
+
+    def test_decode_text(self):
+        """
+        Testing if the text format decodes to the original values
+        """
+        self.assertEqual(list(vector_from_text(b"[0.5,-1.25,3]")), self.values)
+        self.assertEqual(len(vector_from_text(b"[]")), 0)